@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from db_configurator import get_api_cache_config
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+RESOURCE_KEYS = {
+                 'product': ('product', 'product_properties'),
+                 'category': ('category', 'subcategories_lvl1'),
+                 }
+
+
+def make_etag(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+class LRUCache:
+
+    def __init__(self, max_entries=10000, ttl=60):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = None
+        if self._ttl is not None:
+            expires_at = time.monotonic() + self._ttl
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache:
+
+    def __init__(self, url, ttl=300, prefix='oma:api:'):
+        if redis is None:
+            raise RuntimeError('The redis package is required for a shared '
+                               'API cache')
+        self._client = redis.Redis.from_url(url)
+        self._ttl = ttl
+        self._prefix = prefix
+
+    def get(self, key):
+        value = self._client.get(self._prefix + key)
+        if value is None:
+            return None
+        etag, _, body = value.partition(b'\n')
+        return etag.decode(), body
+
+    def set(self, key, value):
+        etag, body = value
+        self._client.set(self._prefix + key, etag.encode() + b'\n' + body,
+                         ex=self._ttl)
+
+    def delete(self, key):
+        self._client.delete(self._prefix + key)
+
+
+class ApiCache:
+
+    def __init__(self, local=None, shared=None):
+        self._local = local
+        self._shared = shared
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def _count(self, resource, counter):
+        with self._lock:
+            counters = self._counters.setdefault(resource,
+                                                 {'hits': 0, 'misses': 0,
+                                                  'invalidations': 0})
+            counters[counter] += 1
+
+    def _key(self, resource, resource_id):
+        return '{}:{}'.format(resource, resource_id)
+
+    def get(self, resource, resource_id):
+        key = self._key(resource, resource_id)
+        value = None
+        if self._local is not None:
+            value = self._local.get(key)
+        if value is None and self._shared is not None:
+            try:
+                value = self._shared.get(key)
+            except Exception as e:
+                logging.exception(e)
+            if value is not None and self._local is not None:
+                self._local.set(key, value)
+        self._count(resource, 'hits' if value is not None else 'misses')
+        return value
+
+    def set(self, resource, resource_id, body):
+        value = (make_etag(body), body)
+        key = self._key(resource, resource_id)
+        if self._local is not None:
+            self._local.set(key, value)
+        if self._shared is not None:
+            try:
+                self._shared.set(key, value)
+            except Exception as e:
+                logging.exception(e)
+        return value
+
+    def invalidate(self, resource, resource_ids):
+        for resource_id in resource_ids:
+            for cached_resource in RESOURCE_KEYS.get(resource, (resource,)):
+                key = self._key(cached_resource, resource_id)
+                if self._local is not None:
+                    self._local.delete(key)
+                if self._shared is not None:
+                    try:
+                        self._shared.delete(key)
+                    except Exception as e:
+                        logging.exception(e)
+                self._count(cached_resource, 'invalidations')
+
+    def stats(self):
+        with self._lock:
+            stats = {resource: dict(counters)
+                     for resource, counters in self._counters.items()}
+        for counters in stats.values():
+            lookups = counters['hits'] + counters['misses']
+            counters['hit_ratio'] = round(counters['hits'] / lookups, 3)\
+                if lookups else 0
+        if self._local is not None:
+            stats['local_entries'] = len(self._local)
+        return stats
+
+
+def api_cache_from_config(local=True):
+    config = get_api_cache_config()
+    local_cache = None
+    if local and config['MAX_ENTRIES']:
+        local_cache = LRUCache(config['MAX_ENTRIES'], config['TTL'])
+    shared_cache = None
+    if config['SHARED_URL']:
+        shared_cache = RedisCache(config['SHARED_URL'], config['SHARED_TTL'])
+    if local_cache is None and shared_cache is None:
+        return None
+    return ApiCache(local_cache, shared_cache)
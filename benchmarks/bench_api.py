@@ -0,0 +1,90 @@
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from sqlalchemy import create_engine
+from werkzeug.serving import make_server
+from db_connect import Postgres_db
+from db_configurator import get_pool_config
+from benchmarks.bench_indexes import populate
+from benchmarks.harness import add_database_argument, database_url
+
+
+def serve(app):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_port)
+
+
+def run_clients(base_url, threads, requests_per_thread):
+    local = threading.local()
+
+    def client(_):
+        if getattr(local, 'session', None) is None:
+            local.session = requests.Session()
+        for _ in range(requests_per_thread):
+            low = random.randint(0, 990)
+            response = local.session.get(
+                            '{}/products/property?low={}&high={}&limit=50'
+                            .format(base_url, low, low + 5))
+            response.raise_for_status()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(client, range(threads)))
+    elapsed = time.perf_counter() - started
+    return round(threads * requests_per_thread / elapsed, 1)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='API requests/sec against WSGI threads for a '
+                             'single connection and a connection pool')
+    add_database_argument(arg_parser)
+    arg_parser.add_argument('--products', type=int, default=100000)
+    arg_parser.add_argument('--threads', type=int, nargs='+',
+                            default=[1, 2, 4, 8, 16])
+    arg_parser.add_argument('--requests-per-thread', type=int, default=50)
+    args = arg_parser.parse_args()
+    db_url = database_url(args)
+    db = Postgres_db(db_url)
+    try:
+        db.drop_existing_tables_from_db()
+    except Exception:
+        pass
+    db.create_tables()
+    db.migrate()
+    db.close()
+    populate(create_engine(db_url), args.products, 1)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    import flask_app
+    flask_app.api_cache = None
+    pool_config = get_pool_config()
+    pools = {
+             'single_connection': dict(pool_config, SIZE=1, MAX_OVERFLOW=0),
+             'pool': pool_config,
+             }
+    report = {}
+    for name, config in pools.items():
+        flask_app.db = Postgres_db(db_url, config)
+        server, base_url = serve(flask_app.app)
+        report[name] = {
+                        'pool_size': config['SIZE'],
+                        'max_overflow': config['MAX_OVERFLOW'],
+                        'requests_per_sec': {
+                            threads: run_clients(base_url, threads,
+                                                 args.requests_per_thread)
+                            for threads in args.threads},
+                        }
+        server.shutdown()
+        flask_app.db.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
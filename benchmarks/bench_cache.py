@@ -0,0 +1,51 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from http_cache import ResponseCache
+from parse import Parser
+from benchmarks.local_site import SyntheticSite, LocalSiteServer
+
+
+def extract_all(parser, urls):
+    started = time.perf_counter()
+    for url in urls:
+        parser.get_product_parameters(url)
+    elapsed = time.perf_counter() - started
+    return {'pages': len(urls), 'seconds': round(elapsed, 3),
+            'pages_per_sec': round(len(urls) / elapsed, 1)}
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(directory) for name in names)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='Record product pages into the response cache '
+                             'and re-extract them offline')
+    arg_parser.add_argument('--pages', type=int, default=300)
+    arg_parser.add_argument('--latency', type=float, default=0.02)
+    arg_parser.add_argument('--cache-dir', default=None)
+    args = arg_parser.parse_args()
+    cache_dir = args.cache_dir or tempfile.mkdtemp(prefix='oma-cache-')
+    site = SyntheticSite(products_per_lvl2=args.pages)
+    with LocalSiteServer(site, latency=args.latency) as server:
+        urls = [server.base_url + path
+                for path in list(site.product_paths())[:args.pages]]
+        record = extract_all(Parser(base_url=server.base_url,
+                                    cache=ResponseCache(cache_dir)), urls)
+    replay = extract_all(Parser(cache=ResponseCache(cache_dir,
+                                                    mode='replay')), urls)
+    print(json.dumps({
+                      'cache_dir': cache_dir,
+                      'cache_bytes': directory_size(cache_dir),
+                      'record': record,
+                      'replay_offline': replay,
+                      }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
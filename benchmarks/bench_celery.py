@@ -0,0 +1,65 @@
+import argparse
+import json
+import threading
+import time
+import oma_celery
+from benchmarks.harness import (add_database_argument, database_url,
+                                make_downloader, seed_product_urls)
+from benchmarks.local_site import SyntheticSite, LocalSiteServer
+
+
+def run_workers(db_url, base_url, workers):
+    def work(worker_number):
+        oma_celery._local.downloader = make_downloader(
+                                        db_url, base_url,
+                                        worker_id='bench-{}'.format(
+                                                            worker_number),
+                                        concurrency=4, per_host_limit=4)
+        while oma_celery.dispatch_products() > 0:
+            pass
+        oma_celery._local.downloader.close()
+
+    threads = [threading.Thread(target=work, args=(number,))
+               for number in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='Stage-3 Celery pipeline throughput (eager mode)')
+    add_database_argument(arg_parser)
+    arg_parser.add_argument('--products-per-lvl2', type=int, default=50)
+    arg_parser.add_argument('--latency', type=float, default=0.02)
+    arg_parser.add_argument('--workers', type=int, nargs='+',
+                            default=[1, 2, 4, 8])
+    arg_parser.add_argument('--chunk-size', type=int, default=20)
+    args = arg_parser.parse_args()
+    db_url = database_url(args)
+    oma_celery.app.conf.update(task_always_eager=True,
+                               broker_url='memory://')
+    oma_celery.celery_config.update(CHUNK_SIZE=args.chunk_size,
+                                    CHUNKS_PER_DISPATCH=1,
+                                    RATE_LIMIT=None)
+    site = SyntheticSite(products_per_lvl2=args.products_per_lvl2)
+    with LocalSiteServer(site, latency=args.latency) as server:
+        for workers in args.workers:
+            download = seed_product_urls(db_url, server.base_url)
+            elapsed = run_workers(db_url, server.base_url, workers)
+            parsed = download.count_parsed_products()
+            download.close()
+            print(json.dumps({
+                              'workers': workers,
+                              'products': parsed,
+                              'seconds': round(elapsed, 3),
+                              'products_per_minute': round(parsed * 60 /
+                                                           elapsed),
+                              }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import create_engine, text
+from benchmarks.harness import add_database_argument, database_url
+from benchmarks.harness import make_downloader
+from benchmarks.local_site import SyntheticSite, LocalSiteServer
+
+
+STAGE3_MODES = ('pipeline', 'concurrent')
+ROW_COUNT_QUERIES = {
+    'stage1': """SELECT (SELECT COUNT(*) FROM categories) +
+                        (SELECT COUNT(*) FROM subcategories_lvl1) +
+                        (SELECT COUNT(*) FROM subcategories_lvl2)""",
+    'stage2': """SELECT COUNT(*) FROM products""",
+    'stage3': """SELECT (SELECT COUNT(*) FROM products
+                         WHERE parsed_at IS NOT NULL) +
+                        (SELECT COUNT(*) FROM product_properties) +
+                        (SELECT COUNT(*) FROM product_properties_compact)""",
+}
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def _current_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class StageMonitor:
+
+    def __init__(self, interval=0.05):
+        self._interval = interval
+        self._stop = threading.Event()
+        self._sampler = None
+        self.peak_rss = 0
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, _current_rss())
+            self._stop.wait(self._interval)
+
+    def __enter__(self):
+        self._self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        self._children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._started = time.perf_counter()
+        self.peak_rss = _current_rss()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_seconds = time.perf_counter() - self._started
+        self._stop.set()
+        self._sampler.join()
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.cpu_seconds = (self_usage.ru_utime + self_usage.ru_stime -
+                            self._self_usage.ru_utime -
+                            self._self_usage.ru_stime)
+        self.children_cpu_seconds = (children_usage.ru_utime +
+                                     children_usage.ru_stime -
+                                     self._children_usage.ru_utime -
+                                     self._children_usage.ru_stime)
+
+
+def count_rows(engine, stage):
+    with engine.connect() as connection:
+        return connection.execute(text(ROW_COUNT_QUERIES[stage])).scalar()
+
+
+def run_stage(engine, server, stage, func):
+    rows_before = count_rows(engine, stage)
+    pages_before = server.requests_served
+    with StageMonitor() as monitor:
+        func()
+    pages = server.requests_served - pages_before
+    rows = count_rows(engine, stage) - rows_before
+    wall = monitor.wall_seconds
+    return {
+            'wall_seconds': round(wall, 3),
+            'pages': pages,
+            'pages_per_sec': round(pages / wall, 1) if wall else 0,
+            'db_rows': rows,
+            'db_rows_per_sec': round(rows / wall, 1) if wall else 0,
+            'cpu_seconds': round(monitor.cpu_seconds, 3),
+            'children_cpu_seconds': round(monitor.children_cpu_seconds, 3),
+            'peak_rss_mb': round(monitor.peak_rss / 1024 ** 2, 1),
+            }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(__file__))\
+                         .decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    site = SyntheticSite.for_product_count(args.products,
+                                           cross_listed=args.cross_listed)
+    db_url = database_url(args)
+    engine = create_engine(db_url)
+    report = {
+              'commit': _git_commit(),
+              'started_at': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'cpu_count': os.cpu_count(),
+              'site': {
+                       'products': site.product_count,
+                       'listings': site.listing_count,
+                       'lvl2_subcategories': site.lvl2_count,
+                       'latency': args.latency,
+                       },
+              'stage3_mode': args.stage3,
+              'stages': {},
+              }
+    with LocalSiteServer(site, latency=args.latency) as server:
+        download = make_downloader(db_url, server.base_url,
+                                   create_new_tables=True,
+                                   concurrency=args.concurrency,
+                                   per_host_limit=args.concurrency)
+        stages = report['stages']
+        stages['stage1'] = run_stage(engine, server, 'stage1',
+                                     download.parse_main_catalog_page_single_run)
+
+        def stage2():
+            while download.parse_product_url_from_subcats_lvl2_concurrently(
+                                                        args.stage2_batch):
+                pass
+
+        def stage3():
+            if args.stage3 == 'pipeline':
+                while download.parse_products_pipeline(
+                                    args.stage3_batch,
+                                    fetch_workers=args.concurrency,
+                                    parse_workers=args.parse_workers)\
+                                    ['fetch']['items']:
+                    pass
+            else:
+                while download.parse_products_parameters_concurrently(
+                                                        args.stage3_batch):
+                    pass
+
+        stages['stage2'] = run_stage(engine, server, 'stage2', stage2)
+        stages['stage3'] = run_stage(engine, server, 'stage3', stage3)
+        download.close()
+    return report
+
+
+def compare(paths):
+    reports = []
+    for path in paths:
+        with open(path) as f:
+            reports.append(json.load(f))
+    base = reports[0]
+    comparison = {}
+    for report, path in zip(reports[1:], paths[1:]):
+        comparison[path] = {
+            stage: {metric: round(values[metric] /
+                                  base['stages'][stage][metric], 3)
+                    if base['stages'][stage][metric] else None
+                    for metric in ('pages_per_sec', 'db_rows_per_sec',
+                                   'cpu_seconds', 'peak_rss_mb')}
+            for stage, values in report['stages'].items()}
+    return {'baseline': paths[0], 'ratios': comparison}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='End-to-end crawl of a synthetic oma.by: '
+                             'pages/sec, DB rows/sec, CPU time and peak RSS '
+                             'per stage')
+    add_database_argument(arg_parser)
+    arg_parser.add_argument('--products', type=int, default=100000)
+    arg_parser.add_argument('--latency', type=float, default=0.0)
+    arg_parser.add_argument('--cross-listed', type=float, default=0.0,
+                            help='fraction of each subcategory also listed '
+                                 'on its neighbour\'s first page')
+    arg_parser.add_argument('--concurrency', type=int, default=8)
+    arg_parser.add_argument('--parse-workers', type=int, default=None)
+    arg_parser.add_argument('--stage2-batch', type=int, default=50)
+    arg_parser.add_argument('--stage3-batch', type=int, default=2000)
+    arg_parser.add_argument('--stage3', choices=STAGE3_MODES,
+                            default='pipeline')
+    arg_parser.add_argument('--output', default=None,
+                            help='JSON file for the report (defaults to '
+                                 'benchmarks/results/e2e-<commit>.json)')
+    arg_parser.add_argument('--compare', nargs='+', metavar='REPORT',
+                            help='print metric ratios of saved reports '
+                                 'against the first one instead of running')
+    args = arg_parser.parse_args()
+    if args.compare:
+        print(json.dumps(compare(args.compare), indent=2))
+        return
+    report = run(args)
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, 'e2e-{}.json'.format(
+                                            report['commit'] or 'unknown'))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import json
+import time
+from parse import Parser
+from benchmarks.local_site import SyntheticSite, LocalSiteServer
+
+
+def measure(base_url, urls, concurrency, per_host_limit):
+    parser = Parser(base_url=base_url, concurrency=concurrency,
+                    per_host_limit=per_host_limit)
+    results = []
+
+    def collect(url, result, error):
+        results.append(error is None and result[1] == 200)
+
+    started = time.perf_counter()
+    parser.fetcher.run(parser.async_get_product_parameters, urls, collect)
+    elapsed = time.perf_counter() - started
+    return {
+            'concurrency': concurrency,
+            'per_host_limit': per_host_limit,
+            'pages': len(results),
+            'ok': sum(results),
+            'seconds': round(elapsed, 3),
+            'pages_per_sec': round(len(results) / elapsed, 1),
+            }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='Stage-3 fetch throughput against a local site')
+    arg_parser.add_argument('--pages', type=int, default=200)
+    arg_parser.add_argument('--latency', type=float, default=0.05)
+    arg_parser.add_argument('--concurrency', type=int, nargs='+',
+                            default=[1, 2, 4, 8, 16, 32])
+    arg_parser.add_argument('--per-host-limit', type=int, default=None)
+    args = arg_parser.parse_args()
+    site = SyntheticSite(products_per_lvl2=args.pages)
+    with LocalSiteServer(site, latency=args.latency) as server:
+        urls = [server.base_url + path
+                for path in list(site.product_paths())[:args.pages]]
+        for concurrency in args.concurrency:
+            per_host_limit = args.per_host_limit or concurrency
+            print(json.dumps(measure(server.base_url, urls, concurrency,
+                                     per_host_limit)))
+
+
+if __name__ == '__main__':
+    main()
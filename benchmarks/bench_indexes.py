@@ -0,0 +1,124 @@
+import argparse
+import json
+from sqlalchemy import create_engine, text
+from db_connect import Postgres_db
+from benchmarks.harness import add_database_argument, database_url
+
+
+HOT_QUERIES = {
+    'claim_unparsed_products': """SELECT id FROM products
+                                  WHERE parsed_at IS NULL
+                                  AND deleted_at IS NULL
+                                  AND (lease_expires_at IS NULL
+                                  OR lease_expires_at < NOW())
+                                  ORDER BY id LIMIT 50""",
+    'claim_unparsed_subcats_lvl2': """SELECT id FROM subcategories_lvl2
+                                      WHERE parsed_at IS NULL
+                                      AND (lease_expires_at IS NULL
+                                      OR lease_expires_at < NOW())
+                                      ORDER BY id LIMIT 10""",
+    'lvl2_by_name': """SELECT id FROM subcategories_lvl2
+                       WHERE name='Section 1234' LIMIT 1""",
+    'product_properties': """SELECT * FROM product_properties
+                             WHERE product_id=123456
+                             AND deleted_at IS NULL""",
+    'products_by_price': """SELECT * FROM products
+                            WHERE price BETWEEN 100 AND 101
+                            AND deleted_at IS NULL""",
+    'products_by_name': """SELECT * FROM products
+                           WHERE name::text LIKE '%uct 12345%'""",
+    'products_by_url': """SELECT 1 FROM products
+                          WHERE url='/product/54321/'""",
+}
+
+
+def populate(engine, products, properties_per_product):
+    lvl2_count = max(products // 100, 1)
+    statements = [
+        """INSERT INTO categories (name)
+           SELECT 'Category ' || n FROM generate_series(1, 10) AS n""",
+        """INSERT INTO subcategories_lvl1 (name, category_id)
+           SELECT 'Group ' || n, n % 10 + 1
+           FROM generate_series(1, 100) AS n""",
+        """INSERT INTO subcategories_lvl2 (name, url, subcat_lvl1_id,
+                                          parsed_at)
+           SELECT 'Section ' || n, '/catalog/section-' || n || '/',
+                  n % 100 + 1,
+                  CASE WHEN n % 10 = 0 THEN NULL ELSE NOW() END
+           FROM generate_series(1, :lvl2_count) AS n""",
+        """INSERT INTO products (url, name, price, parsed_at, subcat_lvl2_id)
+           SELECT '/product/' || n || '/', 'Product ' || n,
+                  (n % 99900) / 100.0,
+                  CASE WHEN n % 20 = 0 THEN NULL ELSE NOW() END,
+                  n % :lvl2_count + 1
+           FROM generate_series(1, :products) AS n""",
+        """INSERT INTO product_properties (name, value, product_id)
+           SELECT 'Property ' || p, 'Value ' || (n + p) % 7, n
+           FROM generate_series(1, :products) AS n,
+                generate_series(1, :properties_per_product) AS p""",
+    ]
+    with engine.begin() as connection:
+        for statement in statements:
+            connection.execute(text(statement),
+                               lvl2_count=lvl2_count, products=products,
+                               properties_per_product=properties_per_product)
+        connection.execute(text('ANALYZE'))
+
+
+def _node_types(plan):
+    types = [plan['Node Type'] +
+             (' on ' + plan['Index Name'] if 'Index Name' in plan else '')]
+    for child in plan.get('Plans', []):
+        types.extend(_node_types(child))
+    return types
+
+
+def explain(engine):
+    report = {}
+    with engine.connect() as connection:
+        for name, query in HOT_QUERIES.items():
+            row = connection.execute(text('EXPLAIN (ANALYZE, FORMAT JSON) ' +
+                                          query)).fetchone()
+            plan = row[0][0]
+            report[name] = {
+                            'execution_ms': plan['Execution Time'],
+                            'nodes': _node_types(plan['Plan']),
+                            }
+    return report
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='EXPLAIN ANALYZE of hot queries before and '
+                             'after the index migrations')
+    add_database_argument(arg_parser)
+    arg_parser.add_argument('--products', type=int, default=200000)
+    arg_parser.add_argument('--properties-per-product', type=int, default=8)
+    args = arg_parser.parse_args()
+    db_url = database_url(args)
+    db = Postgres_db(db_url)
+    try:
+        db.drop_existing_tables_from_db()
+    except Exception:
+        pass
+    db.create_tables()
+    db.migrate(target_version=2)
+    engine = create_engine(db_url)
+    populate(engine, args.products, args.properties_per_product)
+    before = explain(engine)
+    applied = db.migrate()
+    with engine.begin() as connection:
+        connection.execute(text('ANALYZE'))
+    after = explain(engine)
+    db.close()
+    print(json.dumps({
+                      'products': args.products,
+                      'applied_migrations': applied,
+                      'queries': {name: {'before': before[name],
+                                         'after': after[name]}
+                                  for name in HOT_QUERIES},
+                      }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
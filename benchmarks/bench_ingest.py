@@ -0,0 +1,92 @@
+import argparse
+import json
+import logging
+import time
+import requests
+from sqlalchemy import create_engine
+from db_connect import Postgres_db
+from benchmarks.bench_api import serve
+from benchmarks.bench_indexes import populate
+from benchmarks.harness import add_database_argument, database_url
+
+
+def make_products(count, properties_per_product, offset=0):
+    return [{
+             'url': '/partner/product/{}/'.format(n),
+             'subcat_lvl2_id': n % 10 + 1,
+             'name': 'Товар {}'.format(n),
+             'price': round(n % 99900 / 100, 2),
+             'product_units': 'шт',
+             'description': 'Описание товара {}'.format(n),
+             'image_url': '/images/{}.jpg'.format(n),
+             'is_trend': n % 7 == 0,
+             'characteristics': {'Свойство {}'.format(p): 'Значение {}'
+                                 .format((n + p) % 7)
+                                 for p in range(properties_per_product)},
+             } for n in range(offset, offset + count)]
+
+
+def per_item(session, base_url, products):
+    started = time.perf_counter()
+    for product in products:
+        session.post('{}/product'.format(base_url),
+                     json=dict(product, parent='Section 1')).raise_for_status()
+    return len(products) / (time.perf_counter() - started)
+
+
+def bulk(session, base_url, products):
+    body = '\n'.join(json.dumps(product, ensure_ascii=False)
+                     for product in products).encode()
+    started = time.perf_counter()
+    response = session.post('{}/products/bulk'.format(base_url), data=body,
+                            headers={'Content-Type': 'application/x-ndjson'})
+    response.raise_for_status()
+    elapsed = time.perf_counter() - started
+    summary = response.json()
+    return {
+            'products_per_sec': round(len(products) / elapsed),
+            'created': summary['created'],
+            'updated': summary['updated'],
+            }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='Products/sec through POST /product versus '
+                             'POST /products/bulk')
+    add_database_argument(arg_parser)
+    arg_parser.add_argument('--products', type=int, default=50000)
+    arg_parser.add_argument('--per-item-products', type=int, default=500)
+    arg_parser.add_argument('--properties-per-product', type=int, default=8)
+    args = arg_parser.parse_args()
+    db_url = database_url(args)
+    db = Postgres_db(db_url)
+    try:
+        db.drop_existing_tables_from_db()
+    except Exception:
+        pass
+    db.create_tables()
+    db.migrate()
+    db.close()
+    populate(create_engine(db_url), 1000, 0)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    import flask_app
+    flask_app.api_cache = None
+    flask_app.db = Postgres_db(db_url)
+    server, base_url = serve(flask_app.app)
+    session = requests.Session()
+    products = make_products(args.products, args.properties_per_product)
+    report = {
+              'per_item_products_per_sec': round(per_item(
+                    session, base_url,
+                    make_products(args.per_item_products, 0, -10 ** 6))),
+              'bulk_insert': bulk(session, base_url, products),
+              'bulk_resend': bulk(session, base_url, products),
+              }
+    server.shutdown()
+    flask_app.db.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import json
+import logging
+import random
+import time
+import requests
+from sqlalchemy import create_engine
+from db_connect import Postgres_db
+from benchmarks.bench_api import serve
+from benchmarks.bench_indexes import populate
+from benchmarks.harness import add_database_argument, database_url
+
+
+def n_plus_one(session, base_url, product_ids):
+    for product_id in product_ids:
+        session.get('{}/products/{}'.format(base_url,
+                                            product_id)).raise_for_status()
+        session.get('{}/products/{}/properties'
+                    .format(base_url, product_id)).raise_for_status()
+
+
+def multi_get(session, base_url, product_ids):
+    session.get('{}/products'.format(base_url),
+                params={'ids': ','.join(map(str, product_ids)),
+                        'include': 'properties'}).raise_for_status()
+
+
+def batch_post(session, base_url, product_ids):
+    session.post('{}/products/batch'.format(base_url),
+                 json={'ids': product_ids}).raise_for_status()
+
+
+def measure(fetch, session, base_url, products, page_size, repeat):
+    timings = []
+    for _ in range(repeat):
+        product_ids = random.sample(range(1, products + 1), page_size)
+        started = time.perf_counter()
+        fetch(session, base_url, product_ids)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+            'p50_ms': round(timings[len(timings) // 2] * 1000, 1),
+            'max_ms': round(timings[-1] * 1000, 1),
+            }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='Latency of a product listing page fetched '
+                             'item by item versus in one batched call')
+    add_database_argument(arg_parser)
+    arg_parser.add_argument('--products', type=int, default=100000)
+    arg_parser.add_argument('--properties-per-product', type=int, default=8)
+    arg_parser.add_argument('--page-sizes', type=int, nargs='+',
+                            default=[50, 500])
+    arg_parser.add_argument('--repeat', type=int, default=10)
+    args = arg_parser.parse_args()
+    db_url = database_url(args)
+    db = Postgres_db(db_url)
+    try:
+        db.drop_existing_tables_from_db()
+    except Exception:
+        pass
+    db.create_tables()
+    db.migrate()
+    db.close()
+    populate(create_engine(db_url), args.products, args.properties_per_product)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    import flask_app
+    flask_app.api_cache = None
+    flask_app.db = Postgres_db(db_url)
+    server, base_url = serve(flask_app.app)
+    session = requests.Session()
+    report = {}
+    for page_size in args.page_sizes:
+        report[page_size] = {
+            name: measure(fetch, session, base_url, args.products, page_size,
+                          args.repeat)
+            for name, fetch in (('n_plus_one', n_plus_one),
+                                ('multi_get', multi_get),
+                                ('batch_post', batch_post))}
+    server.shutdown()
+    flask_app.db.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
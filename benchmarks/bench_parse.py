@@ -0,0 +1,76 @@
+import argparse
+import glob
+import json
+import os
+import time
+import tracemalloc
+from parse import Parser
+from benchmarks.local_site import SyntheticSite
+
+
+CONFIGURATIONS = [
+                  ('html.parser', False),
+                  ('html.parser', True),
+                  ('lxml', False),
+                  ('lxml', True),
+                  ]
+
+
+def load_corpus(corpus_dir, pages):
+    if corpus_dir is not None:
+        paths = sorted(glob.glob(os.path.join(corpus_dir, '*.html')))
+        corpus = []
+        for path in paths[:pages]:
+            with open(path, 'r', encoding='utf-8') as f:
+                corpus.append(f.read())
+        return corpus
+    site = SyntheticSite()
+    return [site.product_page(product_id) for product_id in range(pages)]
+
+
+def measure(corpus, parser_backend, restrict_product_parse, reference):
+    parser = Parser(parser_backend=parser_backend,
+                    restrict_product_parse=restrict_product_parse)
+    started = time.perf_counter()
+    results = [parser.parse_product_html(html) for html in corpus]
+    elapsed = time.perf_counter() - started
+    peak = 0
+    for html in corpus:
+        tracemalloc.start()
+        parser.parse_product_html(html)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    mismatches = 0
+    if reference is not None:
+        mismatches = sum(result != expected
+                         for result, expected in zip(results, reference))
+    report = {
+              'backend': parser_backend,
+              'restrict_product_parse': restrict_product_parse,
+              'pages': len(corpus),
+              'ms_per_page': round(elapsed * 1000 / len(corpus), 3),
+              'peak_memory_kb_per_page': round(peak / 1024, 1),
+              'mismatches': mismatches,
+              }
+    return report, results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='Product page parsing speed per backend')
+    arg_parser.add_argument('--corpus', default=None,
+                            help='directory with saved product *.html pages')
+    arg_parser.add_argument('--pages', type=int, default=300)
+    args = arg_parser.parse_args()
+    corpus = load_corpus(args.corpus, args.pages)
+    reference = None
+    for parser_backend, restrict_product_parse in CONFIGURATIONS:
+        report, results = measure(corpus, parser_backend,
+                                  restrict_product_parse, reference)
+        if reference is None:
+            reference = results
+        print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import argparse
+import json
+from benchmarks.harness import (add_database_argument, database_url,
+                                seed_product_urls)
+from benchmarks.local_site import SyntheticSite, LocalSiteServer
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='Stage-3 fetch/parse/write pipeline throughput')
+    add_database_argument(arg_parser)
+    arg_parser.add_argument('--products-per-lvl2', type=int, default=50)
+    arg_parser.add_argument('--latency', type=float, default=0.02)
+    arg_parser.add_argument('--fetch-workers', type=int, default=8)
+    arg_parser.add_argument('--parse-workers', type=int, default=None)
+    arg_parser.add_argument('--queue-size', type=int, default=64)
+    args = arg_parser.parse_args()
+    site = SyntheticSite(products_per_lvl2=args.products_per_lvl2)
+    with LocalSiteServer(site, latency=args.latency) as server:
+        download = seed_product_urls(database_url(args), server.base_url)
+        stats = download.parse_products_pipeline(
+                                site.product_count,
+                                fetch_workers=args.fetch_workers,
+                                parse_workers=args.parse_workers,
+                                queue_size=args.queue_size)
+        stats['parsed_products'] = download.count_parsed_products()
+        download.close()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import json
+import random
+import time
+from sqlalchemy import create_engine, text
+from db_connect import Postgres_db
+from benchmarks.bench_indexes import populate
+from benchmarks.harness import add_database_argument, database_url
+
+
+SIZE_QUERY = """SELECT pg_total_relation_size('product_properties'),
+                pg_total_relation_size('products'),
+                pg_total_relation_size('property_names')"""
+
+
+def relation_sizes(engine):
+    with engine.connect() as connection:
+        eav, products, names = connection.execute(text(SIZE_QUERY)).fetchone()
+    return {
+            'product_properties_mb': round(eav / 1024 ** 2, 2),
+            'products_mb': round(products / 1024 ** 2, 2),
+            'property_names_mb': round(names / 1024 ** 2, 2),
+            }
+
+
+def latency(db, products, lookups):
+    ids = [random.randint(1, products) for _ in range(lookups)]
+    report = {}
+    for name in ('get_product_properties', 'get_product_with_properties'):
+        method = getattr(db, name)
+        timings = []
+        for product_id in ids:
+            started = time.perf_counter()
+            method(product_id)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        report[name] = {
+                        'p50_ms': round(timings[len(timings) // 2] * 1000, 3),
+                        'p99_ms': round(timings[int(len(timings) * 0.99)] *
+                                        1000, 3),
+                        }
+    return report
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='Storage size and read latency of EAV rows '
+                             'versus compact JSONB properties')
+    add_database_argument(arg_parser)
+    arg_parser.add_argument('--products', type=int, default=100000)
+    arg_parser.add_argument('--properties-per-product', type=int, default=8)
+    arg_parser.add_argument('--lookups', type=int, default=1000)
+    args = arg_parser.parse_args()
+    db_url = database_url(args)
+    db = Postgres_db(db_url, property_storage='eav')
+    try:
+        db.drop_existing_tables_from_db()
+    except Exception:
+        pass
+    db.create_tables()
+    db.migrate()
+    engine = create_engine(db_url)
+    populate(engine, args.products, args.properties_per_product)
+    with engine.connect().execution_options(
+                                isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text('VACUUM FULL ANALYZE products'))
+    eav_sizes = relation_sizes(engine)
+    eav_latency = latency(db, args.products, args.lookups)
+    db.compact_properties(drop_eav=False)
+    with engine.connect().execution_options(
+                                isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text('VACUUM FULL ANALYZE products'))
+    compact_sizes = relation_sizes(engine)
+    compact_db = Postgres_db(db_url, property_storage='jsonb')
+    compact_latency = latency(compact_db, args.products, args.lookups)
+    print(json.dumps({
+                      'products': args.products,
+                      'properties_per_product': args.properties_per_product,
+                      'eav': dict(eav_sizes, **eav_latency),
+                      'jsonb': dict(compact_sizes, **compact_latency),
+                      }, indent=2))
+    compact_db.close()
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
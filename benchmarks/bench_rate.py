@@ -0,0 +1,96 @@
+import argparse
+import json
+import logging
+import time
+from metrics import FETCH_RETRIES
+from parse import Parser
+from rate_control import AIMDController, RetryPolicy
+from benchmarks.local_site import SyntheticSite, LocalSiteServer
+
+
+MODES = ('fixed', 'fixed-retry', 'adaptive')
+
+
+def _retries():
+    return sum(sample.value for metric in FETCH_RETRIES.collect()
+               for sample in metric.samples
+               if sample.name.endswith('_total'))
+
+
+def make_parser(mode, base_url, args):
+    retry_policy = None
+    rate_controller = None
+    if mode != 'fixed':
+        retry_policy = RetryPolicy(args.max_retries, args.backoff_base,
+                                   args.backoff_max)
+    if mode == 'adaptive':
+        rate_controller = AIMDController(initial=args.initial_concurrency,
+                                         maximum=args.concurrency)
+    return Parser(base_url=base_url, concurrency=args.concurrency,
+                  per_host_limit=args.concurrency,
+                  retry_policy=retry_policy,
+                  rate_controller=rate_controller)
+
+
+def run(mode, site, args):
+    with LocalSiteServer(site, latency=args.latency,
+                         max_in_flight=args.max_in_flight,
+                         retry_after=args.retry_after,
+                         overload_latency=args.overload_latency) as server:
+        parser = make_parser(mode, server.base_url, args)
+        urls = ['{}{}'.format(server.base_url, path)
+                for path in site.product_paths()]
+        statuses = {}
+
+        def count(url, result, error):
+            key = 'error' if error is not None else str(result[1])
+            statuses[key] = statuses.get(key, 0) + 1
+
+        retries_before = _retries()
+        started = time.perf_counter()
+        parser.fetcher.run(parser.fetcher.fetch, urls, count)
+        elapsed = time.perf_counter() - started
+        report = {
+                  'wall_seconds': round(elapsed, 3),
+                  'pages_ok': statuses.get('200', 0),
+                  'pages_ok_per_sec': round(statuses.get('200', 0) / elapsed,
+                                            1),
+                  'final_statuses': statuses,
+                  'requests_sent': server.requests_served,
+                  'requests_throttled': server.requests_throttled,
+                  'retries': int(_retries() - retries_before),
+                  }
+        if parser.rate_controller is not None:
+            report['controller'] = parser.rate_controller.stats()
+    return report
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='Fetch throughput and 429 count against a '
+                             'throttling synthetic oma.by: fixed '
+                             'concurrency versus the AIMD rate controller')
+    arg_parser.add_argument('--products', type=int, default=2000)
+    arg_parser.add_argument('--concurrency', type=int, default=16)
+    arg_parser.add_argument('--initial-concurrency', type=int, default=2)
+    arg_parser.add_argument('--max-in-flight', type=int, default=4,
+                            help='server answers 429 above this many '
+                                 'concurrent requests')
+    arg_parser.add_argument('--retry-after', type=int, default=None)
+    arg_parser.add_argument('--latency', type=float, default=0.01)
+    arg_parser.add_argument('--overload-latency', type=float, default=0.005,
+                            help='extra server latency per concurrent request')
+    arg_parser.add_argument('--max-retries', type=int, default=5)
+    arg_parser.add_argument('--backoff-base', type=float, default=0.05)
+    arg_parser.add_argument('--backoff-max', type=float, default=2.0)
+    arg_parser.add_argument('--modes', nargs='+', choices=MODES,
+                            default=list(MODES))
+    args = arg_parser.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+    site = SyntheticSite.for_product_count(args.products)
+    report = {mode: run(mode, site, args) for mode in args.modes}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
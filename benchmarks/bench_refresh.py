@@ -0,0 +1,53 @@
+import argparse
+import json
+import random
+import time
+from benchmarks.harness import (add_database_argument, database_url,
+                                seed_product_urls)
+from benchmarks.local_site import SyntheticSite, LocalSiteServer
+
+
+def refresh_all(download):
+    totals = {'claimed': 0, 'checked': 0, 'changed': 0}
+    started = time.perf_counter()
+    while True:
+        result = download.refresh_products(200)
+        if result['claimed'] == 0:
+            break
+        for key in totals:
+            totals[key] += result[key]
+    totals['seconds'] = round(time.perf_counter() - started, 3)
+    return totals
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='Incremental refresh: conditional GETs and '
+                             'content hashes')
+    add_database_argument(arg_parser)
+    arg_parser.add_argument('--products-per-lvl2', type=int, default=50)
+    arg_parser.add_argument('--changed-fraction', type=float, default=0.02)
+    args = arg_parser.parse_args()
+    site = SyntheticSite(products_per_lvl2=args.products_per_lvl2)
+    with LocalSiteServer(site) as server:
+        download = seed_product_urls(database_url(args), server.base_url)
+        while download.parse_products_parameters_concurrently(200):
+            pass
+        first = refresh_all(download)
+        download.schedule_full_refresh()
+        changed = random.sample(range(site.product_count),
+                                int(site.product_count *
+                                    args.changed_fraction))
+        site.touch(changed)
+        second = refresh_all(download)
+        download.close()
+    print(json.dumps({
+                      'products': site.product_count,
+                      'touched_on_site': len(changed),
+                      'first_refresh': first,
+                      'second_refresh': second,
+                      }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+import serialize
+from serialize import RowSet
+
+
+COLUMNS = ('id', 'url', 'name', 'price', 'units', 'description',
+           'image_url', 'is_trend', 'parsed_at', 'subcat_lvl2_id',
+           'deleted_at')
+
+
+class StaticResult:
+
+    def __init__(self, columns, rows):
+        self._columns = columns
+        self._rows = rows
+
+    def keys(self):
+        return list(self._columns)
+
+    def fetchall(self):
+        return self._rows
+
+
+def make_rows(count):
+    parsed_at = datetime(2020, 5, 1, 12, 0, 0)
+    return [(n, '/product/{}/'.format(n), 'Product {}'.format(n),
+             Decimal(n % 99900) / 100, 'шт', 'Description of product {}'
+             .format(n), '/images/{}.jpg'.format(n), n % 7 == 0,
+             parsed_at + timedelta(seconds=n), n % 500 + 1, None)
+            for n in range(1, count + 1)]
+
+
+def legacy_serialize(result):
+    row_proxy_object = result.fetchall()
+    list_ = []
+    for obj in row_proxy_object:
+        list_.append({column_name: str(column_value) for column_name,
+                      column_value in zip(result.keys(), obj)})
+    return json.dumps(list_).encode()
+
+
+def row_set_serialize(result):
+    return RowSet.from_result(result).to_json()
+
+
+def measure(serializer, rows, repeat):
+    result = StaticResult(COLUMNS, rows)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        payload = serializer(result)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    serializer(result)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best = min(timings)
+    return {
+            'rows_per_sec': round(len(rows) / best),
+            'seconds': round(best, 4),
+            'peak_alloc_mb': round(peak / 1024 ** 2, 2),
+            'payload_bytes': len(payload),
+            }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='Row serialization throughput and allocations')
+    arg_parser.add_argument('--rows', type=int, nargs='+',
+                            default=[10000, 100000])
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--encoder', choices=('orjson', 'json'),
+                            default='orjson',
+                            help='json forces the stdlib column encoder')
+    args = arg_parser.parse_args()
+    if args.encoder == 'json':
+        serialize.orjson = None
+    report = {'encoder': 'orjson' if serialize.orjson is not None
+              else 'json'}
+    for count in args.rows:
+        rows = make_rows(count)
+        report[count] = {
+                         'legacy': measure(legacy_serialize, rows,
+                                           args.repeat),
+                         'row_set': measure(row_set_serialize, rows,
+                                            args.repeat),
+                         }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
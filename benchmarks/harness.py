@@ -0,0 +1,32 @@
+from db_configurator import get_config_string
+from downloader import Downloader
+from parse import Parser
+
+
+def add_database_argument(arg_parser):
+    arg_parser.add_argument('--db', default=None,
+                            help='SQLAlchemy URL of a scratch database '
+                                 '(defaults to config.json); its tables '
+                                 'are dropped and recreated')
+
+
+def database_url(args):
+    if args.db is not None:
+        return args.db
+    return get_config_string()
+
+
+def make_downloader(db_url, base_url, create_new_tables=False, **kwargs):
+    parser = Parser(base_url=base_url,
+                    concurrency=kwargs.pop('concurrency', 10),
+                    per_host_limit=kwargs.pop('per_host_limit', 10))
+    return Downloader(db_url, create_new_tables=create_new_tables,
+                      parser=parser, **kwargs)
+
+
+def seed_product_urls(db_url, base_url):
+    download = make_downloader(db_url, base_url, create_new_tables=True)
+    download.parse_main_catalog_page_single_run()
+    while download.parse_product_url_from_subcats_lvl2_concurrently(50):
+        pass
+    return download
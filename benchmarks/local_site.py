@@ -0,0 +1,278 @@
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+
+
+class SyntheticSite:
+
+    @classmethod
+    def for_product_count(cls, products, categories=10, lvl1_per_category=10,
+                          products_per_page=20, cross_listed=0.0):
+        lvl2_count = max(products // 100, 1)
+        lvl2_per_lvl1 = max(-(-lvl2_count // (categories * lvl1_per_category)),
+                            1)
+        lvl2_count = categories * lvl1_per_category * lvl2_per_lvl1
+        return cls(categories, lvl1_per_category, lvl2_per_lvl1,
+                   max(-(-products // lvl2_count), 1), products_per_page,
+                   cross_listed)
+
+    def __init__(self, categories=2, lvl1_per_category=2, lvl2_per_lvl1=2,
+                 products_per_lvl2=40, products_per_page=20,
+                 cross_listed=0.0):
+        self.categories = categories
+        self.lvl1_per_category = lvl1_per_category
+        self.lvl2_per_lvl1 = lvl2_per_lvl1
+        self.products_per_lvl2 = products_per_lvl2
+        self.products_per_page = products_per_page
+        self.cross_listed = cross_listed
+        self.revisions = {}
+
+    def touch(self, product_ids):
+        for product_id in product_ids:
+            self.revisions[product_id] = self.revisions.get(product_id, 0) + 1
+
+    @property
+    def lvl2_count(self):
+        return self.categories * self.lvl1_per_category * self.lvl2_per_lvl1
+
+    @property
+    def product_count(self):
+        return self.lvl2_count * self.products_per_lvl2
+
+    def lvl2_paths(self):
+        for lvl2_index in range(self.lvl2_count):
+            yield '/catalog/section-{}/'.format(lvl2_index)
+
+    def product_paths(self):
+        for product_id in range(self.product_count):
+            yield '/product/{}/'.format(product_id)
+
+    def page_count(self, lvl2_index):
+        pages, rest = divmod(self.products_per_lvl2, self.products_per_page)
+        return max(pages + (1 if rest else 0), 1)
+
+    def catalog_page(self):
+        sections = []
+        lvl2_index = 0
+        for cat in range(self.categories):
+            items = []
+            for lvl1 in range(self.lvl1_per_category):
+                links = []
+                for lvl2 in range(self.lvl2_per_lvl1):
+                    links.append('<a class="section-submenu-sublink" '
+                                 'href="/catalog/section-{}/">Section '
+                                 '{}</a>'.format(lvl2_index, lvl2_index))
+                    lvl2_index += 1
+                items.append('<div class="catalog-all-item">'
+                             '<div class="accordion-item_title">'
+                             '<a href="#">Group {}-{}</a></div>'
+                             '<div class="section-submenu">{}</div>'
+                             '</div>'.format(cat, lvl1, ''.join(links)))
+            sections.append('<section class="bordered-section '
+                            'js-accordion-group"><h2>Category {}</h2>'
+                            '{}</section>'.format(cat, ''.join(items)))
+        return self._page('Catalog', ''.join(sections))
+
+    def lvl2_page(self, lvl2_index, page=1):
+        pages = self.page_count(lvl2_index)
+        buttons = ''
+        if pages > 1:
+            links = ['<a href="/catalog/section-{}/?PAGEN_1={}">{}</a>'
+                     .format(lvl2_index, number, number)
+                     for number in range(1, pages + 1)]
+            buttons = ('<div class="btn-combo">{}<div class="hide">{}</div>'
+                       '</div>'.format(''.join(links[:3]),
+                                       ''.join(links[3:])))
+        first = (lvl2_index * self.products_per_lvl2 +
+                 (page - 1) * self.products_per_page)
+        last = min(first + self.products_per_page,
+                   (lvl2_index + 1) * self.products_per_lvl2)
+        cards = ['<div class="product-item"><div class="product-item_img-box">'
+                 '<a class="no-border-product" href="/product/{}/">'
+                 '<img src="/upload/{}.jpg"></a></div></div>'
+                 .format(product_id, product_id)
+                 for product_id in self._listed_products(lvl2_index, page,
+                                                         first, last)]
+        body = '{}<div class="catalog-grid">{}</div>'.format(buttons,
+                                                             ''.join(cards))
+        return self._page('Section {}'.format(lvl2_index), body)
+
+    def _listed_products(self, lvl2_index, page, first, last):
+        product_ids = list(range(first, last))
+        shared = int(self.products_per_lvl2 * self.cross_listed)
+        if page == 1 and shared and self.lvl2_count > 1:
+            neighbour = (lvl2_index + 1) % self.lvl2_count
+            start = neighbour * self.products_per_lvl2
+            product_ids.extend(range(start, start + shared))
+        return product_ids
+
+    @property
+    def listing_count(self):
+        shared = int(self.products_per_lvl2 * self.cross_listed)
+        if self.lvl2_count < 2:
+            shared = 0
+        return self.product_count + self.lvl2_count * shared
+
+    def product_page(self, product_id):
+        properties = ''.join('<li class="params-block_list-item">'
+                             '<span class="param-item_name">Property {}'
+                             '</span><span class="param-item_value-col">\n\t'
+                             'Value {}\n\t</span></li>'
+                             .format(number, (product_id + number) % 7)
+                             for number in range(8))
+        body = ('<div class="page-title"><h1>Product {id}</h1></div>'
+                '<div class="slider-w-preview">'
+                '<img src="/upload/{id}.jpg"></div>'
+                '<div class="product-info-box">'
+                '<div class="product-info-box_price">\n {price},'
+                '<small>{fraction:02d}</small>'
+                '<span class="product-unit">шт</span></div></div>'
+                '<article class="catalog-item-description-txt_content">\n'
+                'Description of product {id}.   Long   text\n with spaces.'
+                '\n</article>'
+                '<ul class="params-block">{properties}</ul>'
+                .format(id=product_id,
+                        price=(product_id + self.revisions.get(product_id, 0))
+                        % 900 + 1,
+                        fraction=product_id % 100, properties=properties))
+        return self._page('Product {}'.format(product_id), body)
+
+    def _page(self, title, body):
+        filler = '<div class="footer-menu">{}</div>'.format(
+                 ''.join('<a href="/info/{}/">Info {}</a>'.format(i, i)
+                         for i in range(60)))
+        return ('<!DOCTYPE html><html><head><meta charset="utf-8">'
+                '<title>{}</title></head><body><header></header>'
+                '<main>{}</main>{}</body></html>'.format(title, body, filler))
+
+    def render(self, path, query):
+        if path == '/catalog':
+            return self.catalog_page()
+        if path.startswith('/catalog/section-'):
+            lvl2_index = int(path.strip('/').split('-')[-1])
+            if lvl2_index >= self.lvl2_count:
+                return None
+            page = int(query.get('PAGEN_1', ['1'])[0])
+            return self.lvl2_page(lvl2_index, page)
+        if path.startswith('/product/'):
+            product_id = int(path.strip('/').split('/')[-1])
+            if product_id >= self.product_count:
+                return None
+            return self.product_page(product_id)
+        return None
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+    requests_served = 0
+    requests_throttled = 0
+    in_flight = 0
+    max_in_flight = None
+    _count_lock = threading.Lock()
+
+    def count_request(self):
+        with self._count_lock:
+            self.requests_served += 1
+
+    def enter(self):
+        with self._count_lock:
+            if (self.max_in_flight is not None and
+                    self.in_flight >= self.max_in_flight):
+                self.requests_throttled += 1
+                return None
+            self.in_flight += 1
+            return self.in_flight
+
+    def leave(self):
+        with self._count_lock:
+            self.in_flight -= 1
+
+
+def _make_handler(site, latency, retry_after, overload_latency):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.server.count_request()
+            in_flight = self.server.enter()
+            if in_flight is None:
+                self.send_response(429)
+                if retry_after is not None:
+                    self.send_header('Retry-After', str(retry_after))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            try:
+                self._respond(in_flight)
+            finally:
+                self.server.leave()
+
+        def _respond(self, in_flight):
+            delay = latency + overload_latency * (in_flight - 1)
+            if delay:
+                time.sleep(delay)
+            parts = urlsplit(self.path)
+            html = site.render(parts.path, parse_qs(parts.query))
+            if html is None:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = html.encode('utf-8')
+            etag = '"{}"'.format(hashlib.sha1(body).hexdigest()[:16])
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class LocalSiteServer:
+
+    def __init__(self, site, latency=0.0, host='127.0.0.1', port=0,
+                 max_in_flight=None, retry_after=None, overload_latency=0.0):
+        self._server = _ThreadingHTTPServer((host, port),
+                                            _make_handler(site, latency,
+                                                          retry_after,
+                                                          overload_latency))
+        self._server.max_in_flight = max_in_flight
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+
+    @property
+    def requests_served(self):
+        return self._server.requests_served
+
+    @property
+    def requests_throttled(self):
+        return self._server.requests_throttled
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
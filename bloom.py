@@ -0,0 +1,61 @@
+import hashlib
+import math
+from db_configurator import get_crawler_config
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate=0.001):
+        if capacity <= 0:
+            raise ValueError('capacity must be positive')
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1')
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._size = max(int(math.ceil(-capacity * math.log(error_rate) /
+                                       math.log(2) ** 2)), 8)
+        self._hash_count = max(int(round(self._size / capacity *
+                                         math.log(2))), 1)
+        self._bits = bytearray((self._size + 7) // 8)
+        self._count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16)\
+                        .digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + number * second) % self._size
+                for number in range(self._hash_count)]
+
+    def add(self, item):
+        added = False
+        for position in self._positions(item):
+            byte, bit = divmod(position, 8)
+            if not self._bits[byte] & (1 << bit):
+                self._bits[byte] |= 1 << bit
+                added = True
+        if added:
+            self._count += 1
+        return added
+
+    def __contains__(self, item):
+        for position in self._positions(item):
+            byte, bit = divmod(position, 8)
+            if not self._bits[byte] & (1 << bit):
+                return False
+        return True
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def size_bytes(self):
+        return len(self._bits)
+
+
+def url_filter_from_config():
+    config = get_crawler_config()
+    if not config['URL_FILTER_CAPACITY']:
+        return None
+    return BloomFilter(config['URL_FILTER_CAPACITY'],
+                       config['URL_FILTER_ERROR_RATE'])
@@ -12,3 +12,119 @@ def get_config_string():
     db_config = '{}://{}:{}@{}/{}'.format(db_type, admin_name, admin_password,
                                           db_location, db_name)
     return db_config
+
+
+POOL_DEFAULTS = {
+    'SIZE': 5,
+    'MAX_OVERFLOW': 10,
+    'PRE_PING': True,
+    'RECYCLE': 1800,
+    'TIMEOUT': 30,
+}
+
+
+def get_pool_config():
+    pool_config = dict(POOL_DEFAULTS)
+    try:
+        with open('config.json', 'r') as f:
+            config = json.load(f)
+        pool_config.update(config.get('POOL', {}))
+    except FileNotFoundError:
+        pass
+    return pool_config
+
+
+CELERY_DEFAULTS = {
+    'BROKER_URL': 'amqp://localhost//',
+    'DISPATCH_INTERVAL': 5.0,
+    'CHUNK_SIZE': 20,
+    'CHUNKS_PER_DISPATCH': 5,
+    'PREFETCH_MULTIPLIER': 1,
+    'RATE_LIMIT': None,
+    'WRITE_BATCH_SIZE': 50,
+    'FACET_REFRESH_INTERVAL': 300.0,
+}
+
+
+def get_celery_config():
+    celery_config = dict(CELERY_DEFAULTS)
+    try:
+        with open('config.json', 'r') as f:
+            config = json.load(f)
+        celery_config.update(config.get('CELERY', {}))
+    except FileNotFoundError:
+        pass
+    return celery_config
+
+
+API_CACHE_DEFAULTS = {
+    'MAX_ENTRIES': 10000,
+    'TTL': 60,
+    'SHARED_URL': None,
+    'SHARED_TTL': 300,
+}
+
+
+def get_api_cache_config():
+    api_cache_config = dict(API_CACHE_DEFAULTS)
+    try:
+        with open('config.json', 'r') as f:
+            config = json.load(f)
+        api_cache_config.update(config.get('API_CACHE', {}))
+    except FileNotFoundError:
+        pass
+    return api_cache_config
+
+
+def get_property_storage():
+    try:
+        with open('config.json', 'r') as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return 'eav'
+    return config.get('PROPERTY_STORAGE', 'eav')
+
+
+METRICS_DEFAULTS = {
+    'PORT': 9105,
+    'ADDRESS': '0.0.0.0',
+    'QUEUE_DEPTH': True,
+}
+
+
+def get_metrics_config():
+    metrics_config = dict(METRICS_DEFAULTS)
+    try:
+        with open('config.json', 'r') as f:
+            config = json.load(f)
+        metrics_config.update(config.get('METRICS', {}))
+    except FileNotFoundError:
+        pass
+    return metrics_config
+
+
+CRAWLER_DEFAULTS = {
+    'TIMEOUT': 30,
+    'MAX_RETRIES': 3,
+    'BACKOFF_BASE': 0.5,
+    'BACKOFF_MAX': 30.0,
+    'ADAPTIVE_CONCURRENCY': True,
+    'INITIAL_CONCURRENCY': 2,
+    'MIN_CONCURRENCY': 1,
+    'LATENCY_FACTOR': 2.0,
+    'ERROR_THRESHOLD': 0.1,
+    'MAX_FETCH_ERRORS': 5,
+    'URL_FILTER_CAPACITY': 1000000,
+    'URL_FILTER_ERROR_RATE': 0.001,
+}
+
+
+def get_crawler_config():
+    crawler_config = dict(CRAWLER_DEFAULTS)
+    try:
+        with open('config.json', 'r') as f:
+            config = json.load(f)
+        crawler_config.update(config.get('CRAWLER', {}))
+    except FileNotFoundError:
+        pass
+    return crawler_config
@@ -1,23 +1,178 @@
 import sys
 import os
+import csv
+import io
+import json
 import logging
+import threading
 from sqlalchemy import create_engine, update, text
 from sqlalchemy import Column, String, Integer, MetaData, Table
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import time
+from contextlib import contextmanager
 from datetime import datetime
+from migrations import apply_migrations
+from db_configurator import get_pool_config, get_property_storage
+from metrics import timed_query
+from serialize import RowSet
+
+
+COPY_THRESHOLD = 500
+FETCH_ERROR_BACKOFF = 60
+FETCH_ERROR_BACKOFF_MAX = 86400
+UPSERT_COLUMNS = ('url', 'subcat_lvl2_id', 'name', 'price', 'units',
+                  'description', 'image_url', 'is_trend', 'properties')
+DEFAULT_PAGE_SIZE = 100
+EXPORT_BATCH_SIZE = 5000
+FACET_VALUES_LIMIT = 50
+PRODUCT_COLUMNS = ('id', 'url', 'name', 'price', 'units', 'description',
+                   'image_url', 'is_trend', 'parsed_at', 'subcat_lvl2_id')
+PROPERTY_COLUMNS = ('id', 'product_id', 'name', 'value')
+COMPACT_PROPERTY_COLUMNS = ('product_id', 'name', 'value')
+PROPERTY_STORAGES = ('eav', 'jsonb')
+
+
+REFRESH_BASE_HOURS = 24
+REFRESH_MIN_HOURS = 6
+REFRESH_MAX_HOURS = 24 * 30
 
 
 class Postgres_db:
 
-    def __init__(self, db_config):
-        self._engine = create_engine(db_config)
-        self._connect = self._engine.connect()
+    def __init__(self, db_config, pool_config=None, property_storage=None):
+        if pool_config is None:
+            pool_config = get_pool_config()
+        if property_storage is None:
+            property_storage = get_property_storage()
+        if property_storage not in PROPERTY_STORAGES:
+            raise ValueError('Unknown property storage {}'
+                             .format(property_storage))
+        self._property_storage = property_storage
+        self._property_name_ids = {}
+        self._property_names_lock = threading.Lock()
+        self._engine = create_engine(db_config,
+                                     pool_size=pool_config['SIZE'],
+                                     max_overflow=pool_config['MAX_OVERFLOW'],
+                                     pool_pre_ping=pool_config['PRE_PING'],
+                                     pool_recycle=pool_config['RECYCLE'],
+                                     pool_timeout=pool_config['TIMEOUT'])
         self._meta = MetaData(self._engine)
+        self._change_listeners = []
+
+    def close(self):
+        self._engine.dispose()
+
+    @property
+    def property_storage(self):
+        return self._property_storage
+
+    @property
+    def property_columns(self):
+        if self._property_storage == 'jsonb':
+            return COMPACT_PROPERTY_COLUMNS
+        return PROPERTY_COLUMNS
+
+    @property
+    def _properties_source(self):
+        if self._property_storage == 'jsonb':
+            return 'product_properties_compact'
+        return 'product_properties'
+
+    def _get_property_name_ids(self, names, create=True):
+        missing = [name for name in set(names)
+                   if name not in self._property_name_ids]
+        if missing:
+            with self._transaction() as connection:
+                if create is True:
+                    connection.execute(text("""INSERT INTO property_names
+                                               (name)
+                                               SELECT unnest(:names)
+                                               ON CONFLICT DO NOTHING;"""),
+                                       names=missing)
+                rows = connection.execute(text("""SELECT name, id
+                                                  FROM property_names
+                                                  WHERE name = ANY(:names);
+                                                  """),
+                                          names=missing).fetchall()
+            with self._property_names_lock:
+                self._property_name_ids.update(rows)
+        return {name: self._property_name_ids[name] for name in names
+                if name in self._property_name_ids}
+
+    def _properties_json(self, feature_dict, name_ids=None):
+        if name_ids is None:
+            name_ids = self._get_property_name_ids(list(feature_dict))
+        return json.dumps({str(name_ids[name]): value
+                           for name, value in feature_dict.items()},
+                          ensure_ascii=False)
+
+    def add_change_listener(self, listener):
+        self._change_listeners.append(listener)
+
+    def _notify_change(self, resource, resource_ids):
+        for listener in self._change_listeners:
+            try:
+                listener(resource, resource_ids)
+            except Exception as e:
+                logging.exception(e)
 
     def _query(self, query):
-        return self._connect.execute(query)
+        return self._engine.execute(query)
+
+    @contextmanager
+    def _transaction(self):
+        with self._engine.begin() as connection:
+            yield connection
+
+    def _values_clause(self, rows, prefix='v'):
+        placeholders = []
+        params = {}
+        for row_number, row in enumerate(rows):
+            names = []
+            for column_number, value in enumerate(row):
+                key = '{}{}_{}'.format(prefix, row_number, column_number)
+                params[key] = value
+                names.append(':' + key)
+            placeholders.append('({})'.format(', '.join(names)))
+        return ',\n'.join(placeholders), params
+
+    def _copy_rows(self, connection, table_name, columns, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(['\\N' if value is None else value
+                             for value in row])
+        buffer.seek(0)
+        statement = """COPY {} ({}) FROM STDIN
+                       WITH (FORMAT csv, NULL '\\N')""".format(
+                                                    table_name,
+                                                    ', '.join(columns))
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(statement, buffer)
+        finally:
+            cursor.close()
+        return len(rows)
+
+    def _insert_rows(self, connection, table_name, columns, rows):
+        if len(rows) == 0:
+            return 0
+        if len(rows) >= COPY_THRESHOLD:
+            return self._copy_rows(connection, table_name, columns, rows)
+        values, params = self._values_clause(rows)
+        statement = text("""INSERT INTO {} ({})
+                            VALUES {};""".format(table_name,
+                                                 ', '.join(columns),
+                                                 values))
+        connection.execute(statement, params)
+        return len(rows)
+
+    def _bulk_insert(self, table_name, columns, rows):
+        if len(rows) == 0:
+            return 0
+        with self._transaction() as connection:
+            return self._insert_rows(connection, table_name, columns, rows)
 
     def _reflect_table(self, table_name):
         table = Table(table_name,
@@ -66,7 +221,53 @@ class Postgres_db:
         self._query(product_properties_query)
         return True
 
+    def migrate(self, target_version=None):
+        with self._engine.connect() as connection:
+            return apply_migrations(connection, target_version)
+
+    def compact_properties(self, batch_size=EXPORT_BATCH_SIZE, drop_eav=False):
+        self._query("""INSERT INTO property_names (name)
+                       SELECT DISTINCT name FROM product_properties
+                       WHERE name IS NOT NULL AND deleted_at IS NULL
+                       ON CONFLICT DO NOTHING;""")
+        bounds = self._query("""SELECT MIN(product_id), MAX(product_id)
+                                FROM product_properties;""").fetchone()
+        compacted = 0
+        if bounds[0] is not None:
+            for low in range(bounds[0], bounds[1] + 1, batch_size):
+                statement = text("""UPDATE products SET
+                                    properties=COALESCE(products.properties,
+                                                        '{}'::jsonb) ||
+                                    compact.properties
+                                    FROM (SELECT product_properties.product_id,
+                                          jsonb_object_agg(
+                                              property_names.id::text,
+                                              product_properties.value)
+                                          AS properties
+                                          FROM product_properties
+                                          JOIN property_names ON
+                                          (property_names.name =
+                                           product_properties.name)
+                                          WHERE product_properties.product_id
+                                          >= :low
+                                          AND product_properties.product_id
+                                          < :high
+                                          AND product_properties.deleted_at
+                                          IS NULL
+                                          GROUP BY product_properties.product_id)
+                                          AS compact
+                                    WHERE products.id=compact.product_id;""").\
+                            bindparams(low=low, high=low + batch_size)
+                compacted += self._query(statement).rowcount
+        if drop_eav is True:
+            self._query("""TRUNCATE product_properties;""")
+        return compacted
+
     def drop_existing_tables_from_db(self):
+        self._query("""DROP VIEW IF EXISTS product_properties_compact;""")
+        self._query("""DROP TABLE IF EXISTS schema_migrations, category_facets,
+                       category_facets_dirty, property_names,
+                       subcategory_pages, product_subcategories;""")
         statement = """DROP TABLE categories,subcategories_lvl1,
                        subcategories_lvl2, products, product_properties;"""
         return self._query(statement)
@@ -89,7 +290,7 @@ class Postgres_db:
                             :category_name)
                             RETURNING id;""").\
                             bindparams(category_name=category_name)
-        result = self._connect.execute(statement).fetchone()[0]
+        result = self._query(statement).fetchone()[0]
         return result
 
     def subcat_lvl1_insert(self, subcat_lvl1_name, parent_id):
@@ -99,19 +300,70 @@ class Postgres_db:
                             RETURNING id;""").\
                             bindparams(name=subcat_lvl1_name,
                                        parent_id=parent_id)
-        result = self._connect.execute(statement).fetchone()[0]
+        result = self._query(statement).fetchone()[0]
         return result
 
     def subcat_lvl2_insert(self, subcat_lvl2_dict, subcat_lvl1_id):
         statement = text("""INSERT INTO subcategories_lvl2
-                            VALUES (DEFAULT,
-                            :name, :url, NULL,
-                            :parent_id);""").\
+                            (name, url, subcat_lvl1_id)
+                            VALUES (:name, :url, :parent_id);""").\
                             bindparams(name=subcat_lvl2_dict['name'],
                                        url=subcat_lvl2_dict['url'],
                                        parent_id=subcat_lvl1_id
                                        )
-        return self._connect.execute(statement)
+        return self._query(statement)
+
+    def _ids_by_key(self, returned_rows, keys):
+        ids = {}
+        for row in sorted(returned_rows):
+            key = row[1] if len(row) == 2 else tuple(row[1:])
+            ids.setdefault(key, []).append(row[0])
+        return [ids[key].pop(0) for key in keys]
+
+    def catalog_tree_insert(self, catalog_tree):
+        if len(catalog_tree) == 0:
+            return 0
+        with self._transaction() as connection:
+            values, params = self._values_clause(
+                                    [(category['name'],)
+                                     for category in catalog_tree])
+            statement = text("""INSERT INTO categories (name)
+                                VALUES {}
+                                RETURNING id, name;""".format(values))
+            category_ids = self._ids_by_key(
+                                connection.execute(statement, params),
+                                [category['name']
+                                 for category in catalog_tree])
+            lvl1_rows = []
+            lvl1_children = []
+            for category, category_id in zip(catalog_tree, category_ids):
+                for lvl1 in category['subcategories']:
+                    lvl1_rows.append((lvl1['name'], category_id))
+                    lvl1_children.append(lvl1['subcategories'])
+            if len(lvl1_rows) == 0:
+                return len(category_ids)
+            values, params = self._values_clause(lvl1_rows)
+            statement = text("""INSERT INTO subcategories_lvl1
+                                (name, category_id)
+                                VALUES {}
+                                RETURNING id, name, category_id;
+                                """.format(values))
+            lvl1_ids = self._ids_by_key(connection.execute(statement, params),
+                                        lvl1_rows)
+            lvl2_rows = [(lvl2['name'], lvl2['url'], lvl1_id)
+                         for lvl1_id, children in zip(lvl1_ids,
+                                                      lvl1_children)
+                         for lvl2 in children]
+            if len(lvl2_rows) > 0:
+                values, params = self._values_clause(lvl2_rows)
+                statement = text("""INSERT INTO subcategories_lvl2
+                                    (name, url, subcat_lvl1_id)
+                                    VALUES {};""".format(values))
+                connection.execute(statement, params)
+        logging.info('db.Catalog tree inserted: {} categories, {} lvl1, '
+                     '{} lvl2'.format(len(category_ids), len(lvl1_rows),
+                                      len(lvl2_rows)))
+        return len(category_ids)
 
     def get_unparsed_subcat_lvl2_entry(self):
         statement = """SELECT id, url, name from subcategories_lvl2
@@ -126,31 +378,302 @@ class Postgres_db:
         logging.info('db.Get unparsed subcat_lvl2_entry {}'.format(dict_['url']))
         return dict_
 
+    @timed_query
+    def claim_unparsed_subcat_lvl2_entries(self, worker_id, batch_size,
+                                           lease_seconds=600):
+        statement = text("""UPDATE subcategories_lvl2 SET
+                            claimed_by=:worker_id,
+                            lease_expires_at=NOW() +
+                            :lease_seconds * INTERVAL '1 second'
+                            WHERE id IN (SELECT id FROM subcategories_lvl2
+                                         WHERE parsed_at IS NULL
+                                         AND deleted_at IS NULL
+                                         AND (lease_expires_at IS NULL
+                                         OR lease_expires_at < NOW())
+                                         ORDER BY id
+                                         LIMIT :batch_size
+                                         FOR UPDATE SKIP LOCKED)
+                            RETURNING id, url, name;""").\
+                            bindparams(worker_id=worker_id,
+                                       batch_size=batch_size,
+                                       lease_seconds=lease_seconds)
+        entries = self._query(statement).fetchall()
+        logging.info('db.Worker {} claimed {} subcat_lvl2 entries'
+                     .format(worker_id, len(entries)))
+        return [{'id': entry[0], 'url': entry[1], 'name': entry[2]}
+                for entry in entries]
+
     def _current_timestamp(self):
         ts = time.time()
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         return timestamp
 
+    @timed_query
     def update_lvl2_entry_set_parsed_at(self, entry_id):
         statement = text("""UPDATE subcategories_lvl2 SET
-                            parsed_at=:timestamp
+                            parsed_at=:timestamp,
+                            claimed_by=NULL,
+                            lease_expires_at=NULL,
+                            fetch_error_code=NULL,
+                            fetch_errors=0
                             WHERE id=:entry_id;""").\
                             bindparams(entry_id=entry_id,
                                        timestamp=self._current_timestamp())
-        return self._query(statement)
+        with self._transaction() as connection:
+            connection.execute(text("""DELETE FROM subcategory_pages
+                                       WHERE subcat_lvl2_id=:entry_id;"""),
+                               entry_id=entry_id)
+            return connection.execute(statement)
+
+    @timed_query
+    def lvl2_entry_update_fetch_error(self, entry_id, response_code=None,
+                                      max_fetch_errors=5,
+                                      backoff_seconds=FETCH_ERROR_BACKOFF,
+                                      max_backoff_seconds=
+                                      FETCH_ERROR_BACKOFF_MAX):
+        statement = text("""UPDATE subcategories_lvl2 SET
+                            fetch_error_code=:response_code,
+                            fetch_errors=fetch_errors + 1,
+                            claimed_by=NULL,
+                            lease_expires_at=NOW() +
+                            LEAST(:backoff_seconds * 2 ^ fetch_errors,
+                                  :max_backoff_seconds) * INTERVAL '1 second',
+                            parsed_at=CASE WHEN fetch_errors + 1 >=
+                                      :max_fetch_errors
+                                      THEN NOW() ELSE parsed_at END
+                            WHERE id=:entry_id
+                            RETURNING fetch_errors;""").\
+                            bindparams(entry_id=entry_id,
+                                       response_code=response_code,
+                                       max_fetch_errors=max_fetch_errors,
+                                       backoff_seconds=backoff_seconds,
+                                       max_backoff_seconds=max_backoff_seconds)
+        row = self._query(statement).fetchone()
+        if row is not None and row[0] >= max_fetch_errors:
+            logging.warning('Subcat_lvl2 {} gave up after {} fetch errors, '
+                            'last status {}'.format(entry_id, row[0],
+                                                    response_code))
+        return row is not None
+
+    @timed_query
+    def get_pending_lvl2_subpages(self, subcat_lvl2_ids):
+        statement = text("""SELECT subcat_lvl2_id,
+                            array_agg(url ORDER BY url)
+                            FILTER (WHERE parsed_at IS NULL)
+                            FROM subcategory_pages
+                            WHERE subcat_lvl2_id = ANY(:ids)
+                            GROUP BY subcat_lvl2_id;""").\
+                            bindparams(ids=list(subcat_lvl2_ids))
+        return dict((subcat_lvl2_id, urls or [])
+                    for subcat_lvl2_id, urls in self._query(statement))
+
+    def _store_product_urls(self, connection, subcat_lvl2_id, urls,
+                            known_urls=()):
+        urls = list(dict.fromkeys(urls))
+        url_set = set(urls)
+        known_urls = [url for url in dict.fromkeys(known_urls)
+                      if url not in url_set]
+        inserted = 0
+        if urls:
+            inserted = connection.execute(text("""INSERT INTO products
+                                   (url, subcat_lvl2_id)
+                                   SELECT unnest(:urls), :subcat_lvl2_id
+                                   ON CONFLICT (url) DO NOTHING;"""),
+                                          urls=urls,
+                                          subcat_lvl2_id=subcat_lvl2_id)\
+                                 .rowcount
+        if inserted == len(urls) and not known_urls:
+            return inserted
+        found = connection.execute(text("""WITH found AS
+                                   (SELECT id, url FROM products
+                                   WHERE url = ANY(:urls)),
+                                   linked AS (INSERT INTO product_subcategories
+                                   (product_id, subcat_lvl2_id)
+                                   SELECT id, :subcat_lvl2_id FROM found
+                                   ON CONFLICT DO NOTHING)
+                                   SELECT url FROM found;"""),
+                                   urls=urls + known_urls,
+                                   subcat_lvl2_id=subcat_lvl2_id).fetchall()
+        found = set(row[0] for row in found)
+        missing = [url for url in known_urls if url not in found]
+        if missing:
+            inserted += self._store_product_urls(connection, subcat_lvl2_id,
+                                                 missing)
+        return inserted
+
+    @timed_query
+    def lvl2_page_store(self, subcat_lvl2_id, page_url, product_urls,
+                        subpage_urls=(), known_urls=()):
+        pages = [(subcat_lvl2_id, page_url, self._current_timestamp())]
+        pages.extend((subcat_lvl2_id, url, None) for url in subpage_urls
+                     if url != page_url)
+        values, params = self._values_clause(pages)
+        statement = text("""INSERT INTO subcategory_pages
+                            (subcat_lvl2_id, url, parsed_at)
+                            SELECT v.subcat_lvl2_id::int, v.url,
+                            v.parsed_at::timestamp
+                            FROM (VALUES {}) AS v(subcat_lvl2_id, url,
+                                                  parsed_at)
+                            ON CONFLICT (subcat_lvl2_id, url) DO UPDATE SET
+                            parsed_at=COALESCE(EXCLUDED.parsed_at,
+                                               subcategory_pages.parsed_at);"""
+                         .format(values))
+        with self._transaction() as connection:
+            inserted = self._store_product_urls(connection, subcat_lvl2_id,
+                                                product_urls, known_urls)
+            connection.execute(statement, params)
+        return inserted
 
+    @timed_query
     def product_initial_insert(self, product_dict):
-        statement = text("""INSERT INTO products
-                            VALUES (DEFAULT,
-                            :url, NULL, NULL, NULL,
-                            NULL, NULL, NULL, NULL,
-                            (SELECT id from subcategories_lvl2
-                            WHERE name=:parent_name LIMIT 1))
-                            RETURNING id;""").\
-                            bindparams(url=product_dict['url'],
-                                       parent_name=product_dict['parent']
-                                       )
-        return self._query(statement).fetchone()[0]
+        params = {
+                  'url': product_dict['url'],
+                  'parent_name': product_dict['parent'],
+                  }
+        with self._transaction() as connection:
+            row = connection.execute(text("""INSERT INTO products
+                                     (url, subcat_lvl2_id)
+                                     VALUES (:url,
+                                     (SELECT id from subcategories_lvl2
+                                     WHERE name=:parent_name LIMIT 1))
+                                     ON CONFLICT (url) DO NOTHING
+                                     RETURNING id;"""), **params).fetchone()
+            if row is not None:
+                return row[0]
+            product_id = connection.execute(text("""SELECT id FROM products
+                                                WHERE url=:url;"""),
+                                            **params).scalar()
+            connection.execute(text("""INSERT INTO product_subcategories
+                                    (product_id, subcat_lvl2_id)
+                                    SELECT :product_id, id
+                                    FROM subcategories_lvl2
+                                    WHERE name=:parent_name LIMIT 1
+                                    ON CONFLICT DO NOTHING;"""),
+                               product_id=product_id, **params)
+            return product_id
+
+    @timed_query
+    def products_bulk_insert(self, subcat_lvl2_id, urls):
+        with self._transaction() as connection:
+            return self._store_product_urls(connection, subcat_lvl2_id, urls)
+
+    def get_subcats_lvl2_ids_by_name(self, names):
+        statement = text("""SELECT name, MIN(id) FROM subcategories_lvl2
+                            WHERE name = ANY(:names)
+                            GROUP BY name;""").\
+                            bindparams(names=list(set(names)))
+        return dict(self._query(statement).fetchall())
+
+    def get_existing_subcat_lvl2_ids(self, ids):
+        statement = text("""SELECT id FROM subcategories_lvl2
+                            WHERE id = ANY(:ids);""").\
+                            bindparams(ids=list(set(ids)))
+        return set(row[0] for row in self._query(statement).fetchall())
+
+    @timed_query
+    def products_bulk_upsert(self, products):
+        products = list({product['url']: product
+                         for product in products}.values())
+        if len(products) == 0:
+            return []
+        compact = self._property_storage == 'jsonb'
+        timestamp = self._current_timestamp()
+        if compact is True:
+            name_ids = self._get_property_name_ids(
+                           [name for product in products
+                            for name in product.get('characteristics') or {}])
+        rows = []
+        for product in products:
+            if compact is True:
+                properties = self._properties_json(
+                                        product.get('characteristics') or {},
+                                        name_ids)
+            else:
+                properties = None
+            rows.append((product['url'], product['subcat_lvl2_id'],
+                         product['name'], product['price'],
+                         product['product_units'], product['description'],
+                         product['image_url'], product['is_trend'],
+                         properties))
+        with self._transaction() as connection:
+            connection.execute(text("""SET LOCAL oma.defer_search_vector
+                                       = 'on';"""))
+            connection.execute(text("""CREATE TEMP TABLE products_upsert
+                                       (url VARCHAR, subcat_lvl2_id INT,
+                                       name VARCHAR, price NUMERIC(6,2),
+                                       units VARCHAR, description VARCHAR,
+                                       image_url VARCHAR, is_trend BOOLEAN,
+                                       properties JSONB)
+                                       ON COMMIT DROP;"""))
+            self._copy_rows(connection, 'products_upsert', UPSERT_COLUMNS,
+                            rows)
+            connection.execute(text("""ANALYZE products_upsert;"""))
+            upserted = connection.execute(text("""INSERT INTO products
+                                   (url, subcat_lvl2_id, name, price, units,
+                                   description, image_url, is_trend,
+                                   properties, parsed_at)
+                                   SELECT url, subcat_lvl2_id, name, price,
+                                   units, description, image_url, is_trend,
+                                   properties, :timestamp
+                                   FROM products_upsert
+                                   ON CONFLICT (url) DO UPDATE SET
+                                   name=EXCLUDED.name,
+                                   price=EXCLUDED.price,
+                                   units=EXCLUDED.units,
+                                   description=EXCLUDED.description,
+                                   image_url=EXCLUDED.image_url,
+                                   is_trend=EXCLUDED.is_trend,
+                                   properties={},
+                                   parsed_at=EXCLUDED.parsed_at,
+                                   deleted_at=NULL,
+                                   claimed_by=NULL,
+                                   lease_expires_at=NULL
+                                   RETURNING id, url, xmax = 0;"""
+                                   .format('EXCLUDED.properties'
+                                           if compact is True
+                                           else 'products.properties')),
+                                          timestamp=timestamp).fetchall()
+            updated = [(product_id, url)
+                       for product_id, url, inserted in upserted
+                       if not inserted]
+            created = [(product_id, url)
+                       for product_id, url, inserted in upserted if inserted]
+            if updated:
+                connection.execute(text("""INSERT INTO product_subcategories
+                                       (product_id, subcat_lvl2_id)
+                                       SELECT products.id,
+                                       products_upsert.subcat_lvl2_id
+                                       FROM products_upsert
+                                       JOIN products
+                                       ON (products.url = products_upsert.url)
+                                       WHERE products.id = ANY(:ids)
+                                       ON CONFLICT DO NOTHING;"""),
+                                   ids=[row[0] for row in updated])
+            product_ids = [row[0] for row in updated + created]
+            if compact is False:
+                connection.execute(text("""DELETE FROM product_properties
+                                          WHERE product_id = ANY(:ids);"""),
+                                   ids=[row[0] for row in updated])
+                ids = dict((url, product_id)
+                           for product_id, url in updated + created)
+                feature_rows = [(name, value, ids[product['url']])
+                                for product in products
+                                for name, value in
+                                (product.get('characteristics') or {}).items()]
+                self._insert_rows(connection, 'product_properties',
+                                  ('name', 'value', 'product_id'),
+                                  feature_rows)
+            connection.execute(text("""SET LOCAL oma.defer_search_vector
+                                       = 'off';
+                                       SELECT refresh_product_search_vectors(
+                                       :ids);"""), ids=product_ids)
+        self._notify_change('product', [row[0] for row in updated])
+        statuses = dict((url, (product_id, 'updated'))
+                        for product_id, url in updated)
+        statuses.update((url, (product_id, 'created'))
+                        for product_id, url in created)
+        return [(product['url'],) + statuses[product['url']]
+                for product in products]
 
     def get_unparsed_product_entry(self):
         statement = """SELECT id, url from products
@@ -162,6 +685,41 @@ class Postgres_db:
                  }
         return dict_
 
+    @timed_query
+    def claim_unparsed_product_entries(self, worker_id, batch_size,
+                                       lease_seconds=600):
+        statement = text("""UPDATE products SET
+                            claimed_by=:worker_id,
+                            lease_expires_at=NOW() +
+                            :lease_seconds * INTERVAL '1 second'
+                            WHERE id IN (SELECT id FROM products
+                                         WHERE parsed_at IS NULL
+                                         AND deleted_at IS NULL
+                                         AND (lease_expires_at IS NULL
+                                         OR lease_expires_at < NOW())
+                                         ORDER BY id
+                                         LIMIT :batch_size
+                                         FOR UPDATE SKIP LOCKED)
+                            RETURNING id, url;""").\
+                            bindparams(worker_id=worker_id,
+                                       batch_size=batch_size,
+                                       lease_seconds=lease_seconds)
+        entries = self._query(statement).fetchall()
+        logging.info('db.Worker {} claimed {} product entries'
+                     .format(worker_id, len(entries)))
+        return [{'id': entry[0], 'url': entry[1]} for entry in entries]
+
+    def get_parsed_product_entries(self, after_id, limit):
+        statement = text("""SELECT id, url from products
+                            WHERE parsed_at IS NOT NULL
+                            AND id > :after_id
+                            ORDER BY id
+                            LIMIT :limit;""").\
+                            bindparams(after_id=after_id, limit=limit)
+        entries = self._query(statement).fetchall()
+        return [{'id': entry[0], 'url': entry[1]} for entry in entries]
+
+    @timed_query
     def product_update(self, product_id, product_dict):
         statement = text("""UPDATE products SET
                             name=:name,
@@ -170,7 +728,11 @@ class Postgres_db:
                             description=:description,
                             image_url=:image_url,
                             is_trend=:is_trend,
-                            parsed_at=:timestamp
+                            parsed_at=:timestamp,
+                            fetch_error_code=NULL,
+                            fetch_errors=0,
+                            claimed_by=NULL,
+                            lease_expires_at=NULL
                             WHERE id=:product_id;""").\
                             bindparams(product_id=product_id,
                                        name=product_dict['name'],
@@ -181,28 +743,254 @@ class Postgres_db:
                                        is_trend=product_dict['is_trend'],
                                        timestamp=self._current_timestamp()
                                        )
-        return self._query(statement)
+        result = self._query(statement)
+        self._notify_change('product', [product_id])
+        return result
+
+    @timed_query
+    def products_bulk_update(self, results, replace_properties=False):
+        if len(results) == 0:
+            return 0
+        timestamp = self._current_timestamp()
+        rows = [(product_id,
+                 product_dict['name'],
+                 product_dict['price'],
+                 product_dict['product_units'],
+                 product_dict['description'],
+                 product_dict['image_url'],
+                 product_dict['is_trend'],
+                 timestamp)
+                for product_id, product_dict in results]
+        if self._property_storage == 'jsonb':
+            return self._products_bulk_update_compact(results, rows,
+                                                      replace_properties)
+        feature_rows = [(name, value, product_id)
+                        for product_id, product_dict in results
+                        for name, value in
+                        (product_dict['characteristics'] or {}).items()]
+        values, params = self._values_clause(rows)
+        statement = text("""UPDATE products SET
+                            name=v.name,
+                            price=v.price::numeric,
+                            units=v.units,
+                            description=v.description,
+                            image_url=v.image_url,
+                            is_trend=v.is_trend::boolean,
+                            parsed_at=v.parsed_at::timestamp,
+                            fetch_error_code=NULL,
+                            fetch_errors=0,
+                            claimed_by=NULL,
+                            lease_expires_at=NULL
+                            FROM (VALUES {}) AS v(id, name, price, units,
+                                                  description, image_url,
+                                                  is_trend, parsed_at)
+                            WHERE products.id=v.id;""".format(values))
+        with self._transaction() as connection:
+            connection.execute(statement, params)
+            if replace_properties is True:
+                connection.execute(text("""DELETE FROM product_properties
+                                          WHERE product_id = ANY(:ids);"""),
+                                   ids=[row[0] for row in rows])
+            self._insert_rows(connection, 'product_properties',
+                              ('name', 'value', 'product_id'), feature_rows)
+        self._notify_change('product', [row[0] for row in rows])
+        return len(rows)
+
+    def _products_bulk_update_compact(self, results, rows,
+                                      replace_properties=False):
+        name_ids = self._get_property_name_ids(
+                       [name for _, product_dict in results
+                        for name in product_dict['characteristics'] or {}])
+        rows = [row + (self._properties_json(product_dict['characteristics']
+                                             or {}, name_ids),)
+                for row, (_, product_dict) in zip(rows, results)]
+        values, params = self._values_clause(rows)
+        statement = text("""UPDATE products SET
+                            name=v.name,
+                            price=v.price::numeric,
+                            units=v.units,
+                            description=v.description,
+                            image_url=v.image_url,
+                            is_trend=v.is_trend::boolean,
+                            parsed_at=v.parsed_at::timestamp,
+                            properties={}v.properties::jsonb,
+                            fetch_error_code=NULL,
+                            fetch_errors=0,
+                            claimed_by=NULL,
+                            lease_expires_at=NULL
+                            FROM (VALUES {}) AS v(id, name, price, units,
+                                                  description, image_url,
+                                                  is_trend, parsed_at,
+                                                  properties)
+                            WHERE products.id=v.id;""".format(
+                                '' if replace_properties is True else
+                                "COALESCE(products.properties, '{}'::jsonb) || ",
+                                values))
+        self._query(statement.bindparams(**params))
+        self._notify_change('product', [row[0] for row in rows])
+        return len(rows)
+
+    def _claim_due_for_refresh(self, table_name, columns, worker_id,
+                               batch_size, lease_seconds):
+        statement = text("""UPDATE {table} SET
+                            claimed_by=:worker_id,
+                            lease_expires_at=NOW() +
+                            :lease_seconds * INTERVAL '1 second'
+                            WHERE id IN (SELECT id FROM {table}
+                                         WHERE parsed_at IS NOT NULL
+                                         AND deleted_at IS NULL
+                                         AND (next_crawl_at IS NULL
+                                         OR next_crawl_at <= NOW())
+                                         AND (lease_expires_at IS NULL
+                                         OR lease_expires_at < NOW())
+                                         ORDER BY next_crawl_at NULLS FIRST
+                                         LIMIT :batch_size
+                                         FOR UPDATE SKIP LOCKED)
+                            RETURNING {columns};""".format(
+                                                table=table_name,
+                                                columns=', '.join(columns))).\
+                            bindparams(worker_id=worker_id,
+                                       batch_size=batch_size,
+                                       lease_seconds=lease_seconds)
+        entries = self._query(statement).fetchall()
+        return [dict(zip(columns, entry)) for entry in entries]
+
+    @timed_query
+    def claim_products_due_for_refresh(self, worker_id, batch_size,
+                                       lease_seconds=600):
+        columns = ('id', 'url', 'etag', 'last_modified', 'content_hash')
+        return self._claim_due_for_refresh('products', columns, worker_id,
+                                           batch_size, lease_seconds)
 
-    def product_update_uknown_error(self, product_id):
-        unknown_failure_dict = {
-                                'name': 'error',
-                                'price': None,
-                                'product_units': None,
-                                'description': 'error',
-                                'characteristics': None,
-                                'similar_products': None,
-                                'image_url': None,
-                                'is_trend': None,
-                                }
-        self._db.product_update(entry_id, unknown_failure_dict)
+    @timed_query
+    def claim_subcats_lvl2_due_for_refresh(self, worker_id, batch_size,
+                                           lease_seconds=600):
+        columns = ('id', 'url', 'name', 'etag', 'last_modified',
+                   'content_hash')
+        return self._claim_due_for_refresh('subcategories_lvl2', columns,
+                                           worker_id, batch_size,
+                                           lease_seconds)
 
+    def _mark_checked(self, table_name, checks):
+        if len(checks) == 0:
+            return 0
+        rows = [(entry_id, changed, etag, last_modified, content_hash)
+                for entry_id, changed, etag, last_modified, content_hash
+                in checks]
+        values, params = self._values_clause(rows)
+        params.update(base_hours=REFRESH_BASE_HOURS,
+                      min_hours=REFRESH_MIN_HOURS,
+                      max_hours=REFRESH_MAX_HOURS)
+        statement = text("""UPDATE {table} SET
+                            etag=v.etag,
+                            last_modified=v.last_modified,
+                            content_hash=v.content_hash,
+                            checked_at=NOW(),
+                            check_count=check_count + 1,
+                            change_count=change_count +
+                            CASE WHEN v.changed::boolean THEN 1 ELSE 0 END,
+                            next_crawl_at=NOW() + LEAST(GREATEST(
+                            :base_hours * (check_count + 2.0) /
+                            (change_count + 1.0 +
+                            CASE WHEN v.changed::boolean THEN 1 ELSE 0 END),
+                            :min_hours), :max_hours) * INTERVAL '1 hour',
+                            claimed_by=NULL,
+                            lease_expires_at=NULL
+                            FROM (VALUES {values}) AS v(id, changed, etag,
+                                                       last_modified,
+                                                       content_hash)
+                            WHERE {table}.id=v.id;""".format(table=table_name,
+                                                             values=values))
+        self._query(statement.bindparams(**params))
+        return len(rows)
+
+    @timed_query
+    def products_mark_checked(self, checks):
+        return self._mark_checked('products', checks)
+
+    @timed_query
+    def subcats_lvl2_mark_checked(self, checks):
+        return self._mark_checked('subcategories_lvl2', checks)
+
+    def schedule_full_refresh(self):
+        for table_name in ('subcategories_lvl2', 'products'):
+            self._query("""UPDATE {} SET next_crawl_at=NOW()
+                           WHERE parsed_at IS NOT NULL;""".format(table_name))
+        return True
+
+    @timed_query
+    def products_insert_missing(self, subcat_lvl2_id, urls):
+        if len(urls) == 0:
+            return 0
+        with self._transaction() as connection:
+            return self._store_product_urls(connection, subcat_lvl2_id, urls)
+
+    @timed_query
+    def product_update_uknown_error(self, product_id, response_code=None,
+                                    max_fetch_errors=5,
+                                    backoff_seconds=FETCH_ERROR_BACKOFF,
+                                    max_backoff_seconds=FETCH_ERROR_BACKOFF_MAX):
+        statement = text("""UPDATE products SET
+                            fetch_error_code=:response_code,
+                            fetch_errors=fetch_errors + 1,
+                            claimed_by=NULL,
+                            lease_expires_at=NOW() +
+                            LEAST(:backoff_seconds * 2 ^ fetch_errors,
+                                  :max_backoff_seconds) * INTERVAL '1 second',
+                            parsed_at=CASE WHEN fetch_errors + 1 >=
+                                      :max_fetch_errors
+                                      THEN NOW() ELSE parsed_at END
+                            WHERE id=:product_id
+                            RETURNING fetch_errors;""").\
+                            bindparams(product_id=product_id,
+                                       response_code=response_code,
+                                       max_fetch_errors=max_fetch_errors,
+                                       backoff_seconds=backoff_seconds,
+                                       max_backoff_seconds=max_backoff_seconds)
+        row = self._query(statement).fetchone()
+        if row is not None and row[0] >= max_fetch_errors:
+            logging.warning('Product {} gave up after {} fetch errors, last '
+                            'status {}'.format(product_id, row[0],
+                                               response_code))
+        return row is not None
+
+    def _merge_product_properties(self, product_id, feature_dict):
+        statement = text("""UPDATE products SET
+                            properties=COALESCE(properties, '{}'::jsonb) ||
+                            CAST(:properties AS jsonb)
+                            WHERE id=:product_id;""").\
+                            bindparams(product_id=product_id,
+                                       properties=self._properties_json(
+                                                                feature_dict))
+        self._query(statement)
+        self._notify_change('product', [product_id])
+        return len(feature_dict)
+
+    @timed_query
     def product_features_insert(self, feature_name, feature_value, product_id):
+        if self._property_storage == 'jsonb':
+            return self._merge_product_properties(product_id,
+                                                  {feature_name: feature_value})
         statement = text("""INSERT INTO product_properties
-                            VALUES (DEFAULT, :name, :value, :product_id);""").\
+                            (name, value, product_id)
+                            VALUES (:name, :value, :product_id);""").\
                             bindparams(name=feature_name,
                                        value=feature_value,
                                        product_id=product_id)
-        return self._query(statement)
+        result = self._query(statement)
+        self._notify_change('product', [product_id])
+        return result
+
+    @timed_query
+    def product_features_bulk_insert(self, product_id, feature_dict):
+        if self._property_storage == 'jsonb':
+            return self._merge_product_properties(product_id, feature_dict)
+        rows = [(name, value, product_id)
+                for name, value in feature_dict.items()]
+        inserted = self._bulk_insert('product_properties',
+                                     ('name', 'value', 'product_id'), rows)
+        self._notify_change('product', [product_id])
+        return inserted
 
     def check_if_subcats_lvl2_table_is_not_empty(self):
         try:
@@ -216,69 +1004,160 @@ class Postgres_db:
     def check_if_all_lvl2_links_are_parsed(self):
         response = self._query("""SELECT COUNT(*) FROM
                                   subcategories_lvl2 WHERE parsed_at
+                                  IS NULL AND deleted_at
                                   IS NULL;""").fetchone()[0]
         return response == 0
 
     def check_if_all_product_links_are_parsed(self):
         response = self._query("""SELECT COUNT(*) FROM
                                   products WHERE parsed_at
+                                  IS NULL AND deleted_at
                                   IS NULL;""").fetchone()[0]
         return response == 0
 
+    def get_queue_depths(self):
+        row = self._query("""SELECT
+                             (SELECT COUNT(*) FROM subcategories_lvl2
+                              WHERE parsed_at IS NULL),
+                             (SELECT COUNT(*) FROM products
+                              WHERE parsed_at IS NULL
+                              AND deleted_at IS NULL);""").fetchone()
+        return {'subcategories_lvl2': row[0], 'products': row[1]}
+
+    def count_parsed_products(self):
+        return self._query("""SELECT COUNT(*) FROM products
+                              WHERE parsed_at IS NOT NULL;""").fetchone()[0]
+
+    @timed_query
     def remove_entry_from_product_table(self, id, hard=False):
         if hard is True:
             statement = text("""DELETE FROM products
                                 WHERE id=:id;""").\
                                 bindparams(id=id)
-            return self._query(statement)
+            result = self._query(statement)
+            self._notify_change('product', [id])
+            return result
+        timestamp = self._current_timestamp()
         statement1 = text("""UPDATE products SET
                              deleted_at=:timestamp
                              WHERE id=:id;""").\
-                             bindparams(id=id,
-                                        timestamp=self._current_timestamp()
-                                        )
-        self._query(statement1)
+                             bindparams(id=id, timestamp=timestamp)
         statement2 = text("""UPDATE product_properties SET
                              deleted_at=:timestamp
                              WHERE product_id=:id;""").\
-                             bindparams(id=id,
-                                        timestamp=self._current_timestamp()
-                                        )
-        self._query(statement2)
+                             bindparams(id=id, timestamp=timestamp)
+        with self._transaction() as connection:
+            connection.execute(statement1)
+            connection.execute(statement2)
+        self._notify_change('product', [id])
         return True
 
+    def remove_subcat_lvl2_entry(self, entry_id):
+        statement = text("""UPDATE subcategories_lvl2 SET
+                            deleted_at=:timestamp,
+                            claimed_by=NULL,
+                            lease_expires_at=NULL
+                            WHERE id=:entry_id;""").\
+                            bindparams(entry_id=entry_id,
+                                       timestamp=self._current_timestamp())
+        return self._query(statement)
+
+    @timed_query
     def get_product_by_id(self, prod_id):
-        statement = text("""SELECT * FROM products
+        statement = text("""SELECT {} FROM products
                             WHERE id=:product_id
-                            AND deleted_at IS NULL""").\
+                            AND deleted_at IS NULL""".format(
+                                ', '.join(PRODUCT_COLUMNS))).\
                             bindparams(product_id=prod_id)
         proxy_obj = self._query(statement)
-        return self._create_list_of_dictionaries(proxy_obj)
+        return self._row_set(proxy_obj)
 
+    def get_products_by_ids(self, product_ids):
+        statement = text("""SELECT {} FROM products
+                            WHERE id = ANY(:product_ids)
+                            AND deleted_at IS NULL""".format(
+                                ', '.join(PRODUCT_COLUMNS))).\
+                            bindparams(product_ids=list(product_ids))
+        proxy_obj = self._query(statement)
+        return self._row_set(proxy_obj)
+
+    def get_properties_by_product_ids(self, product_ids):
+        statement = text("""SELECT {} FROM {}
+                            WHERE product_id = ANY(:product_ids)
+                            AND deleted_at IS NULL
+                            ORDER BY product_id""".format(
+                                ', '.join(COMPACT_PROPERTY_COLUMNS),
+                                self._properties_source)).\
+                    bindparams(product_ids=list(product_ids))
+        proxy_obj = self._query(statement)
+        return self._row_set(proxy_obj)
+
+    def get_subcategories_by_product_ids(self, product_ids):
+        statement = text("""SELECT product_id, subcat_lvl2_id
+                            FROM product_subcategories
+                            WHERE product_id = ANY(:product_ids)
+                            ORDER BY product_id, subcat_lvl2_id""").\
+                    bindparams(product_ids=list(product_ids))
+        return self._query(statement).fetchall()
+
+    @timed_query
+    def get_products_with_properties(self, product_ids,
+                                     include_properties=True,
+                                     include_subcategories=False):
+        product_ids = list(dict.fromkeys(product_ids))
+        products = {row['id']: row
+                    for row in self.get_products_by_ids(product_ids)}
+        if include_properties is True and products:
+            for product in products.values():
+                product['properties'] = {}
+            for product_id, name, value in \
+                    self.get_properties_by_product_ids(list(products)).rows:
+                products[product_id]['properties'][name] = value
+        if include_subcategories is True and products:
+            for product in products.values():
+                product['subcategories'] = []
+            for product_id, subcat_lvl2_id in \
+                    self.get_subcategories_by_product_ids(list(products)):
+                products[product_id]['subcategories'].append(subcat_lvl2_id)
+        return [products[product_id] for product_id in product_ids
+                if product_id in products]
+
+    @timed_query
     def get_category(self, category_id):
         statement = text("""SELECT * FROM categories
                             WHERE id=:category_id
                             AND deleted_at IS NULL""").\
                     bindparams(category_id=category_id)
         proxy_obj = self._query(statement)
-        return self._create_list_of_dictionaries(proxy_obj)
+        return self._row_set(proxy_obj)
 
+    @timed_query
     def get_product_with_properties(self, product_id):
-        statement = text("""SELECT * FROM products JOIN product_properties
+        statement = text("""SELECT {},
+                            product_properties.name AS property_name,
+                            product_properties.value AS property_value
+                            FROM products JOIN {} AS product_properties
                             ON (products.id = product_properties.product_id)
                             WHERE products.id=:product_id
-                            AND product_properties.deleted_at IS NULL""").\
+                            AND products.deleted_at IS NULL
+                            AND product_properties.deleted_at IS NULL""".format(
+                                ', '.join('products.' + column
+                                          for column in PRODUCT_COLUMNS),
+                                self._properties_source)).\
                     bindparams(product_id=product_id)
         proxy_obj = self._query(statement)
-        return self._create_list_of_dictionaries(proxy_obj)
+        return self._row_set(proxy_obj)
 
+    @timed_query
     def get_product_properties(self, product_id):
-        statement = text("""SELECT * FROM product_properties
+        statement = text("""SELECT {} FROM {}
                             WHERE product_id=:product_id
-                            AND product_properties.deleted_at IS NULL""").\
+                            AND deleted_at IS NULL""".format(
+                                ', '.join(self.property_columns),
+                                self._properties_source)).\
                     bindparams(product_id=product_id)
         proxy_obj = self._query(statement)
-        return self._create_list_of_dictionaries(proxy_obj)
+        return self._row_set(proxy_obj)
 
     def get_lvl1_subcategories(self, category_id):
         statement = text("""SELECT * FROM subcategories_lvl1
@@ -286,80 +1165,321 @@ class Postgres_db:
                             AND deleted_at IS NULL""").\
                     bindparams(category_id=category_id)
         proxy_obj = self._query(statement)
-        return self._create_list_of_dictionaries(proxy_obj)
-
-    def _create_list_of_dictionaries(self, proxy_object):
-        row_proxy_object = proxy_object.fetchall()
-        if row_proxy_object is None:
-            return None
-        list_ = []
-        for obj in row_proxy_object:
-            list_.append({column_name: str(column_value) for column_name,
-                          column_value in zip(proxy_object.keys(), obj)})
-        return list_
+        return self._row_set(proxy_obj)
+
+    def _row_set(self, proxy_object):
+        return RowSet.from_result(proxy_object)
 
     def remove_category(self, id, hard=False):
         if hard is True:
             statement = text("""DELETE FROM categories
                                 WHERE id=:id;""").\
                                 bindparams(id=id)
-            return self._query(statement)
+            result = self._query(statement)
+            self._notify_change('category', [id])
+            return result
+        timestamp = self._current_timestamp()
         statement1 = text("""UPDATE categories SET
                              deleted_at=:timestamp
                              WHERE id=:id;""").\
-                             bindparams(id=id,
-                                        timestamp=self._current_timestamp()
-                                        )
-        self._query(statement1)
+                             bindparams(id=id, timestamp=timestamp)
         statement2 = text("""UPDATE subcategories_lvl1 SET
                              deleted_at=:timestamp
                              WHERE category_id=:id;""").\
-                             bindparams(id=id,
-                                        timestamp=self._current_timestamp()
-                                        )
-        self._query(statement2)
+                             bindparams(id=id, timestamp=timestamp)
+        with self._transaction() as connection:
+            connection.execute(statement1)
+            connection.execute(statement2)
+        self._notify_change('category', [id])
         return True
 
-    def get_category_interval(self, category_id1, category_id2):
-        if category_id2 < category_id1:
-            return None
-        statement = """SELECT * FROM categories
-                           WHERE id
-                           BETWEEN {} AND {}
-                           AND deleted_at IS NULL;""".format(category_id1,
-                                                             category_id2)
-        proxy_obj = self._query(statement)
-        return self._create_list_of_dictionaries(proxy_obj)
-
-    def get_products_interval(self, product_id1, product_id2):
-        statement = """SELECT * FROM products
-                       WHERE id
-                       BETWEEN {} AND {}
-                       AND deleted_at IS NULL;""".format(product_id1,
-                                                         product_id2)
+    def _select_page(self, table_name, condition, params, after_id=None,
+                     limit=DEFAULT_PAGE_SIZE, offset=0, columns=('*',)):
+        if after_id is not None:
+            condition += ' AND id > :after_id'
+            params = dict(params, after_id=after_id)
+        statement = text("""SELECT {} FROM {}
+                            WHERE {}
+                            AND deleted_at IS NULL
+                            ORDER BY id
+                            LIMIT :limit
+                            OFFSET :offset;""".format(', '.join(columns),
+                                                      table_name,
+                                                      condition)).\
+                            bindparams(limit=limit, offset=offset, **params)
         proxy_obj = self._query(statement)
-        return self._create_list_of_dictionaries(proxy_obj)
+        return self._row_set(proxy_obj)
+
+    @timed_query
+    def get_category_interval(self, category_id1, category_id2,
+                              after_id=None, limit=DEFAULT_PAGE_SIZE,
+                              offset=0):
+        if category_id2 < category_id1:
+            return []
+        return self._select_page('categories',
+                                 'id BETWEEN :id1 AND :id2',
+                                 {'id1': category_id1, 'id2': category_id2},
+                                 after_id, limit, offset)
+
+    @timed_query
+    def get_products_interval(self, product_id1, product_id2, after_id=None,
+                              limit=DEFAULT_PAGE_SIZE, offset=0):
+        if product_id2 < product_id1:
+            return []
+        return self._select_page('products',
+                                 'id BETWEEN :id1 AND :id2',
+                                 {'id1': product_id1, 'id2': product_id2},
+                                 after_id, limit, offset,
+                                 PRODUCT_COLUMNS)
 
+    def _stream_rows(self, statement, batch_size):
+        connection = self._engine.connect()
+        try:
+            result = connection.execution_options(stream_results=True).\
+                                execute(statement)
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            connection.close()
+
+    def _product_conditions(self, category_id=None, since=None,
+                            properties=None, price_min=None, price_max=None):
+        conditions = ['products.deleted_at IS NULL']
+        params = {}
+        if category_id is not None:
+            conditions.append("""EXISTS
+                                 (SELECT 1 FROM product_subcategories
+                                 JOIN subcategories_lvl2
+                                 ON (subcategories_lvl2.id =
+                                 product_subcategories.subcat_lvl2_id)
+                                 JOIN subcategories_lvl1
+                                 ON (subcategories_lvl1.id =
+                                 subcategories_lvl2.subcat_lvl1_id)
+                                 WHERE product_subcategories.product_id =
+                                 products.id
+                                 AND subcategories_lvl1.category_id=
+                                 :category_id)""")
+            params['category_id'] = category_id
+        if since is not None:
+            conditions.append('products.parsed_at >= :since')
+            params['since'] = since
+        if price_min is not None:
+            conditions.append('products.price >= :price_min')
+            params['price_min'] = price_min
+        if price_max is not None:
+            conditions.append('products.price <= :price_max')
+            params['price_max'] = price_max
+        if self._property_storage == 'jsonb' and properties:
+            return self._compact_property_conditions(conditions, params,
+                                                     properties)
+        for number, (name, values) in enumerate(
+                                        sorted((properties or {}).items())):
+            conditions.append("""products.id IN
+                                 (SELECT product_id FROM product_properties
+                                 WHERE name=:property_name_{0}
+                                 AND value = ANY(:property_values_{0})
+                                 AND deleted_at IS NULL)""".format(number))
+            params['property_name_{}'.format(number)] = name
+            params['property_values_{}'.format(number)] = list(values)
+        return ' AND '.join(conditions), params
+
+    def _compact_property_conditions(self, conditions, params, properties):
+        name_ids = self._get_property_name_ids(list(properties), create=False)
+        for number, (name, values) in enumerate(sorted(properties.items())):
+            if name not in name_ids:
+                conditions.append('FALSE')
+                continue
+            alternatives = []
+            for value_number, value in enumerate(values):
+                key = 'property_{}_{}'.format(number, value_number)
+                alternatives.append('products.properties @> CAST(:{} AS jsonb)'
+                                    .format(key))
+                params[key] = json.dumps({str(name_ids[name]): value},
+                                         ensure_ascii=False)
+            conditions.append('({})'.format(' OR '.join(alternatives)))
+        return ' AND '.join(conditions), params
+
+    def stream_products(self, category_id=None, since=None,
+                        batch_size=EXPORT_BATCH_SIZE):
+        condition, params = self._product_conditions(category_id, since)
+        columns = ', '.join('products.' + column
+                            for column in PRODUCT_COLUMNS)
+        statement = text("""SELECT {} FROM products
+                            WHERE {}
+                            ORDER BY products.id;""".format(columns,
+                                                            condition)).\
+                            bindparams(**params)
+        return self._stream_rows(statement, batch_size)
+
+    def stream_product_properties(self, category_id=None, since=None,
+                                  batch_size=EXPORT_BATCH_SIZE):
+        condition, params = self._product_conditions(category_id, since)
+        columns = ', '.join('product_properties.' + column
+                            for column in self.property_columns)
+        statement = text("""SELECT {} FROM {} AS product_properties
+                            JOIN products
+                            ON (products.id = product_properties.product_id)
+                            WHERE {}
+                            AND product_properties.deleted_at IS NULL
+                            ORDER BY product_properties.product_id;""".format(
+                                columns, self._properties_source,
+                                condition)).\
+                            bindparams(**params)
+        return self._stream_rows(statement, batch_size)
+
+    @timed_query
     def get_subcategories_lvl1(self, category_id):
         statement = text("""SELECT * FROM subcategories_lvl1
                             WHERE category_id=:category_id
                             AND deleted_at IS NULL""").\
                             bindparams(category_id=category_id)
         proxy_obj = self._query(statement)
-        return self._create_list_of_dictionaries(proxy_obj)
-
-    def get_products_filtered_by_price(self, low, hight):
-        statement = """SELECT * FROM products
-                       WHERE price
-                       BETWEEN {} AND {}
-                       AND deleted_at IS NULL;""".format(low,
-                                                         hight)
-        proxy_obj = self._query(statement)
-        return self._create_list_of_dictionaries(proxy_obj)
+        return self._row_set(proxy_obj)
+
+    @timed_query
+    def get_products_filtered_by_price(self, low, hight, after_id=None,
+                                       limit=DEFAULT_PAGE_SIZE, offset=0):
+        return self._select_page('products',
+                                 'price BETWEEN :low AND :high',
+                                 {'low': low, 'high': hight},
+                                 after_id, limit, offset,
+                                 PRODUCT_COLUMNS)
+
+    @timed_query
+    def get_products_filtered_by_name(self, name, after_id=None,
+                                      limit=DEFAULT_PAGE_SIZE, offset=0):
+        pattern = '%{}%'.format(name.replace('\\', '\\\\')
+                                    .replace('%', '\\%')
+                                    .replace('_', '\\_'))
+        return self._select_page('products',
+                                 'name::text LIKE :pattern',
+                                 {'pattern': pattern},
+                                 after_id, limit, offset,
+                                 PRODUCT_COLUMNS)
 
-    def get_products_filtered_by_name(self, name):
-        statement = text("""SELECT * FROM PRODUCTS
-                            WHERE NAME::text
-                            LIKE '%{}%';""".format(name))
+    @timed_query
+    def search_products(self, query, limit=DEFAULT_PAGE_SIZE, offset=0):
+        statement = text("""SELECT {}, ts_rank_cd(search_vector, query) AS rank
+                            FROM products,
+                            websearch_to_tsquery('russian', :query) AS query
+                            WHERE search_vector @@ query
+                            AND deleted_at IS NULL
+                            ORDER BY rank DESC, id
+                            LIMIT :limit
+                            OFFSET :offset;""".format(
+                                ', '.join('products.' + column
+                                          for column in PRODUCT_COLUMNS))).\
+                            bindparams(query=query, limit=limit,
+                                       offset=offset)
         proxy_obj = self._query(statement)
-        return self._create_list_of_dictionaries(proxy_obj)
+        return self._row_set(proxy_obj)
+
+    @timed_query
+    def filter_products(self, category_id=None, properties=None,
+                        price_min=None, price_max=None, after_id=None,
+                        limit=DEFAULT_PAGE_SIZE, offset=0):
+        condition, params = self._product_conditions(
+                                            category_id,
+                                            properties=properties,
+                                            price_min=price_min,
+                                            price_max=price_max)
+        return self._select_page('products', condition, params, after_id,
+                                 limit, offset, PRODUCT_COLUMNS)
+
+    @timed_query
+    def get_facet_counts(self, category_id=None, properties=None,
+                         price_min=None, price_max=None,
+                         values_per_facet=FACET_VALUES_LIMIT):
+        if (category_id is not None and not properties and
+                price_min is None and price_max is None):
+            params = {'category_id': category_id}
+            counts = """SELECT name, value, product_count AS count
+                        FROM category_facets
+                        WHERE category_id=:category_id"""
+        else:
+            condition, params = self._product_conditions(
+                                                category_id,
+                                                properties=properties,
+                                                price_min=price_min,
+                                                price_max=price_max)
+            counts = """SELECT name, value, COUNT(*) AS count
+                        FROM {}
+                        WHERE product_id IN (SELECT products.id
+                                             FROM products
+                                             WHERE {})
+                        AND deleted_at IS NULL
+                        AND name IS NOT NULL
+                        AND value IS NOT NULL
+                        GROUP BY name, value""".format(
+                            self._properties_source, condition)
+        statement = text("""SELECT name, value, count FROM
+                            (SELECT name, value, count,
+                            ROW_NUMBER() OVER (PARTITION BY name
+                                               ORDER BY count DESC, value)
+                            AS position
+                            FROM ({}) AS counts) AS ranked
+                            WHERE position <= :values_per_facet
+                            ORDER BY name, count DESC, value;""".format(
+                                counts)).\
+                            bindparams(values_per_facet=values_per_facet,
+                                       **params)
+        facets = {}
+        for name, value, count in self._query(statement):
+            facets.setdefault(name, {})[value] = int(count)
+        return facets
+
+    @timed_query
+    def refresh_category_facets(self):
+        with self._transaction() as connection:
+            category_ids = [row[0] for row in connection.execute(
+                                """DELETE FROM category_facets_dirty
+                                   RETURNING category_id;""")]
+            if len(category_ids) == 0:
+                return 0
+            connection.execute(text("""DELETE FROM category_facets
+                                       WHERE category_id = ANY(:ids);"""),
+                               ids=category_ids)
+            connection.execute(text("""INSERT INTO category_facets
+                                       (category_id, name, value,
+                                       product_count)
+                                       SELECT product_categories.category_id,
+                                       product_properties.name,
+                                       product_properties.value, COUNT(*)
+                                       FROM {} AS product_properties
+                                       JOIN products ON (products.id =
+                                       product_properties.product_id)
+                                       JOIN (SELECT DISTINCT
+                                             links.product_id,
+                                             lvl1.category_id
+                                             FROM product_subcategories
+                                             AS links
+                                             JOIN subcategories_lvl2 AS lvl2
+                                             ON (lvl2.id =
+                                             links.subcat_lvl2_id)
+                                             JOIN subcategories_lvl1 AS lvl1
+                                             ON (lvl1.id =
+                                             lvl2.subcat_lvl1_id)
+                                             WHERE lvl1.category_id
+                                             = ANY(:ids))
+                                       AS product_categories
+                                       ON (product_categories.product_id =
+                                       products.id)
+                                       WHERE product_properties.deleted_at
+                                       IS NULL
+                                       AND products.deleted_at IS NULL
+                                       AND product_properties.name
+                                       IS NOT NULL
+                                       AND product_properties.value
+                                       IS NOT NULL
+                                       GROUP BY
+                                       product_categories.category_id,
+                                       product_properties.name,
+                                       product_properties.value;"""
+                                    .format(self._properties_source)),
+                               ids=category_ids)
+        logging.info('db.Refreshed facet counts of {} categories'
+                     .format(len(category_ids)))
+        return len(category_ids)
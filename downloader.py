@@ -1,68 +1,342 @@
 from db_connect import Postgres_db
-from parse import Parser
+from db_configurator import get_crawler_config
+from bloom import url_filter_from_config
+from metrics import start_metrics_server
+from rate_control import rate_controller_from_config
+from rate_control import retry_policy_from_config
+from parse import ListingPageError, Parser
+from pipeline import ProductPipeline
 import logging
+import os
+import socket
 
 
 class Downloader:
 
-    def __init__(self, db_config, create_new_tables=False):
+    def __init__(self, db_config, create_new_tables=False,
+                 concurrency=10, per_host_limit=4, parser=None,
+                 worker_id=None, lease_seconds=600, api_cache=None):
         self._db = Postgres_db(db_config)
-        self._parser = Parser()
+        if api_cache is not None:
+            self._db.add_change_listener(api_cache.invalidate)
+        if worker_id is None:
+            worker_id = '{}-{}'.format(socket.gethostname(), os.getpid())
+        self._worker_id = worker_id
+        self._lease_seconds = lease_seconds
+        crawler_config = get_crawler_config()
+        self._max_fetch_errors = crawler_config['MAX_FETCH_ERRORS']
+        self._url_filter = url_filter_from_config()
+        if parser is None:
+            parser = Parser(concurrency=concurrency,
+                            per_host_limit=per_host_limit,
+                            timeout=crawler_config['TIMEOUT'],
+                            retry_policy=retry_policy_from_config(),
+                            rate_controller=rate_controller_from_config(
+                                                                concurrency))
+        self._parser = parser
         if create_new_tables is True:
             try:
                 self._db.drop_existing_tables_from_db()
             except Exception as e:
                 logging.exception(e)
             self._db.create_tables()
+        self._db.migrate()
 
-    def parse_product_url_from_subcats_lvl2(self, number_of_subcats=10):
-        for i in range(number_of_subcats):
+    def _claim_subcats_lvl2(self, number_of_subcats):
+        return self._db.claim_unparsed_subcat_lvl2_entries(
+                                                    self._worker_id,
+                                                    number_of_subcats,
+                                                    self._lease_seconds)
+
+    def claim_products(self, number_of_products, extra_lease_seconds=0):
+        return self._claim_products(number_of_products, extra_lease_seconds)
+
+    def _claim_products(self, number_of_products, extra_lease_seconds=0):
+        return self._db.claim_unparsed_product_entries(
+                                    self._worker_id, number_of_products,
+                                    self._lease_seconds + extra_lease_seconds)
+
+    def _store_lvl2_page(self, subcat_lvl2_id, page_url, product_urls,
+                         subpage_urls=()):
+        url_filter = self._url_filter
+        if url_filter is None:
+            return self._db.lvl2_page_store(subcat_lvl2_id, page_url,
+                                            product_urls, subpage_urls)
+        new_urls = []
+        known_urls = []
+        for url in product_urls:
+            if url in url_filter:
+                known_urls.append(url)
+            else:
+                new_urls.append(url)
+        inserted = self._db.lvl2_page_store(subcat_lvl2_id, page_url,
+                                            new_urls, subpage_urls,
+                                            known_urls)
+        for url in new_urls:
+            url_filter.add(url)
+        return inserted
+
+    async def _parse_subcat_lvl2_pages(self, entry_dict, pending):
+        subpage_urls = pending.get(entry_dict['id'])
+        if subpage_urls is None:
             try:
-                dict_ = self._db.get_unparsed_subcat_lvl2_entry()
-                product_dicts = self._parser\
-                                .get_product_urls_from_lvl2_url(dict_['url'],
-                                                                dict_['id'],
-                                                                dict_['name'])
-                for product_dict in product_dicts:
-                    self._db.product_initial_insert(product_dict)
-                self._db.update_lvl2_entry_set_parsed_at(entry_dict['id'])
-            except Exception as e:
-                logging.exception(e)
-                pass
-        return True
+                page = await self._parser.async_get_lvl2_first_page(
+                                                        entry_dict['url'])
+            except ListingPageError as e:
+                if e.response_code != 404:
+                    raise
+                self._db.remove_subcat_lvl2_entry(entry_dict['id'])
+                return
+            self._store_lvl2_page(entry_dict['id'], entry_dict['url'],
+                                  page['product_urls'], page['subpage_urls'])
+            subpage_urls = page['subpage_urls']
+        failed = None
+        async for url, product_urls, error in \
+                self._parser.async_get_product_urls_from_subpages(
+                                                        subpage_urls):
+            if error is not None:
+                logging.error('Failed to fetch sub-page {}'.format(url),
+                              exc_info=error)
+                failed = error
+                continue
+            self._store_lvl2_page(entry_dict['id'], url, product_urls)
+        if failed is not None:
+            raise failed
+        self._db.update_lvl2_entry_set_parsed_at(entry_dict['id'])
+
+    def parse_product_url_from_subcats_lvl2(self, number_of_subcats=10):
+        entries = self._claim_subcats_lvl2(number_of_subcats)
+        pending = self._db.get_pending_lvl2_subpages(
+                                    [dict_['id'] for dict_ in entries])
+
+        async def fetch_entry(entry_dict):
+            return await self._parse_subcat_lvl2_pages(entry_dict, pending)
+
+        for dict_ in entries:
+            self._parser.fetcher.run(fetch_entry, [dict_],
+                                     self._store_lvl2_result)
+        return len(entries)
+
+    def _store_lvl2_result(self, entry_dict, result, error):
+        if error is None:
+            return
+        self._db.lvl2_entry_update_fetch_error(
+                        entry_dict['id'],
+                        getattr(error, 'response_code', None),
+                        self._max_fetch_errors)
 
     def parse_products_parameters(self, number_of_products_to_parse=20):
-        for i in range(number_of_products_to_parse):
-            entry_dict = self._db.get_unparsed_product_entry()
+        entries = self._claim_products(number_of_products_to_parse)
+        for entry_dict in entries:
             entry_id = entry_dict['id']
             entry_url = entry_dict['url']
-            product_dict, response_code = self._parser\
-                                          .get_product_parameters(entry_url)
+            try:
+                product_dict, response_code = self._parser\
+                                              .get_product_parameters(entry_url)
+                self._store_product_parameters(entry_id, product_dict,
+                                               response_code)
+            except Exception as e:
+                logging.exception(e)
+        return len(entries)
+
+    def _store_product_parameters(self, entry_id, product_dict,
+                                  response_code):
+        if response_code == 200:
+            self._db.product_update(entry_id, product_dict)
+            self._db.product_features_bulk_insert(
+                                        entry_id,
+                                        product_dict['characteristics'])
+        elif response_code == 404:
+            self._db.remove_entry_from_product_table(entry_id)
+        else:
+            self._db.product_update_uknown_error(
+                            entry_id, response_code,
+                            self._max_fetch_errors)
+
+    def parse_products_parameters_concurrently(self,
+                                               number_of_products_to_parse=100):
+        entries = self._claim_products(number_of_products_to_parse)
+
+        async def fetch_entry(entry_dict):
+            return await self._parser\
+                         .async_get_product_parameters(entry_dict['url'])
+
+        def store_entry(entry_dict, result, error):
+            if error is not None:
+                return
+            product_dict, response_code = result
+            self._store_product_parameters(entry_dict['id'], product_dict,
+                                           response_code)
+
+        self._parser.fetcher.run(fetch_entry, entries, store_entry)
+        return len(entries)
+
+    def parse_claimed_products(self, entries, write_batch_size=50):
+        parsed = []
+
+        async def fetch_entry(entry_dict):
+            return await self._parser\
+                         .async_get_product_parameters(entry_dict['url'])
+
+        def store_entry(entry_dict, result, error):
+            if error is not None:
+                return
+            product_dict, response_code = result
             if response_code == 200:
-                self._db.product_update(entry_id, product_dict)
-                feature_dict = product_dict['characteristics']
-                for feature in feature_dict:
-                    feature_value = feature_dict[str(feature)]
-                    self._db.product_features_insert(feature, feature_value,
-                                                     entry_id)
-            elif response_code == 404:
-                self._db.remove_entry_from_product_table(entry_id)
+                parsed.append((entry_dict['id'], product_dict))
+                if len(parsed) >= write_batch_size:
+                    self._db.products_bulk_update(parsed,
+                                                  replace_properties=True)
+                    del parsed[:]
             else:
-                self._db.product_update_uknown_error(entry_id, response_code)
-            return entry_id
+                self._store_product_parameters(entry_dict['id'],
+                                               product_dict, response_code)
+
+        self._parser.fetcher.run(fetch_entry, entries, store_entry)
+        self._db.products_bulk_update(parsed, replace_properties=True)
+        return len(entries)
+
+    def refresh_products(self, number_of_products=500):
+        entries = self._db.claim_products_due_for_refresh(
+                                                    self._worker_id,
+                                                    number_of_products,
+                                                    self._lease_seconds)
+        parsed = []
+        checks = []
+
+        async def fetch_entry(entry_dict):
+            return await self._parser.async_get_page_if_changed(
+                                                entry_dict['url'],
+                                                entry_dict['etag'],
+                                                entry_dict['last_modified'],
+                                                entry_dict['content_hash'])
+
+        def store_entry(entry_dict, page, error):
+            if error is not None:
+                return
+            if page['response_code'] == 404:
+                self._db.remove_entry_from_product_table(entry_dict['id'])
+                return
+            if page['response_code'] not in (200, 304):
+                return
+            if page['changed']:
+                product_dict = self._parser.parse_product_html(page['html'])
+                parsed.append((entry_dict['id'], product_dict))
+            checks.append((entry_dict['id'], page['changed'], page['etag'],
+                           page['last_modified'], page['content_hash']))
+
+        self._parser.fetcher.run(fetch_entry, entries, store_entry)
+        self._db.products_bulk_update(parsed, replace_properties=True)
+        self._db.products_mark_checked(checks)
+        logging.info('Refreshed {} products: {} checked, {} changed'
+                     .format(len(entries), len(checks), len(parsed)))
+        return {'claimed': len(entries), 'checked': len(checks),
+                'changed': len(parsed)}
+
+    def refresh_subcats_lvl2(self, number_of_subcats=50):
+        entries = self._db.claim_subcats_lvl2_due_for_refresh(
+                                                    self._worker_id,
+                                                    number_of_subcats,
+                                                    self._lease_seconds)
+        checks = []
+        new_products = 0
+        for entry_dict in entries:
+            try:
+                page = self._parser.get_page_if_changed(
+                                                entry_dict['url'],
+                                                entry_dict['etag'],
+                                                entry_dict['last_modified'],
+                                                entry_dict['content_hash'])
+                if page['response_code'] == 404:
+                    self._db.remove_subcat_lvl2_entry(entry_dict['id'])
+                    continue
+                if page['response_code'] not in (200, 304):
+                    continue
+                if page['changed']:
+                    urls = self._parser.get_product_urls_from_lvl2_html(
+                                                        page['html'],
+                                                        entry_dict['url'])
+                    new_products += self._db.products_insert_missing(
+                                                        entry_dict['id'], urls)
+                checks.append((entry_dict['id'], page['changed'],
+                               page['etag'], page['last_modified'],
+                               page['content_hash']))
+            except Exception as e:
+                logging.exception(e)
+        self._db.subcats_lvl2_mark_checked(checks)
+        return {'claimed': len(entries), 'checked': len(checks),
+                'new_products': new_products}
+
+    def reparse_parsed_products(self, batch_size=500):
+        after_id = 0
+        reparsed = 0
+        while True:
+            entries = self._db.get_parsed_product_entries(after_id,
+                                                          batch_size)
+            if len(entries) == 0:
+                break
+            results = []
+            for entry_dict in entries:
+                try:
+                    product_dict, response_code = self._parser\
+                                    .get_product_parameters(entry_dict['url'])
+                except Exception as e:
+                    logging.exception(e)
+                    continue
+                if response_code == 200:
+                    results.append((entry_dict['id'], product_dict))
+            self._db.products_bulk_update(results, replace_properties=True)
+            reparsed += len(results)
+            after_id = entries[-1]['id']
+        return reparsed
+
+    def schedule_full_refresh(self):
+        return self._db.schedule_full_refresh()
+
+    def parse_products_pipeline(self, number_of_products_to_parse=500,
+                                fetch_workers=8, parse_workers=None,
+                                queue_size=64, write_batch_size=50):
+        entries = self._claim_products(number_of_products_to_parse)
+        pipeline = ProductPipeline(self._db, self._parser,
+                                   self._store_product_parameters,
+                                   fetch_workers=fetch_workers,
+                                   parse_workers=parse_workers,
+                                   queue_size=queue_size,
+                                   write_batch_size=write_batch_size)
+        stats = pipeline.run(entries)
+        logging.info('Pipeline stats {}'.format(stats))
+        return stats
+
+    def parse_product_url_from_subcats_lvl2_concurrently(self,
+                                                         number_of_subcats=10):
+        entries = self._claim_subcats_lvl2(number_of_subcats)
+        pending = self._db.get_pending_lvl2_subpages(
+                                    [dict_['id'] for dict_ in entries])
+
+        async def fetch_entry(entry_dict):
+            return await self._parse_subcat_lvl2_pages(entry_dict, pending)
+
+        self._parser.fetcher.run(fetch_entry, entries,
+                                 self._store_lvl2_result)
+        return len(entries)
 
     def parse_main_catalog_page_single_run(self):
-        for category in self._parser.get_categories():
-            category_id = self._db.category_item_insert(category)
-            for lvl1_name, lvl1_parent in self._parser.get_lvl1_subcategories():
-                if lvl1_parent == category:
-                    lvl1_id = self._db.subcat_lvl1_insert(lvl1_name,
-                                                                  category_id)
-                    for lvl2_dict in self._parser.get_lvl2_subcategories():
-                        if lvl2_dict['parent'] == lvl1_name:
-                            self._db.subcat_lvl2_insert(lvl2_dict, lvl1_id)
+        catalog_tree = self._parser.get_catalog_tree()
+        self._db.catalog_tree_insert(catalog_tree)
         return True
 
+    def refresh_category_facets(self):
+        return self._db.refresh_category_facets()
+
+    def start_metrics_server(self, port_offset=0):
+        return start_metrics_server(self._db, port_offset)
+
+    def count_parsed_products(self):
+        return self._db.count_parsed_products()
+
+    def close(self):
+        self._db.close()
+
     def check_if_stage1_parsing_is_complete(self):
         return self._db.check_if_subcats_lvl2_table_is_not_empty()
 
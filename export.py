@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import io
+import sys
+import zlib
+from datetime import datetime
+from db_connect import Postgres_db, PRODUCT_COLUMNS, PROPERTY_COLUMNS
+from db_configurator import get_config_string
+from serialize import dumps
+
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_MIMETYPES = {
+                    'ndjson': 'application/x-ndjson',
+                    'csv': 'text/csv',
+                    }
+EXPORT_COLUMNS = {
+                  'products': PRODUCT_COLUMNS,
+                  'properties': PROPERTY_COLUMNS,
+                  }
+
+
+def export_columns(db, export_name):
+    if export_name == 'products':
+        return PRODUCT_COLUMNS
+    return db.property_columns
+
+
+def stream_export(db, export_name, category_id=None, since=None):
+    if export_name == 'products':
+        return db.stream_products(category_id=category_id, since=since)
+    return db.stream_product_properties(category_id=category_id, since=since)
+
+
+def _ndjson_chunks(batches, columns):
+    for rows in batches:
+        yield b''.join(dumps(dict(zip(columns, row))) + b'\n'
+                       for row in rows)
+
+
+def _csv_chunks(batches, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(batches, columns, export_format='ndjson', compress=False):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError('Unknown export format {}'.format(export_format))
+    if export_format == 'ndjson':
+        chunks = _ndjson_chunks(batches, columns)
+    else:
+        chunks = _csv_chunks(batches, columns)
+    if compress:
+        chunks = _gzip_chunks(chunks)
+    return chunks
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+                 description='Stream the catalog out of the database')
+    arg_parser.add_argument('export_name', choices=sorted(EXPORT_COLUMNS))
+    arg_parser.add_argument('--format', dest='export_format',
+                            choices=EXPORT_FORMATS, default='ndjson')
+    arg_parser.add_argument('--gzip', action='store_true')
+    arg_parser.add_argument('--category', type=int, default=None)
+    arg_parser.add_argument('--since', type=datetime.fromisoformat,
+                            default=None,
+                            help='only products parsed at or after this '
+                                 'ISO timestamp')
+    arg_parser.add_argument('--output', '-o', default='-')
+    args = arg_parser.parse_args()
+    db = Postgres_db(get_config_string())
+    batches = stream_export(db, args.export_name, args.category, args.since)
+    chunks = export_chunks(batches, export_columns(db, args.export_name),
+                           args.export_format, args.gzip)
+    if args.output == '-':
+        output = sys.stdout.buffer
+    else:
+        output = open(args.output, 'wb')
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    finally:
+        if output is not sys.stdout.buffer:
+            output.close()
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+class AsyncFetcher:
+
+    def __init__(self, fetch_func, concurrency=10, per_host_limit=4):
+        self._fetch_func = fetch_func
+        self._concurrency = concurrency
+        self._per_host_limit = per_host_limit
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._loop = None
+        self._semaphore = None
+        self._host_semaphores = {}
+
+    def _get_semaphores(self, url):
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+            self._host_semaphores = {}
+        host = urlsplit(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(
+                                                    self._per_host_limit)
+        return self._semaphore, self._host_semaphores[host]
+
+    async def fetch(self, url, *args):
+        semaphore, host_semaphore = self._get_semaphores(url)
+        async with host_semaphore:
+            async with semaphore:
+                loop = asyncio.get_event_loop()
+                return await loop.run_in_executor(self._executor,
+                                                  self._fetch_func, url,
+                                                  *args)
+
+    async def _settle(self, coro_func, item):
+        try:
+            return item, await coro_func(item), None
+        except Exception as e:
+            return item, None, e
+
+    async def as_completed(self, coro_func, items):
+        tasks = [asyncio.ensure_future(self._settle(coro_func, item))
+                 for item in items]
+        for future in asyncio.as_completed(tasks):
+            yield await future
+
+    async def _consume(self, coro_func, items, callback):
+        async for item, result, error in self.as_completed(coro_func, items):
+            if error is not None:
+                logging.error('Failed to process {}'.format(item),
+                              exc_info=error)
+            callback(item, result, error)
+
+    def run(self, coro_func, items, callback):
+        loop = asyncio.new_event_loop()
+        try:
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self._consume(coro_func, items, callback))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        return True
@@ -1,20 +1,191 @@
 import sys
 import os
-from flask import Flask, request, jsonify, abort
-from flask_sqlalchemy import SQLAlchemy
-from db_connect import Postgres_db
-from db_configurator import get_config_string
+import base64
+import binascii
+import json
+import re
+from datetime import datetime
+from functools import partial
+import time
+from flask import Flask, Response, g, request, jsonify, abort
+from db_connect import Postgres_db, DEFAULT_PAGE_SIZE
+from db_configurator import get_config_string, get_metrics_config
+from api_cache import api_cache_from_config, make_etag
+from export import EXPORT_COLUMNS, EXPORT_FORMATS, EXPORT_MIMETYPES
+from export import export_chunks, export_columns, stream_export
+from ingest import ingest_products, parse_ndjson
+from metrics import API_REQUEST_SECONDS, latest, register_queue_depth
+from serialize import dumps
+from urls import normalize_url
 
 
 db_config = get_config_string()
 db = Postgres_db(db_config)
+api_cache = api_cache_from_config()
+if api_cache is not None:
+    db.add_change_listener(api_cache.invalidate)
+if get_metrics_config()['QUEUE_DEPTH'] is True:
+    register_queue_depth(db)
 app = Flask(__name__)
 basedir = os.path.abspath(os.path.dirname(__file__))
+MAX_PAGE_SIZE = 1000
+MAX_BATCH_IDS = 1000
+PROPERTY_ARG = re.compile(r'^prop\[(.+)\]$')
+ID_ARG = re.compile(r'^[0-9]+$')
+
+
+def _encode_page_token(key, value):
+    payload = json.dumps({key: value}).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def _decode_page_token(token, key):
+    padded = token + '=' * (-len(token) % 4)
+    try:
+        value = json.loads(base64.urlsafe_b64decode(padded))[key]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        return abort(400)
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        return abort(400)
+    return value
+
+
+def _int_arg(value):
+    try:
+        return int(value)
+    except ValueError:
+        return abort(400)
+
+
+def _url_arg(value):
+    if not isinstance(value, str):
+        return abort(400)
+    try:
+        return normalize_url(value)
+    except ValueError:
+        return abort(400)
+
+
+def _float_arg(name):
+    if name not in request.args:
+        return None
+    try:
+        return float(request.args[name])
+    except ValueError:
+        return abort(400)
+
+
+def _limit_offset_args():
+    limit = _int_arg(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    offset = _int_arg(request.args.get('offset', 0))
+    if limit < 1 or offset < 0:
+        return abort(400)
+    return min(limit, MAX_PAGE_SIZE), offset
+
+
+def _page_args():
+    limit, offset = _limit_offset_args()
+    after_id = None
+    if 'page_token' in request.args:
+        after_id = _decode_page_token(request.args['page_token'], 'after_id')
+        offset = 0
+    return after_id, limit, offset
+
+
+def _query_ids(value):
+    return [int(item) if ID_ARG.match(item) else item
+            for item in value.split(',')]
+
+
+def _batch_ids(values):
+    product_ids = list(values)
+    if any(not isinstance(value, int) or isinstance(value, bool)
+           for value in product_ids):
+        return abort(400)
+    if not product_ids or len(product_ids) > MAX_BATCH_IDS:
+        return abort(400)
+    return product_ids
+
+
+def _batch_response(product_ids, include):
+    products = db.get_products_with_properties(
+                            product_ids, include_properties='properties'
+                            in include,
+                            include_subcategories='subcategories' in include)
+    found = set(product['id'] for product in products)
+    return _json_response({
+                           'products': products,
+                           'missing': [product_id for product_id in
+                                       dict.fromkeys(product_ids)
+                                       if product_id not in found],
+                           })
+
+
+def _json_response(obj):
+    if hasattr(obj, 'to_json'):
+        return Response(obj.to_json(), mimetype='application/json')
+    return Response(dumps(obj), mimetype='application/json')
+
+
+def _cached_response(resource, resource_id, fetch_rows):
+    resource_id = _int_arg(resource_id)
+    cached = None
+    if api_cache is not None:
+        cached = api_cache.get(resource, resource_id)
+    if cached is None:
+        rows = fetch_rows(resource_id)
+        if len(rows) == 0:
+            return abort(404)
+        body = rows.to_json()
+        if api_cache is not None:
+            cached = api_cache.set(resource, resource_id, body)
+        else:
+            cached = (make_etag(body), body)
+    etag, body = cached
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+
+def _paginated_response(fetch_page):
+    after_id, limit, offset = _page_args()
+    rows = fetch_page(after_id=after_id, limit=limit + 1, offset=offset)
+    if len(rows) == 0:
+        return abort(404)
+    response = _json_response(rows[:limit])
+    if len(rows) > limit:
+        response.headers['X-Next-Page-Token'] = \
+            _encode_page_token('after_id', int(rows[limit - 1]['id']))
+    return response
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        API_REQUEST_SECONDS.labels(endpoint, request.method,
+                                   str(response.status_code))\
+            .observe(time.perf_counter() - started)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    body, content_type = latest()
+    return Response(body, content_type=content_type)
 
 @app.route('/product', methods=['POST'])
 def create_product():
     data = request.get_json()
-    initial_product_dict = {'url': data['url'], 'parent': data['parent']}
+    initial_product_dict = {'url': _url_arg(data['url']),
+                            'parent': data['parent']}
     product_id = db.product_initial_insert(initial_product_dict)
     product_dict = {'name': data['name'],
                     'price': data['price'],
@@ -24,14 +195,67 @@ def create_product():
                     'is_trend': data['is_trend']
                     }
     db.product_update(product_id, product_dict)
-    return jsonify(db.get_product_by_id(product_id))
+    return _json_response(db.get_product_by_id(product_id))
+
+@app.route('/products/bulk', methods=['POST'])
+def bulk_ingest_products():
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items = parse_ndjson(request.stream)
+    else:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list):
+            return abort(400)
+    results = ingest_products(db, items)
+    summary = {status: 0 for status in ('created', 'updated', 'invalid',
+                                        'error')}
+    for result in results:
+        summary[result['status']] += 1
+    return _json_response(dict(summary, results=results))
+
+@app.route('/products', methods=['GET'])
+def filter_products():
+    if 'ids' in request.args:
+        return _batch_response(_batch_ids(_query_ids(request.args['ids'])),
+                               request.args.get('include', '').split(','))
+    category_id = request.args.get('category')
+    if category_id is not None:
+        category_id = _int_arg(category_id)
+    properties = {}
+    for arg_name in request.args:
+        match = PROPERTY_ARG.match(arg_name)
+        if match is not None:
+            properties[match.group(1)] = request.args.getlist(arg_name)
+    filters = {
+               'category_id': category_id,
+               'properties': properties,
+               'price_min': _float_arg('price_min'),
+               'price_max': _float_arg('price_max'),
+               }
+    after_id, limit, offset = _page_args()
+    rows = db.filter_products(after_id=after_id, limit=limit + 1,
+                              offset=offset, **filters)
+    response = _json_response({
+                               'products': rows[:limit].to_dicts(),
+                               'facets': db.get_facet_counts(**filters),
+                               })
+    if len(rows) > limit:
+        response.headers['X-Next-Page-Token'] = \
+            _encode_page_token('after_id', int(rows[limit - 1]['id']))
+    return response
+
+@app.route('/products/batch', methods=['POST'])
+def get_products_batch():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('ids'), list):
+        return abort(400)
+    include = data.get('include', ['properties'])
+    if not isinstance(include, list):
+        return abort(400)
+    return _batch_response(_batch_ids(data['ids']), include)
 
 @app.route('/products/<product_id>', methods=['GET'])
 def get_product(product_id):
-    product = db.get_product_by_id(product_id)
-    if len(product) == 0:
-        return abort(404)
-    return jsonify(product)
+    return _cached_response('product', product_id, db.get_product_by_id)
 
 @app.route('/products/<product_id>', methods=['DELETE'])
 def delete_product(product_id):
@@ -40,43 +264,49 @@ def delete_product(product_id):
 
 @app.route('/products/<product_id1>-<product_id2>', methods=['GET'])
 def get_products_interval(product_id1, product_id2):
-    limit = int(request.args.get('limit', None))
-    offset = int(request.args.get('offset', None))
-    products = db.get_products_interval(product_id1, product_id2)
-    if len(products) == 0:
-        return abort(404)
-    if limit is None or offset is None:
-        return jsonify(products)
-    return jsonify(products[offset:offset+limit])
+    return _paginated_response(partial(db.get_products_interval,
+                                       _int_arg(product_id1),
+                                       _int_arg(product_id2)))
+
+@app.route('/products/search', methods=['GET'])
+def search_products():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return abort(400)
+    limit, offset = _limit_offset_args()
+    if 'page_token' in request.args:
+        offset = _decode_page_token(request.args['page_token'], 'offset')
+    rows = db.search_products(query, limit=limit + 1, offset=offset)
+    response = _json_response(rows[:limit])
+    if len(rows) > limit:
+        response.headers['X-Next-Page-Token'] = \
+            _encode_page_token('offset', offset + limit)
+    return response
 
 @app.route('/products/<product_id>/properties', methods=['GET'])
 def get_product_properties(product_id):
-    product = db.get_product_properties(product_id)
-    if len(product) == 0:
-        return abort(404)
-    return jsonify(product)
+    return _cached_response('product_properties', product_id,
+                            db.get_product_properties)
 
 @app.route('/products/property', methods=['GET'])
 def get_product_by_name_or_price_range():
     if 'name' in request.args:
         name = request.args['name']
-        product = db.get_products_filtered_by_name(name)
+        fetch_page = partial(db.get_products_filtered_by_name, name)
     elif 'low' in request.args and 'high' in request.args:
-        low = float(request.args['low'])
-        high = float(request.args['high'])
-        product = db.get_products_filtered_by_price(low, high)
+        try:
+            low = float(request.args['low'])
+            high = float(request.args['high'])
+        except ValueError:
+            return abort(400)
+        fetch_page = partial(db.get_products_filtered_by_price, low, high)
     else:
         return abort(404)
-    if len(product) == 0:
-        return abort(404)
-    return jsonify(product)
+    return _paginated_response(fetch_page)
 
 @app.route('/categories/<category_id>', methods=['GET'])
 def get_category(category_id):
-    category = db.get_category(category_id)
-    if len(category) == 0:
-        return abort(404)
-    return jsonify(category)
+    return _cached_response('category', category_id, db.get_category)
 
 @app.route('/categories/<category_id>', methods=['DELETE'])
 def delete_category(category_id):
@@ -85,17 +315,46 @@ def delete_category(category_id):
 
 @app.route('/categories/<category_id1>-<category_id2>', methods=['GET'])
 def get_category_interval(category_id1, category_id2):
-    category = db.get_category_interval(category_id1, category_id2)
-    if len(category) == 0:
-        return abort(404)
-    return jsonify(category)
+    return _paginated_response(partial(db.get_category_interval,
+                                       _int_arg(category_id1),
+                                       _int_arg(category_id2)))
 
 @app.route('/categories/<category_id>/subcategories-level1', methods=['GET'])
 def get_subcategories_lvl1(category_id):
-    subcategories_level1 = db.get_subcategories_lvl1(category_id)
-    if len(subcategories_level1) == 0:
+    return _cached_response('subcategories_lvl1', category_id,
+                            db.get_subcategories_lvl1)
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    if api_cache is None:
+        return jsonify({})
+    return jsonify(api_cache.stats())
+
+@app.route('/export/<export_name>', methods=['GET'])
+def export(export_name):
+    if export_name not in EXPORT_COLUMNS:
         return abort(404)
-    return jsonify(subcategories_level1)
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return abort(400)
+    category_id = request.args.get('category_id')
+    if category_id is not None:
+        category_id = _int_arg(category_id)
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            since = datetime.fromisoformat(since)
+        except ValueError:
+            return abort(400)
+    compress = request.args.get('gzip') in ('1', 'true')
+    batches = stream_export(db, export_name, category_id, since)
+    response = Response(export_chunks(batches,
+                                      export_columns(db, export_name),
+                                      export_format, compress),
+                        mimetype=EXPORT_MIMETYPES[export_format])
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 if __name__ == '__main__':
     app.run(debug=True)
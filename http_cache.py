@@ -0,0 +1,155 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+CACHE_MODES = ('record', 'replay')
+
+
+class CacheMiss(KeyError):
+    pass
+
+
+class CachedResponse:
+
+    def __init__(self, url, status_code, content, headers, encoding):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+
+class ResponseCache:
+
+    def __init__(self, directory, ttl=None, max_bytes=1024 ** 3,
+                 mode='record'):
+        if mode not in CACHE_MODES:
+            raise ValueError('Unknown cache mode {}'.format(mode))
+        self._directory = directory
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._mode = mode
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'blobs'), exist_ok=True)
+        self._index = sqlite3.connect(os.path.join(directory, 'index.sqlite'),
+                                      check_same_thread=False)
+        self._index.execute("""CREATE TABLE IF NOT EXISTS entries
+                               (url TEXT PRIMARY KEY,
+                               blob TEXT NOT NULL,
+                               status_code INTEGER NOT NULL,
+                               headers TEXT NOT NULL,
+                               encoding TEXT,
+                               stored_at REAL NOT NULL,
+                               accessed_at REAL NOT NULL)""")
+        self._index.execute("""CREATE TABLE IF NOT EXISTS blobs
+                               (blob TEXT PRIMARY KEY,
+                               size INTEGER NOT NULL)""")
+        self._index.execute("""CREATE INDEX IF NOT EXISTS
+                               entries_accessed_at_idx
+                               ON entries (accessed_at)""")
+        self._index.commit()
+
+    @property
+    def replay(self):
+        return self._mode == 'replay'
+
+    def _blob_path(self, blob):
+        return os.path.join(self._directory, 'blobs', blob[:2], blob + '.gz')
+
+    def get(self, url):
+        with self._lock:
+            row = self._index.execute("""SELECT blob, status_code, headers,
+                                         encoding, stored_at FROM entries
+                                         WHERE url=?""", (url,)).fetchone()
+            if row is None:
+                return None
+            blob, status_code, headers, encoding, stored_at = row
+            expired = (self._ttl is not None and
+                       time.time() - stored_at > self._ttl)
+            if expired and not self.replay:
+                return None
+            self._index.execute("""UPDATE entries SET accessed_at=?
+                                   WHERE url=?""", (time.time(), url))
+            self._index.commit()
+        try:
+            with gzip.open(self._blob_path(blob), 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        return CachedResponse(url, status_code, content,
+                              json.loads(headers), encoding)
+
+    def put(self, url, response):
+        content = response.content
+        blob = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(blob)
+        if not os.path.exists(path):
+            compressed = gzip.compress(content)
+            if len(compressed) > self._max_bytes:
+                logging.warning('Not caching {}: {} bytes exceed the cache '
+                                'size'.format(url, len(compressed)))
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary_path = '{}.{}.tmp'.format(path, threading.get_ident())
+            with open(temporary_path, 'wb') as f:
+                f.write(compressed)
+            os.replace(temporary_path, path)
+        headers = {name: value for name, value in response.headers.items()
+                   if name in ('ETag', 'Last-Modified', 'Content-Type')}
+        now = time.time()
+        with self._lock:
+            self._index.execute("""INSERT OR IGNORE INTO blobs VALUES (?, ?)""",
+                                (blob, os.path.getsize(path)))
+            self._index.execute("""INSERT OR REPLACE INTO entries
+                                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                                (url, blob, response.status_code,
+                                 json.dumps(headers), response.encoding,
+                                 now, now))
+            self._evict()
+            self._index.commit()
+        return blob
+
+    def _evict(self):
+        total = self._index.execute("""SELECT COALESCE(SUM(size), 0)
+                                       FROM blobs""").fetchone()[0]
+        while total > self._max_bytes:
+            row = self._index.execute("""SELECT url, blob FROM entries
+                                         ORDER BY accessed_at
+                                         LIMIT 1""").fetchone()
+            if row is None:
+                break
+            url, blob = row
+            self._index.execute("DELETE FROM entries WHERE url=?", (url,))
+            still_used = self._index.execute("""SELECT 1 FROM entries
+                                                WHERE blob=? LIMIT 1""",
+                                             (blob,)).fetchone()
+            if still_used is None:
+                size = self._index.execute("""SELECT size FROM blobs
+                                              WHERE blob=?""",
+                                           (blob,)).fetchone()[0]
+                self._index.execute("DELETE FROM blobs WHERE blob=?",
+                                    (blob,))
+                try:
+                    os.remove(self._blob_path(blob))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def urls(self):
+        with self._lock:
+            rows = self._index.execute("SELECT url FROM entries").fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._index.close()
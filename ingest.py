@@ -0,0 +1,151 @@
+import json
+import logging
+from decimal import Decimal, InvalidOperation
+from urls import normalize_url
+
+
+INGEST_CHUNK_SIZE = 2000
+MAX_PRICE = Decimal('9999.99')
+MAX_URL_LENGTH = 255
+MAX_NAME_LENGTH = 255
+OPTIONAL_TEXT_FIELDS = ('product_units', 'description', 'image_url')
+
+
+def parse_ndjson(lines):
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode()
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield ValueError('invalid JSON')
+
+
+def _text(item, name, max_length=None, required=False):
+    value = item.get(name)
+    if value is None:
+        if required:
+            raise ValueError('{} is required'.format(name))
+        return None
+    if not isinstance(value, str) or (required and not value.strip()):
+        raise ValueError('{} must be a non-empty string'.format(name))
+    if max_length is not None and len(value) > max_length:
+        raise ValueError('{} is longer than {} characters'
+                         .format(name, max_length))
+    return value
+
+
+def _price(item):
+    value = item.get('price')
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError('price must be a number')
+    try:
+        price = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError('price must be a number')
+    if not price.is_finite() or price < 0 or price > MAX_PRICE:
+        raise ValueError('price must be between 0 and {}'.format(MAX_PRICE))
+    return price
+
+
+def _characteristics(item):
+    value = item.get('characteristics')
+    if value is None:
+        return {}
+    if not isinstance(value, dict) or not all(
+            isinstance(name, str) and isinstance(feature, str)
+            for name, feature in value.items()):
+        raise ValueError('characteristics must map strings to strings')
+    return value
+
+
+def validate_product(item):
+    if isinstance(item, Exception):
+        raise item
+    if not isinstance(item, dict):
+        raise ValueError('product must be an object')
+    url = normalize_url(_text(item, 'url', MAX_URL_LENGTH, required=True))
+    subcat_lvl2_id = item.get('subcat_lvl2_id')
+    if subcat_lvl2_id is not None and (isinstance(subcat_lvl2_id, bool) or
+                                       not isinstance(subcat_lvl2_id, int)):
+        raise ValueError('subcat_lvl2_id must be an integer')
+    parent = _text(item, 'parent', required=subcat_lvl2_id is None)
+    is_trend = item.get('is_trend')
+    if is_trend is not None and not isinstance(is_trend, bool):
+        raise ValueError('is_trend must be a boolean')
+    product_dict = {
+                    'url': url,
+                    'parent': parent,
+                    'subcat_lvl2_id': subcat_lvl2_id,
+                    'name': _text(item, 'name', MAX_NAME_LENGTH,
+                                  required=True),
+                    'price': _price(item),
+                    'is_trend': is_trend,
+                    'characteristics': _characteristics(item),
+                    }
+    for name in OPTIONAL_TEXT_FIELDS:
+        product_dict[name] = _text(item, name)
+    return product_dict
+
+
+def _ingest_chunk(db, chunk, results):
+    names = [product['parent'] for _, product in chunk
+             if product['subcat_lvl2_id'] is None]
+    parents = db.get_subcats_lvl2_ids_by_name(names) if names else {}
+    ids = [product['subcat_lvl2_id'] for _, product in chunk
+           if product['subcat_lvl2_id'] is not None]
+    existing = db.get_existing_subcat_lvl2_ids(ids) if ids else set()
+    valid = []
+    for index, product in chunk:
+        if product['subcat_lvl2_id'] is None:
+            product['subcat_lvl2_id'] = parents.get(product['parent'])
+            if product['subcat_lvl2_id'] is None:
+                results[index] = {'index': index, 'url': product['url'],
+                                  'status': 'invalid',
+                                  'error': 'unknown parent {}'
+                                           .format(product['parent'])}
+                continue
+        elif product['subcat_lvl2_id'] not in existing:
+            results[index] = {'index': index, 'url': product['url'],
+                              'status': 'invalid',
+                              'error': 'unknown subcat_lvl2_id {}'
+                                       .format(product['subcat_lvl2_id'])}
+            continue
+        valid.append((index, product))
+    try:
+        upserted = db.products_bulk_upsert([product for _, product in valid])
+    except Exception as e:
+        logging.exception(e)
+        for index, product in valid:
+            results[index] = {'index': index, 'url': product['url'],
+                              'status': 'error', 'error': 'write failed'}
+        return
+    outcomes = dict((url, (product_id, status))
+                    for url, product_id, status in upserted)
+    for index, product in valid:
+        product_id, status = outcomes[product['url']]
+        results[index] = {'index': index, 'url': product['url'],
+                          'id': product_id, 'status': status}
+
+
+def ingest_products(db, items, chunk_size=INGEST_CHUNK_SIZE):
+    results = {}
+    chunk = []
+    for index, item in enumerate(items):
+        try:
+            chunk.append((index, validate_product(item)))
+        except ValueError as e:
+            url = item.get('url') if isinstance(item, dict) else None
+            results[index] = {'index': index, 'url': url,
+                              'status': 'invalid', 'error': str(e)}
+        if len(chunk) >= chunk_size:
+            _ingest_chunk(db, chunk, results)
+            chunk = []
+    if chunk:
+        _ingest_chunk(db, chunk, results)
+    return [results[index] for index in sorted(results)]
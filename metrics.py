@@ -0,0 +1,119 @@
+import logging
+import time
+from functools import wraps
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client import generate_latest, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+from db_configurator import get_metrics_config
+
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5,
+                   5.0, 10.0, 30.0)
+
+FETCH_SECONDS = Histogram('oma_fetch_seconds',
+                          'Latency of crawler HTTP requests',
+                          ['status'], buckets=LATENCY_BUCKETS)
+FETCH_CACHE_HITS = Counter('oma_fetch_cache_hits_total',
+                           'Crawler requests served from the HTTP cache')
+FETCH_RETRIES = Counter('oma_fetch_retries_total',
+                        'Crawler requests retried after a failure',
+                        ['status'])
+FETCH_CONCURRENCY_LIMIT = Gauge('oma_fetch_concurrency_limit',
+                                'Concurrency allowed by the adaptive rate '
+                                'controller')
+PARSE_SECONDS = Histogram('oma_parse_seconds',
+                          'Latency of HTML parsing steps',
+                          ['step'], buckets=LATENCY_BUCKETS)
+DB_QUERY_SECONDS = Histogram('oma_db_query_seconds',
+                             'Latency of Postgres_db calls',
+                             ['query'], buckets=LATENCY_BUCKETS)
+DB_QUERY_ERRORS = Counter('oma_db_query_errors_total',
+                          'Postgres_db calls that raised',
+                          ['query'])
+API_REQUEST_SECONDS = Histogram('oma_api_request_seconds',
+                                'Latency of API requests',
+                                ['endpoint', 'method', 'status'],
+                                buckets=LATENCY_BUCKETS)
+
+SOUP_SECONDS = PARSE_SECONDS.labels('soup')
+EXTRACT_PRODUCT_SECONDS = PARSE_SECONDS.labels('extract_product')
+PARSE_PRODUCT_SECONDS = PARSE_SECONDS.labels('product')
+
+
+def timed_query(func):
+    histogram = DB_QUERY_SECONDS.labels(func.__name__)
+    errors = DB_QUERY_ERRORS.labels(func.__name__)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+
+def observe_fetch(status, seconds):
+    FETCH_SECONDS.labels(status).observe(seconds)
+
+
+class QueueDepthCollector:
+
+    def __init__(self, db):
+        self._db = db
+
+    def _family(self):
+        return GaugeMetricFamily('oma_queue_depth',
+                                 'Rows waiting for a crawler stage',
+                                 labels=['table'])
+
+    def describe(self):
+        yield self._family()
+
+    def collect(self):
+        family = self._family()
+        try:
+            depths = self._db.get_queue_depths()
+        except Exception as e:
+            logging.exception(e)
+            depths = {}
+        for table, depth in depths.items():
+            family.add_metric([table], depth)
+        yield family
+
+
+_queue_depth_collector = None
+
+
+def register_queue_depth(db):
+    global _queue_depth_collector
+    if _queue_depth_collector is not None:
+        REGISTRY.unregister(_queue_depth_collector)
+    _queue_depth_collector = QueueDepthCollector(db)
+    REGISTRY.register(_queue_depth_collector)
+    return _queue_depth_collector
+
+
+def latest():
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(db=None, port_offset=0):
+    config = get_metrics_config()
+    if not config['PORT']:
+        return None
+    if db is not None and config['QUEUE_DEPTH'] is True:
+        register_queue_depth(db)
+    port = config['PORT'] + port_offset
+    try:
+        start_http_server(port, addr=config['ADDRESS'])
+    except OSError as e:
+        logging.exception(e)
+        return None
+    logging.info('Metrics exposed on {}:{}'.format(config['ADDRESS'], port))
+    return port
@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+from sqlalchemy import text
+from urls import normalize_url
+
+
+def _add_columns(table_name, columns):
+    return ['ALTER TABLE {} ADD COLUMN IF NOT EXISTS {};'.format(table_name,
+                                                                 column)
+            for column in columns]
+
+
+def _normalize_product_urls(connection):
+    ids = []
+    urls = []
+    for product_id, url in connection.execute(text("""SELECT id, url
+                                                     FROM products
+                                                     WHERE url IS NOT NULL;
+                                                     """)):
+        try:
+            normalized_url = normalize_url(url)
+        except ValueError:
+            continue
+        if normalized_url != url:
+            ids.append(product_id)
+            urls.append(normalized_url)
+    if ids:
+        connection.execute(text("""UPDATE products SET url = changed.url
+                                   FROM (SELECT unnest(:ids) AS id,
+                                         unnest(:urls) AS url) AS changed
+                                   WHERE products.id = changed.id;"""),
+                           ids=ids, urls=urls)
+
+
+QUEUE_COLUMNS = [
+                 'claimed_by VARCHAR (255)',
+                 'lease_expires_at TIMESTAMP',
+                 'etag VARCHAR',
+                 'last_modified VARCHAR',
+                 'content_hash VARCHAR (64)',
+                 'checked_at TIMESTAMP',
+                 'check_count INT NOT NULL DEFAULT 0',
+                 'change_count INT NOT NULL DEFAULT 0',
+                 'next_crawl_at TIMESTAMP',
+                 ]
+
+MIGRATIONS = [
+    (1, 'work queue and incremental refresh columns',
+     _add_columns('subcategories_lvl2', QUEUE_COLUMNS) +
+     _add_columns('products', QUEUE_COLUMNS), False),
+    (2, 'soft delete columns',
+     _add_columns('categories', ['deleted_at TIMESTAMP']) +
+     _add_columns('subcategories_lvl1', ['deleted_at TIMESTAMP']) +
+     _add_columns('products', ['deleted_at TIMESTAMP']) +
+     _add_columns('product_properties', ['deleted_at TIMESTAMP']), False),
+    (3, 'indexes for queue, lookup and filter queries', [
+     """CREATE INDEX IF NOT EXISTS subcategories_lvl2_unparsed_idx
+        ON subcategories_lvl2 (id) WHERE parsed_at IS NULL;""",
+     """CREATE INDEX IF NOT EXISTS products_unparsed_idx
+        ON products (id) WHERE parsed_at IS NULL AND deleted_at IS NULL;""",
+     """CREATE INDEX IF NOT EXISTS products_next_crawl_at_idx
+        ON products (next_crawl_at) WHERE parsed_at IS NOT NULL;""",
+     """CREATE INDEX IF NOT EXISTS subcategories_lvl2_next_crawl_at_idx
+        ON subcategories_lvl2 (next_crawl_at) WHERE parsed_at IS NOT NULL;""",
+     """CREATE INDEX IF NOT EXISTS subcategories_lvl1_category_id_idx
+        ON subcategories_lvl1 (category_id);""",
+     """CREATE INDEX IF NOT EXISTS subcategories_lvl2_subcat_lvl1_id_idx
+        ON subcategories_lvl2 (subcat_lvl1_id);""",
+     """CREATE INDEX IF NOT EXISTS subcategories_lvl2_name_idx
+        ON subcategories_lvl2 (name);""",
+     """CREATE INDEX IF NOT EXISTS products_subcat_lvl2_id_idx
+        ON products (subcat_lvl2_id);""",
+     """CREATE INDEX IF NOT EXISTS products_url_idx
+        ON products (url);""",
+     """CREATE INDEX IF NOT EXISTS products_price_idx
+        ON products (price) WHERE deleted_at IS NULL;""",
+     """CREATE INDEX IF NOT EXISTS product_properties_product_id_idx
+        ON product_properties (product_id);""",
+     ], False),
+    (4, 'trigram index on product name', [
+     """CREATE EXTENSION IF NOT EXISTS pg_trgm;""",
+     """CREATE INDEX IF NOT EXISTS products_name_trgm_idx
+        ON products USING gin ((name::text) gin_trgm_ops);""",
+     ], True),
+    (5, 'full-text search vector on products', [
+     """ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;""",
+     """CREATE OR REPLACE FUNCTION product_search_vector(product_id INT,
+                                                        product_name TEXT,
+                                                        product_description
+                                                        TEXT)
+        RETURNS TSVECTOR AS $$
+            SELECT setweight(to_tsvector('russian',
+                                         COALESCE(product_name, '')), 'A') ||
+                   setweight(to_tsvector('russian',
+                                         COALESCE(product_description, '')),
+                             'B') ||
+                   setweight(to_tsvector('russian',
+                                         COALESCE((SELECT string_agg(value, ' ')
+                                                   FROM product_properties
+                                                   WHERE product_properties
+                                                   .product_id =
+                                                   product_search_vector
+                                                   .product_id
+                                                   AND deleted_at IS NULL),
+                                                  '')), 'C')
+        $$ LANGUAGE SQL STABLE;""",
+     """CREATE OR REPLACE FUNCTION products_search_vector_trigger()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            NEW.search_vector := product_search_vector(NEW.id, NEW.name,
+                                                       NEW.description);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;""",
+     """CREATE TRIGGER products_search_vector_update
+        BEFORE INSERT OR UPDATE OF name, description ON products
+        FOR EACH ROW EXECUTE PROCEDURE products_search_vector_trigger();""",
+     """CREATE OR REPLACE FUNCTION product_properties_search_vector_trigger()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            UPDATE products SET
+            search_vector=product_search_vector(products.id, products.name,
+                                                products.description)
+            WHERE products.id IN (SELECT product_id FROM changed_rows);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;""",
+     """CREATE TRIGGER product_properties_search_vector_insert
+        AFTER INSERT ON product_properties
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT
+        EXECUTE PROCEDURE product_properties_search_vector_trigger();""",
+     """CREATE TRIGGER product_properties_search_vector_update
+        AFTER UPDATE ON product_properties
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT
+        EXECUTE PROCEDURE product_properties_search_vector_trigger();""",
+     """CREATE TRIGGER product_properties_search_vector_delete
+        AFTER DELETE ON product_properties
+        REFERENCING OLD TABLE AS changed_rows
+        FOR EACH STATEMENT
+        EXECUTE PROCEDURE product_properties_search_vector_trigger();""",
+     """UPDATE products SET
+        search_vector=product_search_vector(id, name, description);""",
+     """CREATE INDEX IF NOT EXISTS products_search_vector_idx
+        ON products USING gin (search_vector);""",
+     ], False),
+    (6, 'facet indexes and per-category facet counts', [
+     """CREATE INDEX IF NOT EXISTS product_properties_name_value_idx
+        ON product_properties (name, value, product_id)
+        WHERE deleted_at IS NULL;""",
+     """CREATE INDEX IF NOT EXISTS product_properties_facet_idx
+        ON product_properties (product_id, name, value)
+        WHERE deleted_at IS NULL;""",
+     """CREATE INDEX IF NOT EXISTS products_subcat_lvl2_id_price_idx
+        ON products (subcat_lvl2_id, price) WHERE deleted_at IS NULL;""",
+     """CREATE TABLE IF NOT EXISTS category_facets
+        (category_id INT NOT NULL,
+        name VARCHAR NOT NULL,
+        value VARCHAR NOT NULL,
+        product_count INT NOT NULL,
+        PRIMARY KEY (category_id, name, value));""",
+     """CREATE TABLE IF NOT EXISTS category_facets_dirty
+        (category_id INT PRIMARY KEY);""",
+     """CREATE OR REPLACE FUNCTION category_facets_mark_dirty()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO category_facets_dirty (category_id)
+            SELECT DISTINCT subcategories_lvl1.category_id
+            FROM changed_rows
+            JOIN products ON (products.id = changed_rows.product_id)
+            JOIN subcategories_lvl2
+            ON (subcategories_lvl2.id = products.subcat_lvl2_id)
+            JOIN subcategories_lvl1
+            ON (subcategories_lvl1.id = subcategories_lvl2.subcat_lvl1_id)
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;""",
+     """CREATE TRIGGER category_facets_insert
+        AFTER INSERT ON product_properties
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE category_facets_mark_dirty();""",
+     """CREATE TRIGGER category_facets_update
+        AFTER UPDATE ON product_properties
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE category_facets_mark_dirty();""",
+     """CREATE TRIGGER category_facets_delete
+        AFTER DELETE ON product_properties
+        REFERENCING OLD TABLE AS changed_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE category_facets_mark_dirty();""",
+     """INSERT INTO category_facets
+        (category_id, name, value, product_count)
+        SELECT subcategories_lvl1.category_id,
+        product_properties.name, product_properties.value, COUNT(*)
+        FROM product_properties
+        JOIN products ON (products.id = product_properties.product_id)
+        JOIN subcategories_lvl2
+        ON (subcategories_lvl2.id = products.subcat_lvl2_id)
+        JOIN subcategories_lvl1
+        ON (subcategories_lvl1.id = subcategories_lvl2.subcat_lvl1_id)
+        WHERE product_properties.deleted_at IS NULL
+        AND products.deleted_at IS NULL
+        AND product_properties.name IS NOT NULL
+        AND product_properties.value IS NOT NULL
+        GROUP BY subcategories_lvl1.category_id,
+        product_properties.name, product_properties.value;""",
+     ], False),
+    (7, 'compact property storage', [
+     """CREATE TABLE IF NOT EXISTS property_names
+        (id SERIAL PRIMARY KEY,
+        name VARCHAR NOT NULL UNIQUE);""",
+     """ALTER TABLE products ADD COLUMN IF NOT EXISTS properties JSONB;""",
+     """CREATE INDEX IF NOT EXISTS products_properties_idx
+        ON products USING gin (properties jsonb_path_ops)
+        WHERE deleted_at IS NULL;""",
+     """CREATE OR REPLACE VIEW product_properties_compact AS
+        SELECT products.id AS product_id, property_names.name,
+        entries.value, products.deleted_at
+        FROM products
+        CROSS JOIN LATERAL jsonb_each_text(products.properties) AS entries
+        JOIN property_names ON (property_names.id = entries.key::int);""",
+     """CREATE OR REPLACE FUNCTION products_search_vector_trigger()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            NEW.search_vector := product_search_vector(NEW.id, NEW.name,
+                                                       NEW.description) ||
+                setweight(to_tsvector('russian',
+                    COALESCE((SELECT string_agg(value, ' ')
+                              FROM jsonb_each_text(NEW.properties)), '')),
+                          'C');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;""",
+     """DROP TRIGGER IF EXISTS products_search_vector_update ON products;""",
+     """CREATE TRIGGER products_search_vector_update
+        BEFORE INSERT OR UPDATE OF name, description, properties ON products
+        FOR EACH ROW EXECUTE PROCEDURE products_search_vector_trigger();""",
+     """CREATE OR REPLACE FUNCTION category_facets_mark_dirty_products()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO category_facets_dirty (category_id)
+            SELECT DISTINCT subcategories_lvl1.category_id
+            FROM new_rows
+            JOIN old_rows ON (old_rows.id = new_rows.id)
+            JOIN subcategories_lvl2
+            ON (subcategories_lvl2.id = new_rows.subcat_lvl2_id)
+            JOIN subcategories_lvl1
+            ON (subcategories_lvl1.id = subcategories_lvl2.subcat_lvl1_id)
+            WHERE new_rows.properties IS DISTINCT FROM old_rows.properties
+            OR new_rows.deleted_at IS DISTINCT FROM old_rows.deleted_at
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;""",
+     """CREATE TRIGGER category_facets_products_update
+        AFTER UPDATE ON products
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT
+        EXECUTE PROCEDURE category_facets_mark_dirty_products();""",
+     ], False),
+    (8, 'deferrable search vector maintenance for bulk upserts', [
+     """CREATE OR REPLACE FUNCTION products_search_vector_trigger()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF current_setting('oma.defer_search_vector', true) = 'on' THEN
+                RETURN NEW;
+            END IF;
+            NEW.search_vector := product_search_vector(NEW.id, NEW.name,
+                                                       NEW.description) ||
+                setweight(to_tsvector('russian',
+                    COALESCE((SELECT string_agg(value, ' ')
+                              FROM jsonb_each_text(NEW.properties)), '')),
+                          'C');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;""",
+     """CREATE OR REPLACE FUNCTION product_properties_search_vector_trigger()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF current_setting('oma.defer_search_vector', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            UPDATE products SET
+            search_vector=product_search_vector(products.id, products.name,
+                                                products.description)
+            WHERE products.id IN (SELECT product_id FROM changed_rows);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;""",
+     """CREATE OR REPLACE FUNCTION refresh_product_search_vectors(
+                                                        product_ids INT[])
+        RETURNS VOID AS $$
+            UPDATE products SET
+            search_vector=product_search_vector(id, name, description) ||
+                setweight(to_tsvector('russian',
+                    COALESCE((SELECT string_agg(value, ' ')
+                              FROM jsonb_each_text(properties)), '')), 'C')
+            WHERE id = ANY(product_ids);
+        $$ LANGUAGE SQL;""",
+     """CREATE OR REPLACE FUNCTION category_facets_mark_dirty_products()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO category_facets_dirty (category_id)
+            SELECT DISTINCT subcategories_lvl1.category_id
+            FROM (SELECT id, subcat_lvl2_id, properties, deleted_at
+                  FROM new_rows
+                  EXCEPT
+                  SELECT id, subcat_lvl2_id, properties, deleted_at
+                  FROM old_rows) AS changed_rows
+            JOIN subcategories_lvl2
+            ON (subcategories_lvl2.id = changed_rows.subcat_lvl2_id)
+            JOIN subcategories_lvl1
+            ON (subcategories_lvl1.id = subcategories_lvl2.subcat_lvl1_id)
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;""",
+     ], False),
+    (9, 'product fetch error tracking', [
+     """ALTER TABLE products
+        ADD COLUMN IF NOT EXISTS fetch_error_code INT NULL,
+        ADD COLUMN IF NOT EXISTS fetch_errors INT NOT NULL DEFAULT 0;""",
+     ], False),
+    (10, 'stage-2 sub-page progress', [
+     """CREATE TABLE IF NOT EXISTS subcategory_pages
+        (subcat_lvl2_id INT NOT NULL
+        REFERENCES subcategories_lvl2(id) ON DELETE CASCADE,
+        url VARCHAR(255) NOT NULL,
+        parsed_at TIMESTAMP NULL,
+        PRIMARY KEY (subcat_lvl2_id, url));""",
+     ], False),
+    (11, 'unique product urls and product subcategory links', [
+     """CREATE TABLE IF NOT EXISTS product_subcategories
+        (product_id INT NOT NULL
+        REFERENCES products(id) ON DELETE CASCADE,
+        subcat_lvl2_id INT NOT NULL
+        REFERENCES subcategories_lvl2(id) ON DELETE CASCADE,
+        PRIMARY KEY (product_id, subcat_lvl2_id));""",
+     """CREATE INDEX IF NOT EXISTS product_subcategories_subcat_lvl2_id_idx
+        ON product_subcategories (subcat_lvl2_id);""",
+     _normalize_product_urls,
+     """CREATE TEMP TABLE products_canonical ON COMMIT DROP AS
+        SELECT products.id, keep.id AS canonical_id
+        FROM products
+        JOIN (SELECT DISTINCT ON (url) id, url FROM products
+              WHERE url IS NOT NULL
+              ORDER BY url, parsed_at IS NULL, id) AS keep
+        ON (keep.url = products.url);""",
+     """INSERT INTO product_subcategories (product_id, subcat_lvl2_id)
+        SELECT COALESCE(products_canonical.canonical_id, products.id),
+        products.subcat_lvl2_id
+        FROM products
+        LEFT JOIN products_canonical
+        ON (products_canonical.id = products.id)
+        ON CONFLICT DO NOTHING;""",
+     """DELETE FROM product_properties
+        USING products_canonical
+        WHERE product_properties.product_id = products_canonical.id
+        AND products_canonical.id <> products_canonical.canonical_id;""",
+     """DELETE FROM products
+        USING products_canonical
+        WHERE products.id = products_canonical.id
+        AND products_canonical.id <> products_canonical.canonical_id;""",
+     """CREATE UNIQUE INDEX IF NOT EXISTS products_url_key
+        ON products (url);""",
+     """DROP INDEX IF EXISTS products_url_idx;""",
+     """CREATE OR REPLACE FUNCTION product_subcategories_link_products()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO product_subcategories (product_id, subcat_lvl2_id)
+            SELECT id, subcat_lvl2_id FROM new_rows
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;""",
+     """DROP TRIGGER IF EXISTS product_subcategories_products_insert
+        ON products;""",
+     """CREATE TRIGGER product_subcategories_products_insert
+        AFTER INSERT ON products
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT
+        EXECUTE PROCEDURE product_subcategories_link_products();""",
+     ], False),
+    (12, 'soft delete column for lvl2 subcategories',
+     _add_columns('subcategories_lvl2', ['deleted_at TIMESTAMP']), False),
+    (13, 'facet dirty marking for moved and inserted products', [
+     """CREATE OR REPLACE FUNCTION category_facets_mark_dirty_products()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO category_facets_dirty (category_id)
+            SELECT DISTINCT subcategories_lvl1.category_id
+            FROM (SELECT subcat_lvl2_id
+                  FROM (SELECT id, subcat_lvl2_id, properties, deleted_at
+                        FROM new_rows
+                        EXCEPT
+                        SELECT id, subcat_lvl2_id, properties, deleted_at
+                        FROM old_rows) AS changed_new_rows
+                  UNION
+                  SELECT subcat_lvl2_id
+                  FROM (SELECT id, subcat_lvl2_id, properties, deleted_at
+                        FROM old_rows
+                        EXCEPT
+                        SELECT id, subcat_lvl2_id, properties, deleted_at
+                        FROM new_rows) AS changed_old_rows) AS changed_rows
+            JOIN subcategories_lvl2
+            ON (subcategories_lvl2.id = changed_rows.subcat_lvl2_id)
+            JOIN subcategories_lvl1
+            ON (subcategories_lvl1.id = subcategories_lvl2.subcat_lvl1_id)
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;""",
+     """CREATE OR REPLACE FUNCTION category_facets_mark_dirty_new_products()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO category_facets_dirty (category_id)
+            SELECT DISTINCT subcategories_lvl1.category_id
+            FROM new_rows
+            JOIN subcategories_lvl2
+            ON (subcategories_lvl2.id = new_rows.subcat_lvl2_id)
+            JOIN subcategories_lvl1
+            ON (subcategories_lvl1.id = subcategories_lvl2.subcat_lvl1_id)
+            WHERE new_rows.properties IS NOT NULL
+            AND new_rows.deleted_at IS NULL
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;""",
+     """DROP TRIGGER IF EXISTS category_facets_products_insert
+        ON products;""",
+     """CREATE TRIGGER category_facets_products_insert
+        AFTER INSERT ON products
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT
+        EXECUTE PROCEDURE category_facets_mark_dirty_new_products();""",
+     ], False),
+    (14, 'lvl2 subcategory fetch error tracking',
+     _add_columns('subcategories_lvl2', ['fetch_error_code INT NULL',
+                                         'fetch_errors INT NOT NULL '
+                                         'DEFAULT 0']), False),
+    (15, 'facet counts over every subcategory of a product', [
+     """CREATE OR REPLACE FUNCTION category_facets_mark_dirty()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO category_facets_dirty (category_id)
+            SELECT DISTINCT subcategories_lvl1.category_id
+            FROM changed_rows
+            JOIN product_subcategories
+            ON (product_subcategories.product_id = changed_rows.product_id)
+            JOIN subcategories_lvl2
+            ON (subcategories_lvl2.id = product_subcategories.subcat_lvl2_id)
+            JOIN subcategories_lvl1
+            ON (subcategories_lvl1.id = subcategories_lvl2.subcat_lvl1_id)
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;""",
+     """CREATE OR REPLACE FUNCTION category_facets_mark_dirty_products()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO category_facets_dirty (category_id)
+            SELECT DISTINCT subcategories_lvl1.category_id
+            FROM (SELECT id, properties, deleted_at FROM new_rows
+                  EXCEPT
+                  SELECT id, properties, deleted_at FROM old_rows)
+            AS changed_rows
+            JOIN product_subcategories
+            ON (product_subcategories.product_id = changed_rows.id)
+            JOIN subcategories_lvl2
+            ON (subcategories_lvl2.id = product_subcategories.subcat_lvl2_id)
+            JOIN subcategories_lvl1
+            ON (subcategories_lvl1.id = subcategories_lvl2.subcat_lvl1_id)
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;""",
+     """CREATE OR REPLACE FUNCTION category_facets_mark_dirty_links()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO category_facets_dirty (category_id)
+            SELECT DISTINCT subcategories_lvl1.category_id
+            FROM changed_rows
+            JOIN subcategories_lvl2
+            ON (subcategories_lvl2.id = changed_rows.subcat_lvl2_id)
+            JOIN subcategories_lvl1
+            ON (subcategories_lvl1.id = subcategories_lvl2.subcat_lvl1_id)
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;""",
+     """DROP TRIGGER IF EXISTS category_facets_links_insert
+        ON product_subcategories;""",
+     """CREATE TRIGGER category_facets_links_insert
+        AFTER INSERT ON product_subcategories
+        REFERENCING NEW TABLE AS changed_rows
+        FOR EACH STATEMENT
+        EXECUTE PROCEDURE category_facets_mark_dirty_links();""",
+     """DROP TRIGGER IF EXISTS category_facets_links_delete
+        ON product_subcategories;""",
+     """CREATE TRIGGER category_facets_links_delete
+        AFTER DELETE ON product_subcategories
+        REFERENCING OLD TABLE AS changed_rows
+        FOR EACH STATEMENT
+        EXECUTE PROCEDURE category_facets_mark_dirty_links();""",
+     """INSERT INTO category_facets_dirty (category_id)
+        SELECT id FROM categories
+        ON CONFLICT DO NOTHING;""",
+     ], False),
+]
+
+
+def _create_version_table(connection):
+    connection.execute(text("""CREATE TABLE IF NOT EXISTS schema_migrations
+                               (version INT PRIMARY KEY,
+                               description VARCHAR NOT NULL,
+                               applied_at TIMESTAMP NOT NULL
+                               DEFAULT NOW());"""))
+
+
+def get_applied_versions(connection):
+    with connection.begin():
+        _create_version_table(connection)
+        rows = connection.execute(text("""SELECT version
+                                          FROM schema_migrations;"""))
+        return set(row[0] for row in rows)
+
+
+def apply_migrations(connection, target_version=None):
+    applied = get_applied_versions(connection)
+    newly_applied = []
+    for version, description, statements, optional in MIGRATIONS:
+        if version in applied:
+            continue
+        if target_version is not None and version > target_version:
+            break
+        try:
+            with connection.begin():
+                for statement in statements:
+                    if callable(statement):
+                        statement(connection)
+                    else:
+                        connection.execute(text(statement))
+                connection.execute(text("""INSERT INTO schema_migrations
+                                           (version, description)
+                                           VALUES (:version,
+                                           :description);"""),
+                                   version=version, description=description)
+        except Exception as e:
+            if not optional:
+                raise
+            logging.warning('Optional migration {} ({}) skipped: {}'
+                            .format(version, description, e))
+            continue
+        logging.info('Applied migration {} ({})'.format(version,
+                                                         description))
+        newly_applied.append(version)
+    return newly_applied
+
+
+def main():
+    from db_connect import Postgres_db
+    from db_configurator import get_config_string
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    arg_parser = argparse.ArgumentParser(
+                 description='Apply pending schema migrations')
+    arg_parser.add_argument('command', nargs='?', default='migrate',
+                            choices=('migrate', 'compact-properties'))
+    arg_parser.add_argument('--drop-eav', action='store_true',
+                            help='truncate product_properties after '
+                                 'compacting it into products.properties')
+    args = arg_parser.parse_args()
+    db = Postgres_db(get_config_string())
+    applied = db.migrate()
+    logging.info('Applied migrations: {}'.format(applied or 'none'))
+    if args.command == 'compact-properties':
+        compacted = db.compact_properties(drop_eav=args.drop_eav)
+        logging.info('Compacted properties of {} products'.format(compacted))
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,13 @@
 #!/usr/bin/env python3
 import logging
+import sys
+import time
 from downloader import Downloader
 from db_configurator import get_config_string
+from api_cache import api_cache_from_config
+
+
+STAGE2_IDLE_SECONDS = 5
 
 
 def main():
@@ -12,6 +18,7 @@ def main():
     db_config = get_config_string()
     download = Downloader(db_config, create_new_tables=False)
     logging.info('Downloader initiated with create_new_tables=False')
+    download.start_metrics_server()
     if not download.check_if_stage1_parsing_is_complete():
         logging.info('Stage_1 parsing started')
         download = Downloader(db_config, create_new_tables=True)
@@ -21,9 +28,31 @@ def main():
     logging.info('Stage_2 parsing started')
     while not download.check_if_stage2_parsing_is_complete():
         logging.info('Successful check of incompletion of stage_2 parsing')
-        download.parse_product_url_from_subcats_lvl2(number_of_subcats=1)
+        if download.parse_product_url_from_subcats_lvl2(
+                                                number_of_subcats=1) == 0:
+            time.sleep(STAGE2_IDLE_SECONDS)
     logging.info('Stage_2 parsing finished')
     quit()
 
+
+def refresh():
+    logging.basicConfig(filename='oma_parsing.log', level=logging.INFO,
+                        format='%(asctime)s %(message)s',
+                        datefmt='%m/%d/%Y %I:%M:%S %p')
+    logging.info('Refresh started')
+    download = Downloader(get_config_string(), create_new_tables=False,
+                          api_cache=api_cache_from_config(local=False))
+    download.start_metrics_server()
+    while download.refresh_subcats_lvl2(number_of_subcats=50)['claimed'] > 0:
+        pass
+    while download.refresh_products(number_of_products=500)['claimed'] > 0:
+        pass
+    download.refresh_category_facets()
+    logging.info('Refresh finished')
+    quit()
+
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == 'refresh':
+        refresh()
+    else:
+        main()
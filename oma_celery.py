@@ -1,23 +1,105 @@
+import math
+import threading
+from billiard.process import current_process
 from celery import Celery
+from celery.signals import worker_process_init
 from downloader import Downloader
-from db_configurator import get_config_string
+from api_cache import api_cache_from_config
+from db_configurator import get_config_string, get_celery_config
 
 
-app = Celery('periodic', broker='amqp://localhost//')
-db_config = get_config_string()
-download = Downloader(db_config, create_new_tables=False)
+celery_config = get_celery_config()
+app = Celery('periodic', broker=celery_config['BROKER_URL'])
+app.conf.update(
+    worker_prefetch_multiplier=celery_config['PREFETCH_MULTIPLIER'],
+    task_acks_late=True,
+)
+_local = threading.local()
+_metrics_lock = threading.Lock()
+_metrics_port = None
+
+
+def get_downloader():
+    if getattr(_local, 'downloader', None) is None:
+        _local.downloader = Downloader(get_config_string(),
+                                       create_new_tables=False,
+                                       api_cache=api_cache_from_config(
+                                                                local=False))
+        _start_metrics_server(_local.downloader)
+    return _local.downloader
+
+
+def _start_metrics_server(download):
+    global _metrics_port
+    with _metrics_lock:
+        if _metrics_port is not None:
+            return
+        process_index = getattr(current_process(), 'index', None) or 0
+        _metrics_port = download.start_metrics_server(
+                                            port_offset=1 + process_index)
+
+
+@worker_process_init.connect
+def reset_downloader(**kwargs):
+    global _metrics_port
+    _local.downloader = None
+    _metrics_port = None
+
+
+def _chunks_per_dispatch():
+    rate_limit = celery_config['RATE_LIMIT']
+    if not rate_limit:
+        return celery_config['CHUNKS_PER_DISPATCH']
+    products_per_dispatch = rate_limit * celery_config['DISPATCH_INTERVAL']
+    return max(1, int(products_per_dispatch // celery_config['CHUNK_SIZE']))
+
+
+def _chunk_countdown(chunk_number):
+    rate_limit = celery_config['RATE_LIMIT']
+    if not rate_limit:
+        return 0
+    return chunk_number * celery_config['CHUNK_SIZE'] / rate_limit
+
+
+@app.task(name='periodic.dispatch_products')
+def dispatch_products():
+    download = get_downloader()
+    dispatched = 0
+    chunks_per_dispatch = _chunks_per_dispatch()
+    longest_countdown = _chunk_countdown(chunks_per_dispatch - 1)
+    for chunk_number in range(chunks_per_dispatch):
+        entries = download.claim_products(
+                        celery_config['CHUNK_SIZE'],
+                        extra_lease_seconds=math.ceil(longest_countdown))
+        if len(entries) == 0:
+            break
+        parse_products_chunk.apply_async(
+                            args=(entries,),
+                            countdown=_chunk_countdown(chunk_number))
+        dispatched += len(entries)
+    return dispatched
+
+
+@app.task(name='periodic.parse_products_chunk')
+def parse_products_chunk(entries):
+    download = get_downloader()
+    return download.parse_claimed_products(
+                        entries,
+                        write_batch_size=celery_config['WRITE_BATCH_SIZE'])
+
+
+@app.task(name='periodic.refresh_category_facets')
+def refresh_category_facets():
+    return get_downloader().refresh_category_facets()
 
-@app.task
-def run_parsing_procedure():
-    parse_products()
 
 app.conf.beat_schedule = {
     "run_parsing_product_info": {
-        "task": "periodic.parse_products",
-        "schedule": 5.0
+        "task": "periodic.dispatch_products",
+        "schedule": celery_config['DISPATCH_INTERVAL']
+    },
+    "refresh_category_facets": {
+        "task": "periodic.refresh_category_facets",
+        "schedule": celery_config['FACET_REFRESH_INTERVAL']
     }
 }
-
-def parse_products():
-    download.parse_products_parameters(number_of_products_to_parse=10)
-    return True
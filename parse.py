@@ -1,35 +1,250 @@
 import logging
-from requests import get
-from requests.exceptions import RequestException
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import HTTPError, RequestException
 from contextlib import closing
 from bs4 import BeautifulSoup as BSoup
+from bs4 import SoupStrainer
+import soupsieve as sv
+import hashlib
 import re
 import os
+import time
+from urllib.parse import parse_qs, urlsplit
+from fetcher import AsyncFetcher
+from http_cache import CacheMiss
+from metrics import EXTRACT_PRODUCT_SECONDS, FETCH_CACHE_HITS, SOUP_SECONDS
+from metrics import FETCH_CONCURRENCY_LIMIT, FETCH_RETRIES, observe_fetch
+from rate_control import parse_retry_after
+from urls import normalize_url
+
+
+PARSER_BACKENDS = ('lxml', 'html.parser', 'html5lib')
+DEFAULT_TIMEOUT = 30
+PAGE_PARAMETER = 'PAGEN_1'
+
+SUBPAGE_LINK_SELECTOR = sv.compile('div.btn-combo div.hide a, '
+                                   'div.btn-combo a')
+PRODUCT_CARD_SELECTOR = sv.compile('div.catalog-grid div.product-item_img-box')
+PRODUCT_LINK_SELECTOR = sv.compile('a.no-border-product')
+
+PRODUCT_NAME_SELECTOR = sv.compile('div.page-title h1')
+PRODUCT_PRICE_SELECTOR = sv.compile('div.product-info-box_price')
+PRODUCT_PRICE_FRACTION_SELECTOR = sv.compile('div.product-info-box_price '
+                                             'small')
+PRODUCT_UNIT_SELECTOR = sv.compile('div.product-info-box_price '
+                                   'span.product-unit')
+PRODUCT_DESCRIPTION_SELECTOR = sv.compile('article.'
+                                          'catalog-item-description-txt_content')
+PRODUCT_CHARACTERISTIC_SELECTOR = sv.compile('li.params-block_list-item '
+                                             'span.param-item_name')
+PRODUCT_CHARACTERISTIC_VALUE_SELECTOR = sv.compile('span.param-item_value-col')
+PRODUCT_IMAGE_SELECTOR = sv.compile('div.slider-w-preview img')
+
+PRODUCT_REGION_CLASSES = frozenset(['page-title',
+                                    'product-info-box_price',
+                                    'catalog-item-description-txt_content',
+                                    'params-block_list-item',
+                                    'param-item_value-col',
+                                    'slider-w-preview',
+                                    'special-icon__hit'])
+
+
+def _is_product_region(class_value):
+    if class_value is None:
+        return False
+    if isinstance(class_value, str):
+        class_value = class_value.split()
+    return not PRODUCT_REGION_CLASSES.isdisjoint(class_value)
+
+
+class ListingPageError(HTTPError):
+
+    def __init__(self, response_code, url):
+        super().__init__('{} for listing page {}'.format(response_code, url))
+        self.response_code = response_code
 
 
 class Parser(object):
 
-    def _get_url(self, url):
-        object = get(url)
-        response_code = object.status_code
+    def __init__(self, base_url='https://www.oma.by', concurrency=10,
+                 per_host_limit=4, parser_backend='lxml',
+                 restrict_product_parse=False, cache=None,
+                 timeout=DEFAULT_TIMEOUT, retry_policy=None,
+                 rate_controller=None):
+        if parser_backend not in PARSER_BACKENDS:
+            raise ValueError('Unknown parser backend {}'
+                             .format(parser_backend))
+        self._base_url = base_url
+        self._cache = cache
+        self._timeout = timeout
+        self._retry_policy = retry_policy
+        self._rate_controller = rate_controller
+        self._parser_backend = parser_backend
+        self._restrict_product_parse = restrict_product_parse
+        self._product_strainer = None
+        if restrict_product_parse is True:
+            self._product_strainer = SoupStrainer(
+                                        attrs={'class': _is_product_region})
+        self._session = Session()
+        adapter = HTTPAdapter(pool_connections=concurrency,
+                              pool_maxsize=concurrency)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._fetcher = AsyncFetcher(self._get_url,
+                                     concurrency=concurrency,
+                                     per_host_limit=per_host_limit)
+
+    @property
+    def fetcher(self):
+        return self._fetcher
+
+    @property
+    def rate_controller(self):
+        return self._rate_controller
+
+    @property
+    def parser_backend(self):
+        return self._parser_backend
+
+    @property
+    def restrict_product_parse(self):
+        return self._restrict_product_parse
+
+    def _get_url(self, url, headers=None):
+        if self._cache is not None and (not headers or self._cache.replay):
+            cached = self._cache.get(url)
+            if cached is not None:
+                FETCH_CACHE_HITS.inc()
+                return cached, cached.status_code
+            if self._cache.replay:
+                raise CacheMiss(url)
+        attempt = 0
+        while True:
+            object, response_code, retry_after, error = \
+                self._fetch_once(url, headers)
+            if self._retry_policy is None or \
+                    not self._retry_policy.should_retry(attempt,
+                                                        response_code):
+                break
+            delay = self._retry_policy.delay(attempt, retry_after)
+            status = 'error' if response_code is None else str(response_code)
+            FETCH_RETRIES.labels(status).inc()
+            logging.warning('Retrying {} after {} in {:.2f}s'
+                            .format(url, status, delay))
+            time.sleep(delay)
+            attempt += 1
+        if error is not None:
+            raise error
+        if self._cache is not None and response_code == 200:
+            self._cache.put(url, object)
         return object, response_code
 
+    def _fetch_once(self, url, headers=None):
+        controller = self._rate_controller
+        ticket = controller.acquire() if controller is not None else None
+        started = time.perf_counter()
+        elapsed = None
+        response_code = None
+        retry_after = None
+        try:
+            try:
+                object = self._session.get(url, headers=headers,
+                                           timeout=self._timeout)
+            except RequestException as e:
+                elapsed = time.perf_counter() - started
+                observe_fetch('error', elapsed)
+                return None, None, None, e
+            elapsed = time.perf_counter() - started
+            response_code = object.status_code
+            observe_fetch(str(response_code), elapsed)
+            retry_after = parse_retry_after(object.headers.get('Retry-After'))
+            return object, response_code, retry_after, None
+        finally:
+            if elapsed is None:
+                elapsed = time.perf_counter() - started
+            if controller is not None:
+                controller.release(ticket, response_code, elapsed,
+                                   retry_after)
+                FETCH_CONCURRENCY_LIMIT.set(controller.limit)
+
+    def _make_soup(self, html, parse_only=None):
+        with SOUP_SECONDS.time():
+            return BSoup(html, self._parser_backend, parse_only=parse_only)
+
+    def _make_product_soup(self, html):
+        return self._make_soup(html, parse_only=self._product_strainer)
+
     def _get_soup(self, url):
         content, response_code = self._get_url(url)
-        soup = BSoup(content.text, 'html.parser')
+        soup = self._make_soup(content.text)
+        return soup, response_code
+
+    async def _async_get_soup(self, url):
+        content, response_code = await self._fetcher.fetch(url)
+        soup = self._make_soup(content.text)
         return soup, response_code
 
+    def _conditional_headers(self, etag, last_modified):
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def _page_change(self, content, response_code, etag, last_modified,
+                     content_hash):
+        page = {
+                'response_code': response_code,
+                'etag': etag,
+                'last_modified': last_modified,
+                'content_hash': content_hash,
+                'changed': False,
+                'html': None,
+                }
+        if response_code != 200:
+            return page
+        new_hash = hashlib.sha256(content.content).hexdigest()
+        page['etag'] = content.headers.get('ETag')
+        page['last_modified'] = content.headers.get('Last-Modified')
+        page['content_hash'] = new_hash
+        if new_hash != content_hash:
+            page['changed'] = True
+            page['html'] = content.text
+        return page
+
+    def get_page_if_changed(self, url, etag=None, last_modified=None,
+                            content_hash=None):
+        headers = self._conditional_headers(etag, last_modified)
+        content, response_code = self._get_url(url, headers)
+        return self._page_change(content, response_code, etag,
+                                 last_modified, content_hash)
+
+    async def async_get_page_if_changed(self, url, etag=None,
+                                        last_modified=None,
+                                        content_hash=None):
+        headers = self._conditional_headers(etag, last_modified)
+        content, response_code = await self._fetcher.fetch(url, headers)
+        return self._page_change(content, response_code, etag,
+                                 last_modified, content_hash)
+
     def _construct_url(self, url):
-        return 'https://www.oma.by' + url
+        return normalize_url(self._base_url + url)
 
     def _get_category_name(self, category_obj):
         name_raw = category_obj.select('section.bordered-section h2')
         name = name_raw[0].get_text()
         return name
 
-    def _get_category_obj(self):
+    def _get_catalog_soup(self):
         url = self._construct_url('/catalog')
         soup, response_code = self._get_soup(url)
+        return soup
+
+    def _get_category_obj(self, soup=None):
+        if soup is None:
+            soup = self._get_catalog_soup()
         objs = soup.findAll('section',
                             {'class':
                              'bordered-section js-accordion-group'})
@@ -46,32 +261,42 @@ class Parser(object):
         name = name_raw[0].get_text()
         return name
 
-    def _get_subcat_lvl1_objects(self):
-        for category_obj, category in self._get_category_obj():
-            subcat_lvl1_objs = category_obj.findAll('div',
-                                                    {'class':
-                                                     'catalog-all-item'})
-            for obj in subcat_lvl1_objs:
-                name = self._get_subcat_lvl1_name(obj)
+    def _get_subcat_lvl1_objects(self, soup=None):
+        for category_obj, category in self._get_category_obj(soup):
+            for obj, name in self._subcat_lvl1_objs_from_category(
+                                                            category_obj):
                 parent = category
                 yield obj, name, parent
 
+    def _subcat_lvl1_objs_from_category(self, category_obj):
+        subcat_lvl1_objs = category_obj.findAll('div',
+                                                {'class':
+                                                 'catalog-all-item'})
+        for obj in subcat_lvl1_objs:
+            name = self._get_subcat_lvl1_name(obj)
+            yield obj, name
+
     def get_lvl1_subcategories(self):
         for _, name, parent in self._get_subcat_lvl1_objects():
             yield name, parent
 
-    def _get_subcat_lvl2_objects(self):
-        for subcat_lvl1_obj, s_lvl1_name, cat_name in self._get_subcat_lvl1_objects():
-            objs = subcat_lvl1_obj.findAll('a',
-                                           {'class':
-                                            'section-submenu-sublink'})
-            for obj in objs:
-                name = obj.get_text()
-                url = self._construct_url(obj.get('href'))
+    def _get_subcat_lvl2_objects(self, soup=None):
+        for subcat_lvl1_obj, s_lvl1_name, cat_name in self._get_subcat_lvl1_objects(soup):
+            for obj, name, url in self._subcat_lvl2_objs_from_lvl1(
+                                                        subcat_lvl1_obj):
                 parent = s_lvl1_name
                 grandparent = cat_name
                 yield obj, name, parent, grandparent, url
 
+    def _subcat_lvl2_objs_from_lvl1(self, subcat_lvl1_obj):
+        objs = subcat_lvl1_obj.findAll('a',
+                                       {'class':
+                                        'section-submenu-sublink'})
+        for obj in objs:
+            name = obj.get_text()
+            url = self._construct_url(obj.get('href'))
+            yield obj, name, url
+
     def get_lvl2_subcategories(self):
         for _, name, parent, grandparent, url in self._get_subcat_lvl2_objects():
             dict_ = {
@@ -82,30 +307,125 @@ class Parser(object):
                      }
             yield dict_
 
-    def _get_subpage_urls(self, subcat_lvl2_url):
-        soup, response_code = self._get_soup(subcat_lvl2_url)
-        button_combo_object = soup.select("""div.btn-combo div.hide a,
-                                             div.btn-combo a""")
+    def get_catalog_tree(self):
+        soup = self._get_catalog_soup()
+        tree = []
+        for category_obj, category in self._get_category_obj(soup):
+            lvl1_list = []
+            for lvl1_obj, lvl1_name in self._subcat_lvl1_objs_from_category(
+                                                                category_obj):
+                lvl2_list = [{'name': name, 'url': url}
+                             for _, name, url in
+                             self._subcat_lvl2_objs_from_lvl1(lvl1_obj)]
+                lvl1_list.append({'name': lvl1_name,
+                                  'subcategories': lvl2_list})
+            tree.append({'name': category, 'subcategories': lvl1_list})
+        return tree
+
+    def get_product_urls_from_lvl2_html(self, html, subcat_lvl2_url):
+        page = self._lvl2_page_from_soup(self._make_soup(html),
+                                         subcat_lvl2_url)
+        urls = page['product_urls']
+        for subpage_url in page['subpage_urls']:
+            urls.extend(self.get_product_urls_from_subpage(subpage_url))
+        return list(dict.fromkeys(urls))
+
+    def _page_number(self, url):
+        values = parse_qs(urlsplit(url).query).get(PAGE_PARAMETER)
+        try:
+            return int(values[0]) if values else 1
+        except ValueError:
+            return None
+
+    def _subpage_urls_from_soup(self, soup, subcat_lvl2_url):
+        button_combo_object = SUBPAGE_LINK_SELECTOR.select(soup)
         if len(button_combo_object) == 0:
             yield subcat_lvl2_url
         for a_tag in button_combo_object:
             yield self._construct_url(a_tag.attrs["href"])
 
+    def _remaining_subpage_urls(self, soup, subcat_lvl2_url):
+        urls = [url for url in self._subpage_urls_from_soup(soup,
+                                                            subcat_lvl2_url)
+                if url != subcat_lvl2_url and self._page_number(url) != 1]
+        return list(dict.fromkeys(urls))
+
+    def _lvl2_page_from_soup(self, soup, subcat_lvl2_url):
+        return {
+                'product_urls': list(self._product_links_from_soup(soup)),
+                'subpage_urls': self._remaining_subpage_urls(soup,
+                                                             subcat_lvl2_url),
+                }
 
-    def _extract_product_link(self, page_url):
-        soup, response_code = self._get_soup(page_url)
-        product_cards = soup.select('div.catalog-grid \
-                                    div.product-item_img-box')
+    def _listing_soup(self, soup, response_code, url):
+        if response_code != 200:
+            raise ListingPageError(response_code, url)
+        return soup
+
+    def _product_links_from_soup(self, soup):
+        product_cards = PRODUCT_CARD_SELECTOR.select(soup)
         for card in product_cards:
-            url_raw = card.select('a.no-border-product')
+            url_raw = PRODUCT_LINK_SELECTOR.select(card)
             url = self._construct_url(url_raw[0].attrs['href'])
             yield url
 
+    def get_lvl2_first_page(self, subcat_lvl2_url):
+        soup = self._listing_soup(*self._get_soup(subcat_lvl2_url),
+                                  subcat_lvl2_url)
+        return self._lvl2_page_from_soup(soup, subcat_lvl2_url)
+
+    async def async_get_lvl2_first_page(self, subcat_lvl2_url):
+        soup, response_code = await self._async_get_soup(subcat_lvl2_url)
+        self._listing_soup(soup, response_code, subcat_lvl2_url)
+        return self._lvl2_page_from_soup(soup, subcat_lvl2_url)
+
+    def get_product_urls_from_subpage(self, subpage_url):
+        soup = self._listing_soup(*self._get_soup(subpage_url), subpage_url)
+        return list(self._product_links_from_soup(soup))
+
+    async def async_get_product_urls_from_subpages(self, subpage_urls):
+        async for url, result, error in self._fetcher.as_completed(
+                                            self._async_get_soup,
+                                            subpage_urls):
+            if error is None:
+                try:
+                    soup = self._listing_soup(*result, url)
+                except HTTPError as e:
+                    error = e
+            if error is not None:
+                yield url, None, error
+                continue
+            yield url, list(self._product_links_from_soup(soup)), None
+
     def get_product_urls_from_lvl2_url(self, subcat_lvl2_url,
                                        subcat_lvl2_id,
                                        subcat_lvl2_name):
-        for subpage_url in self._get_subpage_urls(subcat_lvl2_url):
-            for url in self._extract_product_link(subpage_url):
+        page = self.get_lvl2_first_page(subcat_lvl2_url)
+        urls = page['product_urls']
+        for subpage_url in page['subpage_urls']:
+            urls.extend(self.get_product_urls_from_subpage(subpage_url))
+        for url in urls:
+            dict_ = {
+                     'parent': subcat_lvl2_name,
+                     'url': url
+                     }
+            yield dict_
+
+    async def async_get_product_urls_from_lvl2_url(self, subcat_lvl2_url,
+                                                   subcat_lvl2_id,
+                                                   subcat_lvl2_name):
+        page = await self.async_get_lvl2_first_page(subcat_lvl2_url)
+        for url in page['product_urls']:
+            yield {
+                   'parent': subcat_lvl2_name,
+                   'url': url
+                   }
+        async for _, urls, error in \
+                self.async_get_product_urls_from_subpages(
+                                                    page['subpage_urls']):
+            if error is not None:
+                raise error
+            for url in urls:
                 dict_ = {
                          'parent': subcat_lvl2_name,
                          'url': url
@@ -113,7 +433,22 @@ class Parser(object):
                 yield dict_
 
     def get_product_parameters(self, url):
-        soup, response_code = self._get_soup(url)
+        content, response_code = self._get_url(url)
+        return self.parse_product_html(content.text), response_code
+
+    async def async_get_product_parameters(self, url):
+        content, response_code = await self._fetcher.fetch(url)
+        return self.parse_product_html(content.text), response_code
+
+    def parse_product_html(self, html):
+        soup = self._make_product_soup(html)
+        return self._extract_product_parameters(soup)
+
+    def _extract_product_parameters(self, soup):
+        with EXTRACT_PRODUCT_SECONDS.time():
+            return self._extract_product_dict(soup)
+
+    def _extract_product_dict(self, soup):
         name = self._get_product_name(soup)
         price = self._get_product_price(soup)
         desc = self._get_description(soup)
@@ -130,23 +465,21 @@ class Parser(object):
                 'image_url': image_url,
                 'is_trend': is_trend,
                 }
-        return product_dict, response_code
+        return product_dict
 
     def _get_product_name(self, soup):
-        name_raw = soup.select('div.page-title h1')
+        name_raw = PRODUCT_NAME_SELECTOR.select(soup)
         if len(name_raw) == 0:
             return None
         return name_raw[0].text
 
     def _get_product_price(self, soup):
         try:
-            price_div = soup.select('div.product-info-box_price')
-            price_fraction_raw = soup.select('div.product-info-box_price\
-                                             small')
+            price_div = PRODUCT_PRICE_SELECTOR.select(soup)
+            price_fraction_raw = PRODUCT_PRICE_FRACTION_SELECTOR.select(soup)
             price_fraction = price_fraction_raw[0].string
             try:
-                product_unit_raw = soup.select('div.product-info-box_price\
-                                                span.product-unit')
+                product_unit_raw = PRODUCT_UNIT_SELECTOR.select(soup)
                 product_unit = product_unit_raw[0].string
             except Exception as e:
                 logging.exception(e)
@@ -168,8 +501,7 @@ class Parser(object):
 
     def _get_description(self, soup):
         try:
-            search_string = 'article.catalog-item-description-txt_content'
-            desc_raw = soup.select(search_string)
+            desc_raw = PRODUCT_DESCRIPTION_SELECTOR.select(soup)
             desc = desc_raw[0].text.rstrip().replace('\n', ' ')
             desc = re.sub(' +', ' ', desc)
             return desc
@@ -181,9 +513,9 @@ class Parser(object):
     def _get_product_characteristics(self, soup):
         charact_list = []
         charact_value_list = []
-        characteristics = soup.select('li.params-block_list-item \
-                                      span.param-item_name')
-        characteristic_values = soup.select('span.param-item_value-col')
+        characteristics = PRODUCT_CHARACTERISTIC_SELECTOR.select(soup)
+        characteristic_values = PRODUCT_CHARACTERISTIC_VALUE_SELECTOR\
+                                .select(soup)
 
         for char_ in characteristics:
             charact_list.append(char_.contents[0])
@@ -196,7 +528,7 @@ class Parser(object):
 
     def _get_product_image_url(self, soup):
         try:
-            url_raw = soup.select('div.slider-w-preview img')
+            url_raw = PRODUCT_IMAGE_SELECTOR.select(soup)
             url = self._construct_url(url_raw[0].get('src'))
             return url
         except Exception as e:
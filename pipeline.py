@@ -0,0 +1,208 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from metrics import PARSE_PRODUCT_SECONDS
+from parse import Parser
+
+
+_SENTINEL = object()
+_worker_parser = None
+
+
+def _init_parse_worker(parser_backend, restrict_product_parse):
+    global _worker_parser
+    _worker_parser = Parser(concurrency=1, per_host_limit=1,
+                            parser_backend=parser_backend,
+                            restrict_product_parse=restrict_product_parse)
+
+
+def _parse_product_bytes(content, encoding):
+    started = time.perf_counter()
+    html = content.decode(encoding or 'utf-8', errors='replace')
+    product_dict = _worker_parser.parse_product_html(html)
+    return product_dict, time.perf_counter() - started
+
+
+class StageCounter:
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.items = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+
+    def record(self, busy_seconds, error=False):
+        with self._lock:
+            self.items += 1
+            self.busy_seconds += busy_seconds
+            if error:
+                self.errors += 1
+
+    def observe_queue(self, depth):
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def as_dict(self, elapsed, workers):
+        capacity = elapsed * workers
+        return {
+                'items': self.items,
+                'errors': self.errors,
+                'items_per_sec': round(self.items / elapsed, 1)
+                if elapsed else 0,
+                'utilization': round(self.busy_seconds / capacity, 3)
+                if capacity else 0,
+                'max_queue_depth': self.max_queue_depth,
+                }
+
+
+class ProductPipeline:
+
+    def __init__(self, db, parser, store_failure, fetch_workers=8,
+                 parse_workers=None, queue_size=64, write_batch_size=50):
+        self._db = db
+        self._parser = parser
+        self._store_failure = store_failure
+        self._fetch_workers = fetch_workers
+        self._parse_workers = parse_workers or os.cpu_count() or 1
+        self._write_batch_size = write_batch_size
+        self._entries = queue.Queue()
+        self._fetched = queue.Queue(maxsize=queue_size)
+        self._parsed = queue.Queue(maxsize=queue_size)
+        self._parse_slots = threading.BoundedSemaphore(queue_size)
+        self._counters = {
+                          'fetch': StageCounter('fetch'),
+                          'parse': StageCounter('parse'),
+                          'write': StageCounter('write'),
+                          }
+        self._stop = threading.Event()
+
+    def _fetch_loop(self):
+        counter = self._counters['fetch']
+        while not self._stop.is_set():
+            entry_dict = self._entries.get()
+            if entry_dict is _SENTINEL:
+                break
+            started = time.perf_counter()
+            try:
+                content, response_code = self._parser\
+                                         ._get_url(entry_dict['url'])
+            except Exception as e:
+                logging.exception(e)
+                counter.record(time.perf_counter() - started, error=True)
+                continue
+            counter.record(time.perf_counter() - started)
+            self._fetched.put((entry_dict, response_code, content.content,
+                               content.encoding))
+            counter.observe_queue(self._fetched.qsize())
+
+    def _parse_loop(self, executor):
+        counter = self._counters['parse']
+        while True:
+            item = self._fetched.get()
+            if item is _SENTINEL:
+                break
+            entry_dict, response_code, content, encoding = item
+            if response_code != 200:
+                self._parsed.put((entry_dict, response_code, None))
+                continue
+            self._parse_slots.acquire()
+            future = executor.submit(_parse_product_bytes, content, encoding)
+            future.add_done_callback(
+                self._make_parse_callback(entry_dict, counter))
+
+    def _make_parse_callback(self, entry_dict, counter):
+        def on_parsed(future):
+            self._parse_slots.release()
+            error = future.exception()
+            if error is not None:
+                counter.record(0.0, error=True)
+                logging.error('Failed to parse {}'.format(entry_dict['url']),
+                              exc_info=error)
+                return
+            product_dict, busy_seconds = future.result()
+            counter.record(busy_seconds)
+            PARSE_PRODUCT_SECONDS.observe(busy_seconds)
+            self._parsed.put((entry_dict, 200, product_dict))
+            counter.observe_queue(self._parsed.qsize())
+        return on_parsed
+
+    def _flush(self, batch):
+        counter = self._counters['write']
+        started = time.perf_counter()
+        try:
+            self._db.products_bulk_update(batch)
+        except Exception as e:
+            logging.exception(e)
+            counter.errors += 1
+        counter.busy_seconds += time.perf_counter() - started
+        del batch[:]
+
+    def _write_loop(self):
+        counter = self._counters['write']
+        batch = []
+        while True:
+            item = self._parsed.get()
+            if item is _SENTINEL:
+                break
+            entry_dict, response_code, product_dict = item
+            counter.items += 1
+            if response_code == 200:
+                batch.append((entry_dict['id'], product_dict))
+                if len(batch) >= self._write_batch_size:
+                    self._flush(batch)
+                continue
+            try:
+                self._store_failure(entry_dict['id'], product_dict,
+                                    response_code)
+            except Exception as e:
+                logging.exception(e)
+                counter.errors += 1
+        self._flush(batch)
+
+    def run(self, entries):
+        for entry_dict in entries:
+            self._entries.put(entry_dict)
+        for _ in range(self._fetch_workers):
+            self._entries.put(_SENTINEL)
+        started = time.perf_counter()
+        fetchers = [threading.Thread(target=self._fetch_loop, daemon=True)
+                    for _ in range(self._fetch_workers)]
+        writer = threading.Thread(target=self._write_loop, daemon=True)
+        with ProcessPoolExecutor(
+                max_workers=self._parse_workers,
+                initializer=_init_parse_worker,
+                initargs=(self._parser.parser_backend,
+                          self._parser.restrict_product_parse)) as executor:
+            dispatcher = threading.Thread(target=self._parse_loop,
+                                          args=(executor,), daemon=True)
+            for thread in fetchers + [dispatcher, writer]:
+                thread.start()
+            try:
+                for thread in fetchers:
+                    thread.join()
+            finally:
+                self._fetched.put(_SENTINEL)
+                dispatcher.join()
+                executor.shutdown(wait=True)
+                self._parsed.put(_SENTINEL)
+                writer.join()
+        return self.stats(time.perf_counter() - started)
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self, elapsed):
+        workers = {
+                   'fetch': self._fetch_workers,
+                   'parse': self._parse_workers,
+                   'write': 1,
+                   }
+        stats = {name: counter.as_dict(elapsed, workers[name])
+                 for name, counter in self._counters.items()}
+        stats['seconds'] = round(elapsed, 3)
+        return stats
@@ -0,0 +1,179 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from db_configurator import get_crawler_config
+
+
+THROTTLE_STATUSES = frozenset([429, 503])
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+def parse_retry_after(value, now=None):
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    return max((retry_at - now).total_seconds(), 0.0)
+
+
+class RetryPolicy:
+
+    def __init__(self, max_retries=3, backoff_base=0.5, backoff_max=30.0,
+                 retry_statuses=RETRY_STATUSES):
+        self.max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._retry_statuses = retry_statuses
+
+    def should_retry(self, attempt, status):
+        if attempt >= self.max_retries:
+            return False
+        return status is None or status in self._retry_statuses
+
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self._backoff_max)
+        ceiling = min(self._backoff_max, self._backoff_base * 2 ** attempt)
+        return random.uniform(0, ceiling)
+
+
+class AIMDController:
+
+    def __init__(self, initial=2, minimum=1, maximum=16, increase=1,
+                 decrease=0.5, window=20, latency_factor=2.0,
+                 latency_slack=0.05, error_threshold=0.1,
+                 latency_smoothing=0.2, base_latency_drift=0.01):
+        self._minimum = minimum
+        self._maximum = maximum
+        self._increase = increase
+        self._decrease = decrease
+        self._window = window
+        self._latency_factor = latency_factor
+        self._latency_slack = latency_slack
+        self._base_latency_drift = base_latency_drift
+        self._error_threshold = error_threshold
+        self._latency_smoothing = latency_smoothing
+        self._limit = float(min(max(initial, minimum), maximum))
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._latency = None
+        self._base_latency = None
+        self._window_requests = 0
+        self._window_errors = 0
+        self._condition = threading.Condition()
+        self._statuses = {}
+        self._increases = 0
+        self._decreases = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self):
+        with self._condition:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                if self._in_flight < int(self._limit):
+                    self._in_flight += 1
+                    return time.monotonic()
+                self._condition.wait()
+
+    def _cut(self, started):
+        if started < self._last_decrease:
+            return
+        self._limit = max(self._minimum, self._limit * self._decrease)
+        self._last_decrease = time.monotonic()
+        self._decreases += 1
+        self._window_requests = 0
+        self._window_errors = 0
+
+    def _observe_latency(self, latency):
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency += self._latency_smoothing * (latency -
+                                                        self._latency)
+        if self._base_latency is None or self._latency < self._base_latency:
+            self._base_latency = self._latency
+        else:
+            self._base_latency += self._base_latency_drift * (
+                                        self._latency - self._base_latency)
+
+    def _latency_is_rising(self):
+        threshold = max(self._base_latency * self._latency_factor,
+                        self._base_latency + self._latency_slack)
+        return self._latency > threshold
+
+    def release(self, started, status, latency, retry_after=None):
+        with self._condition:
+            self._in_flight -= 1
+            key = 'error' if status is None else str(status)
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+            if status in THROTTLE_STATUSES:
+                if retry_after:
+                    self._paused_until = max(self._paused_until,
+                                             time.monotonic() + retry_after)
+                self._cut(started)
+            else:
+                self._observe_latency(latency)
+                self._window_requests += 1
+                if status is None or status >= 500:
+                    self._window_errors += 1
+                if self._latency_is_rising():
+                    self._cut(started)
+                elif self._window_requests >= self._window:
+                    error_rate = self._window_errors / self._window_requests
+                    if error_rate > self._error_threshold:
+                        self._cut(started)
+                    elif self._limit < self._maximum:
+                        self._limit = min(self._maximum,
+                                          self._limit + self._increase)
+                        self._increases += 1
+                    self._window_requests = 0
+                    self._window_errors = 0
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                    'limit': int(self._limit),
+                    'in_flight': self._in_flight,
+                    'increases': self._increases,
+                    'decreases': self._decreases,
+                    'latency_ms': round(self._latency * 1000, 1)
+                    if self._latency is not None else None,
+                    'base_latency_ms': round(self._base_latency * 1000, 1)
+                    if self._base_latency is not None else None,
+                    'statuses': dict(self._statuses),
+                    }
+
+
+def retry_policy_from_config():
+    config = get_crawler_config()
+    return RetryPolicy(config['MAX_RETRIES'], config['BACKOFF_BASE'],
+                       config['BACKOFF_MAX'])
+
+
+def rate_controller_from_config(concurrency):
+    config = get_crawler_config()
+    if not config['ADAPTIVE_CONCURRENCY']:
+        return None
+    return AIMDController(initial=config['INITIAL_CONCURRENCY'],
+                          minimum=config['MIN_CONCURRENCY'],
+                          maximum=concurrency,
+                          latency_factor=config['LATENCY_FACTOR'],
+                          error_threshold=config['ERROR_THRESHOLD'])
@@ -0,0 +1,136 @@
+import json
+import math
+from datetime import date, datetime
+from decimal import Decimal
+from json.encoder import encode_basestring_ascii
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError('{} is not JSON serializable'.format(type(value)))
+
+
+def _finite(obj):
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+
+def _json_dumps(obj, **kwargs):
+    try:
+        return json.dumps(obj, default=_json_default, allow_nan=False,
+                          **kwargs)
+    except ValueError:
+        return json.dumps(_finite(obj), default=_json_default,
+                          allow_nan=False, **kwargs)
+
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default)
+    return _json_dumps(obj, separators=(',', ':')).encode()
+
+
+_encode_bool = {True: 'true', False: 'false'}.__getitem__
+
+
+def _encode_float(value):
+    if math.isfinite(value):
+        return float.__repr__(value)
+    return 'null'
+
+
+def _encode_quoted(value):
+    return '"{}"'.format(value)
+
+
+def _encode_isoformat(value):
+    return '"{}"'.format(value.isoformat())
+
+
+def _encode_any(value):
+    return _json_dumps(value)
+
+
+def _column_encoder(value):
+    if isinstance(value, str):
+        return encode_basestring_ascii
+    if isinstance(value, bool):
+        return _encode_bool
+    if isinstance(value, int):
+        return int.__repr__
+    if isinstance(value, float):
+        return _encode_float
+    if isinstance(value, Decimal):
+        return _encode_quoted
+    if isinstance(value, (datetime, date)):
+        return _encode_isoformat
+    return _encode_any
+
+
+def _encode_column(values):
+    encoder = next((_column_encoder(value) for value in values
+                    if value is not None), None)
+    if encoder is None:
+        return ('null',) * len(values)
+    if None in values:
+        return ['null' if value is None else encoder(value)
+                for value in values]
+    return list(map(encoder, values))
+
+
+class RowSet:
+
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, columns, rows):
+        self.columns = tuple(columns)
+        self.rows = rows
+
+    @classmethod
+    def from_result(cls, result_proxy):
+        return cls(result_proxy.keys(), result_proxy.fetchall())
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RowSet(self.columns, self.rows[index])
+        return dict(zip(self.columns, self.rows[index]))
+
+    def __iter__(self):
+        columns = self.columns
+        for row in self.rows:
+            yield dict(zip(columns, row))
+
+    def column(self, name):
+        position = self.columns.index(name)
+        return [row[position] for row in self.rows]
+
+    def to_dicts(self):
+        return list(self)
+
+    def to_json(self):
+        if orjson is not None:
+            return dumps(self.to_dicts())
+        if not self.rows:
+            return b'[]'
+        encoded_columns = [_encode_column(values)
+                           for values in zip(*self.rows)]
+        template = '{' + ','.join(encode_basestring_ascii(column)
+                                  .replace('%', '%%') + ':%s'
+                                  for column in self.columns) + '}'
+        return ('[' + ','.join(map(template.__mod__, zip(*encoded_columns))) +
+                ']').encode()
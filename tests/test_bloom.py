@@ -0,0 +1,57 @@
+import unittest
+from bloom import BloomFilter
+
+
+class BloomFilterTest(unittest.TestCase):
+
+    def test_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        urls = ['https://oma.by/p/{}'.format(number)
+                for number in range(1000)]
+        for url in urls:
+            bloom.add(url)
+        self.assertTrue(all(url in bloom for url in urls))
+
+    def test_false_positive_rate_stays_near_target(self):
+        bloom = BloomFilter(5000, 0.01)
+        for number in range(5000):
+            bloom.add('https://oma.by/p/{}'.format(number))
+        false_positives = sum('https://oma.by/q/{}'.format(number) in bloom
+                              for number in range(20000))
+        self.assertLess(false_positives / 20000, 0.03)
+
+    def test_add_reports_new_items(self):
+        bloom = BloomFilter(100)
+        self.assertTrue(bloom.add('https://oma.by/p/1'))
+        self.assertFalse(bloom.add('https://oma.by/p/1'))
+        self.assertEqual(len(bloom), 1)
+
+    def test_empty_filter_contains_nothing(self):
+        bloom = BloomFilter(100)
+        self.assertNotIn('https://oma.by/p/1', bloom)
+        self.assertNotIn('', bloom)
+        self.assertEqual(len(bloom), 0)
+
+    def test_handles_non_ascii_items(self):
+        bloom = BloomFilter(10)
+        bloom.add('https://oma.by/каталог/дюбель')
+        self.assertIn('https://oma.by/каталог/дюбель', bloom)
+
+    def test_size_follows_capacity_and_error_rate(self):
+        small = BloomFilter(1000, 0.01)
+        self.assertGreater(BloomFilter(10000, 0.01).size_bytes,
+                           small.size_bytes)
+        self.assertGreater(BloomFilter(1000, 0.0001).size_bytes,
+                           small.size_bytes)
+        self.assertGreaterEqual(BloomFilter(1, 0.5).size_bytes, 1)
+
+    def test_rejects_invalid_parameters(self):
+        for capacity, error_rate in ((0, 0.01), (-5, 0.01), (10, 0),
+                                     (10, 1), (10, 1.5)):
+            with self.subTest(capacity=capacity, error_rate=error_rate):
+                with self.assertRaises(ValueError):
+                    BloomFilter(capacity, error_rate)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import unittest
+
+
+TEST_DB = os.environ.get('OMA_TEST_DB')
+CATALOG_TREE = [
+                {'name': 'Tools', 'subcategories': [
+                    {'name': 'Hand tools', 'subcategories': [
+                        {'name': 'Hammers', 'url': 'https://oma.by/hammers'},
+                        {'name': 'Sale', 'url': 'https://oma.by/sale'}]}]},
+                {'name': 'Garden', 'subcategories': [
+                    {'name': 'Garden tools', 'subcategories': [
+                        {'name': 'Shovels',
+                         'url': 'https://oma.by/shovels'}]}]},
+                ]
+
+
+def _product(url, subcat_lvl2_id, characteristics):
+    return {'url': url, 'subcat_lvl2_id': subcat_lvl2_id, 'name': url,
+            'price': 10, 'product_units': None, 'description': None,
+            'image_url': None, 'is_trend': False,
+            'characteristics': characteristics}
+
+
+@unittest.skipIf(TEST_DB is None, 'set OMA_TEST_DB to a scratch database')
+class CrossListedProductTest(unittest.TestCase):
+
+    property_storage = 'eav'
+
+    def setUp(self):
+        from db_connect import Postgres_db
+        self.db = Postgres_db(TEST_DB, property_storage=self.property_storage)
+        try:
+            self.db.drop_existing_tables_from_db()
+        except Exception:
+            pass
+        self.db.create_tables()
+        self.db.migrate()
+        self.db.catalog_tree_insert(CATALOG_TREE)
+        subcats = self.db.get_subcats_lvl2_ids_by_name(
+                                    ['Hammers', 'Sale', 'Shovels'])
+        categories = dict(self.db._query("""SELECT name, id
+                                            FROM categories;""").fetchall())
+        self.tools = categories['Tools']
+        self.garden = categories['Garden']
+        url = 'https://oma.by/p/multi-tool'
+        [(_, self.product_id, _)] = self.db.products_bulk_upsert(
+                        [_product(url, subcats['Hammers'],
+                                  {'Material': 'steel'})])
+        self.db.products_bulk_upsert([_product(url, subcats['Sale'],
+                                               {'Material': 'steel'})])
+        self.db.products_bulk_upsert([_product(url, subcats['Shovels'],
+                                               {'Material': 'steel'})])
+        self.db.products_bulk_upsert([_product('https://oma.by/p/rake',
+                                               subcats['Shovels'],
+                                               {'Material': 'wood'})])
+        self.db.refresh_category_facets()
+        self.subcats = subcats
+
+    def tearDown(self):
+        self.db.drop_existing_tables_from_db()
+        self.db.close()
+
+    def _filtered_ids(self, **filters):
+        return [row['id'] for row in self.db.filter_products(**filters)]
+
+    def test_filter_finds_product_in_every_category(self):
+        self.assertEqual(self._filtered_ids(category_id=self.tools),
+                         [self.product_id])
+        self.assertIn(self.product_id,
+                      self._filtered_ids(category_id=self.garden))
+        self.assertEqual(len(self._filtered_ids(category_id=self.garden)), 2)
+
+    def test_export_includes_product_in_every_category(self):
+        for category_id in (self.tools, self.garden):
+            rows = [row for batch in self.db.stream_products(
+                                                category_id=category_id)
+                    for row in batch]
+            self.assertIn(self.product_id, [row[0] for row in rows])
+            self.assertEqual(len(rows), len(set(row[0] for row in rows)))
+
+    def test_category_facets_count_product_once(self):
+        self.assertEqual(self.db.get_facet_counts(category_id=self.tools),
+                         {'Material': {'steel': 1}})
+        self.assertEqual(self.db.get_facet_counts(category_id=self.garden),
+                         {'Material': {'steel': 1, 'wood': 1}})
+
+    def test_filtered_facets_count_product_once(self):
+        self.assertEqual(self.db.get_facet_counts(category_id=self.tools,
+                                                  price_min=0),
+                         {'Material': {'steel': 1}})
+        self.assertEqual(self.db.get_facet_counts(),
+                         {'Material': {'steel': 1, 'wood': 1}})
+
+    def test_new_listing_marks_category_dirty(self):
+        self.db.products_bulk_upsert([_product('https://oma.by/p/rake',
+                                               self.subcats['Sale'],
+                                               {'Material': 'wood'})])
+        self.db.refresh_category_facets()
+        self.assertEqual(self.db.get_facet_counts(category_id=self.tools),
+                         {'Material': {'steel': 1, 'wood': 1}})
+
+
+class CompactCrossListedProductTest(CrossListedProductTest):
+
+    property_storage = 'jsonb'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import unittest
+from sqlalchemy import text
+
+
+TEST_DB = os.environ.get('OMA_TEST_DB')
+CATALOG_TREE = [
+                {'name': 'Tools', 'subcategories': [
+                    {'name': 'Hand tools', 'subcategories': [
+                        {'name': 'Hammers', 'url': 'https://oma.by/hammers'},
+                        {'name': 'Saws', 'url': 'https://oma.by/saws'},
+                        {'name': 'Sale', 'url': 'https://oma.by/sale'}]}]},
+                ]
+
+
+@unittest.skipIf(TEST_DB is None, 'set OMA_TEST_DB to a scratch database')
+class ClaimTest(unittest.TestCase):
+
+    def setUp(self):
+        from db_connect import Postgres_db
+        self.db = Postgres_db(TEST_DB)
+        try:
+            self.db.drop_existing_tables_from_db()
+        except Exception:
+            pass
+        self.db.create_tables()
+        self.db.migrate()
+        self.db.catalog_tree_insert(CATALOG_TREE)
+        self.subcats = self.db.get_subcats_lvl2_ids_by_name(
+                                            ['Hammers', 'Saws', 'Sale'])
+        self.db.products_bulk_insert(self.subcats['Hammers'],
+                                     ['https://oma.by/p/{}'.format(number)
+                                      for number in range(4)])
+
+    def tearDown(self):
+        self.db.drop_existing_tables_from_db()
+        self.db.close()
+
+    def _claimed_ids(self, entries):
+        return sorted(entry['id'] for entry in entries)
+
+    def test_workers_do_not_share_lvl2_entries(self):
+        first = self.db.claim_unparsed_subcat_lvl2_entries('a', 2)
+        second = self.db.claim_unparsed_subcat_lvl2_entries('b', 2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertEqual(self._claimed_ids(first + second),
+                         sorted(self.subcats.values()))
+
+    def test_empty_claims(self):
+        self.db.claim_unparsed_subcat_lvl2_entries('a', 10)
+        self.db.claim_unparsed_product_entries('a', 10)
+        self.assertEqual(self.db.claim_unparsed_subcat_lvl2_entries('b', 10),
+                         [])
+        self.assertEqual(self.db.claim_unparsed_product_entries('b', 10), [])
+        self.assertEqual(self.db.claim_unparsed_product_entries('c', 0), [])
+
+    def test_expired_leases_can_be_claimed_again(self):
+        claimed = self.db.claim_unparsed_product_entries('a', 2,
+                                                         lease_seconds=-1)
+        reclaimed = self.db.claim_unparsed_product_entries('b', 10)
+        self.assertEqual(len(reclaimed), 4)
+        self.assertTrue(set(self._claimed_ids(claimed)) <=
+                        set(self._claimed_ids(reclaimed)))
+
+    def test_workers_do_not_share_products(self):
+        first = self.db.claim_unparsed_product_entries('a', 3)
+        second = self.db.claim_unparsed_product_entries('b', 3)
+        self.assertEqual(len(first + second), 4)
+        self.assertFalse(set(self._claimed_ids(first)) &
+                         set(self._claimed_ids(second)))
+
+    def test_deleted_entries_are_not_claimed(self):
+        self.db.remove_subcat_lvl2_entry(self.subcats['Sale'])
+        [product] = self.db.claim_unparsed_product_entries('a', 1,
+                                                           lease_seconds=-1)
+        self.db.remove_entry_from_product_table(product['id'])
+        self.assertNotIn(self.subcats['Sale'], self._claimed_ids(
+                    self.db.claim_unparsed_subcat_lvl2_entries('b', 10)))
+        self.assertNotIn(product['id'], self._claimed_ids(
+                    self.db.claim_unparsed_product_entries('b', 10)))
+
+    def test_failing_lvl2_entry_backs_off_and_retires(self):
+        entry_id = self.subcats['Saws']
+        for attempt in range(3):
+            self.db.lvl2_entry_update_fetch_error(entry_id, 503,
+                                                  max_fetch_errors=3,
+                                                  backoff_seconds=0,
+                                                  max_backoff_seconds=0)
+            claimed = self._claimed_ids(
+                        self.db.claim_unparsed_subcat_lvl2_entries('a', 10))
+            self.assertEqual(entry_id in claimed, attempt < 2)
+            self.db._query("""UPDATE subcategories_lvl2 SET
+                              lease_expires_at=NULL
+                              WHERE parsed_at IS NULL;""")
+        row = self.db._query(text("""SELECT fetch_errors, fetch_error_code,
+                                     parsed_at IS NOT NULL
+                                     FROM subcategories_lvl2
+                                     WHERE id=:entry_id;""").
+                             bindparams(entry_id=entry_id)).fetchone()
+        self.assertEqual(tuple(row), (3, 503, True))
+
+    def test_backoff_delays_the_next_claim(self):
+        entry_id = self.subcats['Saws']
+        self.db.lvl2_entry_update_fetch_error(entry_id, 500)
+        self.assertNotIn(entry_id, self._claimed_ids(
+                    self.db.claim_unparsed_subcat_lvl2_entries('a', 10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import threading
+import time
+import unittest
+from fetcher import AsyncFetcher
+
+
+class ConcurrencyProbe:
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peak = {}
+        self.peak_total = 0
+
+    def __call__(self, url):
+        host = url.split('/')[2]
+        with self.lock:
+            self.running[host] = self.running.get(host, 0) + 1
+            self.peak[host] = max(self.peak.get(host, 0), self.running[host])
+            self.peak_total = max(self.peak_total,
+                                  sum(self.running.values()))
+        time.sleep(self.delay)
+        with self.lock:
+            self.running[host] -= 1
+        if url.endswith('/fail'):
+            raise ValueError(url)
+        return url.upper()
+
+
+class AsyncFetcherTest(unittest.TestCase):
+
+    def _run(self, fetcher, items):
+        results = []
+        fetcher.run(fetcher.fetch, items,
+                    lambda item, result, error: results.append(
+                                                    (item, result, error)))
+        return results
+
+    def test_calls_back_with_results_and_errors(self):
+        fetcher = AsyncFetcher(ConcurrencyProbe(delay=0))
+        results = self._run(fetcher, ['http://a/1', 'http://a/fail',
+                                      'http://b/2'])
+        self.assertEqual(len(results), 3)
+        by_item = {item: (result, error) for item, result, error in results}
+        self.assertEqual(by_item['http://a/1'], ('HTTP://A/1', None))
+        self.assertEqual(by_item['http://b/2'], ('HTTP://B/2', None))
+        self.assertIsNone(by_item['http://a/fail'][0])
+        self.assertIsInstance(by_item['http://a/fail'][1], ValueError)
+
+    def test_respects_the_per_host_limit(self):
+        probe = ConcurrencyProbe()
+        fetcher = AsyncFetcher(probe, concurrency=10, per_host_limit=2)
+        self._run(fetcher, ['http://a/{}'.format(number)
+                            for number in range(8)])
+        self.assertEqual(probe.peak['a'], 2)
+
+    def test_respects_the_global_limit(self):
+        probe = ConcurrencyProbe()
+        fetcher = AsyncFetcher(probe, concurrency=3, per_host_limit=3)
+        self._run(fetcher, ['http://{}/{}'.format(host, number)
+                            for host in 'abcd' for number in range(3)])
+        self.assertEqual(probe.peak_total, 3)
+
+    def test_can_run_more_than_once(self):
+        fetcher = AsyncFetcher(ConcurrencyProbe(delay=0))
+        self.assertEqual(len(self._run(fetcher, ['http://a/1'])), 1)
+        self.assertEqual(len(self._run(fetcher, ['http://a/2'])), 1)
+
+    def test_empty_items(self):
+        fetcher = AsyncFetcher(ConcurrencyProbe())
+        self.assertEqual(self._run(fetcher, []), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
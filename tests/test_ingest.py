@@ -0,0 +1,159 @@
+import unittest
+from decimal import Decimal
+from ingest import ingest_products, parse_ndjson, validate_product
+
+
+def _item(**fields):
+    item = {'url': 'https://oma.by/p/1', 'name': 'Hammer', 'parent': 'Tools'}
+    item.update(fields)
+    return item
+
+
+class FakeDb:
+
+    def __init__(self, subcats=None, fail=False):
+        self.subcats = subcats or {'Tools': 7}
+        self.fail = fail
+        self.urls = {}
+        self.upserts = []
+
+    def get_subcats_lvl2_ids_by_name(self, names):
+        return {name: self.subcats[name] for name in names
+                if name in self.subcats}
+
+    def get_existing_subcat_lvl2_ids(self, ids):
+        return set(ids) & set(self.subcats.values())
+
+    def products_bulk_upsert(self, products):
+        if self.fail:
+            raise RuntimeError('database is down')
+        self.upserts.append(products)
+        upserted = []
+        for product in products:
+            status = 'updated' if product['url'] in self.urls else 'created'
+            self.urls.setdefault(product['url'], len(self.urls) + 1)
+            upserted.append((product['url'], self.urls[product['url']],
+                             status))
+        return upserted
+
+
+class ValidateProductTest(unittest.TestCase):
+
+    def test_normalizes_a_valid_product(self):
+        product = validate_product(_item(url='HTTPS://Oma.by//p/1?utm_source=x',
+                                         price=12.5, is_trend=True,
+                                         characteristics={'Color': 'red'}))
+        self.assertEqual(product['url'], 'https://oma.by/p/1')
+        self.assertEqual(product['price'], Decimal('12.5'))
+        self.assertEqual(product['characteristics'], {'Color': 'red'})
+        self.assertIsNone(product['subcat_lvl2_id'])
+        self.assertIsNone(product['description'])
+
+    def test_defaults(self):
+        product = validate_product(_item())
+        self.assertIsNone(product['price'])
+        self.assertIsNone(product['is_trend'])
+        self.assertEqual(product['characteristics'], {})
+
+    def test_subcat_lvl2_id_makes_parent_optional(self):
+        item = _item(subcat_lvl2_id=3)
+        del item['parent']
+        self.assertEqual(validate_product(item)['subcat_lvl2_id'], 3)
+
+    def test_rejects_invalid_products(self):
+        cases = {
+                 'not an object': ['https://oma.by/p/1'],
+                 'missing url': {'name': 'Hammer', 'parent': 'Tools'},
+                 'blank url': _item(url='  '),
+                 'long url': _item(url='https://oma.by/' + 'x' * 300),
+                 'bad port': _item(url='https://oma.by:bad/p/1'),
+                 'missing name': {'url': 'https://oma.by/p/1',
+                                  'parent': 'Tools'},
+                 'name not a string': _item(name=5),
+                 'no parent': {'url': 'https://oma.by/p/1', 'name': 'x'},
+                 'bool subcat id': _item(subcat_lvl2_id=True),
+                 'float subcat id': _item(subcat_lvl2_id=1.5),
+                 'string subcat id': _item(subcat_lvl2_id='3'),
+                 'string price': _item(price='cheap'),
+                 'bool price': _item(price=True),
+                 'negative price': _item(price=-1),
+                 'price too high': _item(price=10000),
+                 'infinite price': _item(price=float('inf')),
+                 'nan price': _item(price=float('nan')),
+                 'string is_trend': _item(is_trend='yes'),
+                 'list characteristics': _item(characteristics=['a']),
+                 'nested characteristics': _item(
+                                        characteristics={'a': {'b': 'c'}}),
+                 'numeric characteristic': _item(characteristics={'a': 1}),
+                 'description not a string': _item(description=['x']),
+                 }
+        for name, item in cases.items():
+            with self.subTest(case=name):
+                with self.assertRaises(ValueError):
+                    validate_product(item)
+
+
+class ParseNdjsonTest(unittest.TestCase):
+
+    def test_skips_blank_lines_and_reports_bad_json(self):
+        items = list(parse_ndjson([b'{"a": 1}\n', b'\n', '  ', b'{oops\n',
+                                   '{"b": "\xd1\x8f"}'.encode('latin-1')]))
+        self.assertEqual(items[0], {'a': 1})
+        self.assertIsInstance(items[1], ValueError)
+        self.assertEqual(items[2], {'b': 'я'})
+        self.assertEqual(len(items), 3)
+
+
+class IngestProductsTest(unittest.TestCase):
+
+    def test_reports_a_result_per_item_in_order(self):
+        db = FakeDb()
+        results = ingest_products(db, [
+                                       _item(),
+                                       {'url': 'https://oma.by/p/2',
+                                        'parent': 'Tools'},
+                                       _item(url='https://oma.by/p/3',
+                                             parent='Garden'),
+                                       _item(url='https://oma.by/p/4',
+                                             subcat_lvl2_id=99),
+                                       _item(url='https://oma.by/p/5',
+                                             subcat_lvl2_id=7),
+                                       _item(),
+                                       ], chunk_size=2)
+        self.assertEqual([result['index'] for result in results],
+                         list(range(6)))
+        self.assertEqual([result['status'] for result in results],
+                         ['created', 'invalid', 'invalid', 'invalid',
+                          'created', 'updated'])
+        self.assertEqual(results[1]['error'], 'name is required')
+        self.assertEqual(results[2]['error'], 'unknown parent Garden')
+        self.assertEqual(results[3]['error'], 'unknown subcat_lvl2_id 99')
+        self.assertEqual(results[0]['id'], results[5]['id'])
+        self.assertTrue(all(len(products) <= 2 for products in db.upserts))
+
+    def test_resolves_parent_names(self):
+        db = FakeDb()
+        ingest_products(db, [_item()])
+        self.assertEqual(db.upserts[0][0]['subcat_lvl2_id'], 7)
+
+    def test_marks_the_chunk_as_error_when_the_write_fails(self):
+        results = ingest_products(FakeDb(fail=True),
+                                  [_item(), _item(url='https://oma.by/p/2'),
+                                   _item(name='')])
+        self.assertEqual([result['status'] for result in results],
+                         ['error', 'error', 'invalid'])
+
+    def test_invalid_json_lines(self):
+        results = ingest_products(FakeDb(), parse_ndjson([b'{oops']))
+        self.assertEqual(results, [{'index': 0, 'url': None,
+                                    'status': 'invalid',
+                                    'error': 'invalid JSON'}])
+
+    def test_empty_input(self):
+        db = FakeDb()
+        self.assertEqual(ingest_products(db, []), [])
+        self.assertEqual(db.upserts, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
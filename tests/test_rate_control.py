@@ -0,0 +1,183 @@
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from parse import Parser
+from rate_control import AIMDController, RetryPolicy, parse_retry_after
+
+
+class ParseRetryAfterTest(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after('120'), 120.0)
+        self.assertEqual(parse_retry_after(' 5 '), 5.0)
+
+    def test_http_date(self):
+        now = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        value = format_datetime(now + timedelta(seconds=30), usegmt=True)
+        self.assertEqual(parse_retry_after(value, now=now), 30.0)
+
+    def test_past_date_means_no_wait(self):
+        now = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        value = format_datetime(now - timedelta(hours=1), usegmt=True)
+        self.assertEqual(parse_retry_after(value, now=now), 0.0)
+
+    def test_missing_or_invalid(self):
+        for value in (None, '', 'soon', '-5', '1.5'):
+            with self.subTest(value=value):
+                self.assertIsNone(parse_retry_after(value))
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_retries_transient_statuses_until_the_limit(self):
+        policy = RetryPolicy(max_retries=2)
+        for status in (None, 429, 500, 502, 503, 504):
+            with self.subTest(status=status):
+                self.assertTrue(policy.should_retry(0, status))
+                self.assertTrue(policy.should_retry(1, status))
+                self.assertFalse(policy.should_retry(2, status))
+        for status in (200, 301, 404):
+            with self.subTest(status=status):
+                self.assertFalse(policy.should_retry(0, status))
+
+    def test_backoff_is_capped(self):
+        policy = RetryPolicy(backoff_base=0.5, backoff_max=4.0)
+        for attempt in range(10):
+            delay = policy.delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(4.0, 0.5 * 2 ** attempt))
+
+    def test_retry_after_wins_but_is_capped(self):
+        policy = RetryPolicy(backoff_max=10.0)
+        self.assertEqual(policy.delay(0, retry_after=3.0), 3.0)
+        self.assertEqual(policy.delay(0, retry_after=60.0), 10.0)
+
+
+class AIMDControllerTest(unittest.TestCase):
+
+    def _complete(self, controller, status=200, latency=0.01, count=1):
+        for _ in range(count):
+            started = controller.acquire()
+            controller.release(started, status, latency)
+
+    def test_initial_limit_is_clamped(self):
+        self.assertEqual(AIMDController(initial=50, maximum=8).limit, 8)
+        self.assertEqual(AIMDController(initial=0, minimum=2).limit, 2)
+
+    def test_increases_after_a_full_window_of_successes(self):
+        controller = AIMDController(initial=2, maximum=4, window=5)
+        self._complete(controller, count=4)
+        self.assertEqual(controller.limit, 2)
+        self._complete(controller)
+        self.assertEqual(controller.limit, 3)
+        self._complete(controller, count=20)
+        self.assertEqual(controller.limit, 4)
+
+    def test_throttling_halves_the_limit_down_to_the_minimum(self):
+        controller = AIMDController(initial=8, minimum=2, maximum=8)
+        self._complete(controller, status=429)
+        self.assertEqual(controller.limit, 4)
+        self._complete(controller, status=503)
+        self._complete(controller, status=429)
+        self.assertEqual(controller.limit, 2)
+
+    def test_one_cut_for_requests_started_before_the_last_cut(self):
+        controller = AIMDController(initial=8, maximum=8)
+        tickets = [controller.acquire() for _ in range(4)]
+        for ticket in tickets:
+            controller.release(ticket, 429, 0.01)
+        self.assertEqual(controller.limit, 4)
+        self.assertEqual(controller.stats()['decreases'], 1)
+
+    def test_error_rate_above_threshold_cuts(self):
+        controller = AIMDController(initial=4, maximum=8, window=10,
+                                    error_threshold=0.1)
+        self._complete(controller, count=8)
+        self._complete(controller, status=500, count=2)
+        self.assertEqual(controller.limit, 2)
+
+    def test_rising_latency_cuts(self):
+        controller = AIMDController(initial=4, maximum=8, window=100,
+                                    latency_smoothing=1.0)
+        self._complete(controller, latency=0.01, count=5)
+        self._complete(controller, latency=1.0)
+        self.assertEqual(controller.limit, 2)
+
+    def test_acquire_blocks_at_the_limit(self):
+        controller = AIMDController(initial=1, maximum=1)
+        ticket = controller.acquire()
+        acquired = threading.Event()
+        waiter = threading.Thread(target=lambda: (controller.acquire(),
+                                                  acquired.set()))
+        waiter.start()
+        self.assertFalse(acquired.wait(0.1))
+        controller.release(ticket, 200, 0.01)
+        self.assertTrue(acquired.wait(1))
+        waiter.join()
+
+    def test_retry_after_pauses_new_requests(self):
+        controller = AIMDController(initial=2, maximum=2)
+        started = controller.acquire()
+        controller.release(started, 429, 0.01, retry_after=0.2)
+        before = time.monotonic()
+        controller.release(controller.acquire(), 200, 0.01)
+        self.assertGreaterEqual(time.monotonic() - before, 0.15)
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeSession:
+
+    def __init__(self, outcome):
+        self._outcome = outcome
+
+    def get(self, url, headers=None, timeout=None):
+        if isinstance(self._outcome, Exception):
+            raise self._outcome
+        return self._outcome
+
+
+class FetchSlotReleaseTest(unittest.TestCase):
+
+    def _parser(self, outcome):
+        controller = AIMDController(initial=2, maximum=2)
+        parser = Parser(rate_controller=controller)
+        parser._session = FakeSession(outcome)
+        return parser, controller
+
+    def test_releases_after_a_response(self):
+        parser, controller = self._parser(FakeResponse(429,
+                                                       {'Retry-After': '0'}))
+        response, status, retry_after, error = parser._fetch_once(
+                                                    'https://oma.by/x')
+        self.assertEqual((status, retry_after, error), (429, 0.0, None))
+        self.assertEqual(controller.stats()['in_flight'], 0)
+        self.assertEqual(controller.stats()['statuses'], {'429': 1})
+
+    def test_releases_after_a_request_exception(self):
+        parser, controller = self._parser(RequestsConnectionError('refused'))
+        response, status, retry_after, error = parser._fetch_once(
+                                                    'https://oma.by/x')
+        self.assertIsNone(response)
+        self.assertIsInstance(error, RequestsConnectionError)
+        self.assertEqual(controller.stats()['in_flight'], 0)
+        self.assertEqual(controller.stats()['statuses'], {'error': 1})
+
+    def test_releases_after_an_unexpected_exception(self):
+        parser, controller = self._parser(ValueError('boom'))
+        with self.assertRaises(ValueError):
+            parser._fetch_once('https://oma.by/x')
+        self.assertEqual(controller.stats()['in_flight'], 0)
+        self.assertEqual(controller.stats()['statuses'], {'error': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import json
+import unittest
+from datetime import date, datetime
+from decimal import Decimal
+from unittest import mock
+import serialize
+from serialize import RowSet, dumps
+
+
+COLUMNS = ('id', 'name', 'price', 'score', 'in_stock', 'parsed_at', 'extra')
+ROWS = [
+        (1, 'Дюбель "8x40"', Decimal('2.50'), 1.5, True,
+         datetime(2020, 1, 1, 2, 3, 4), {'a': [1, 2]}),
+        (2, None, None, float('nan'), False, date(2020, 1, 2), None),
+        (3, 'x', Decimal('0'), float('inf'), None, None, {'b': -float('inf')}),
+        ]
+EXPECTED = [
+            {'id': 1, 'name': 'Дюбель "8x40"', 'price': '2.50', 'score': 1.5,
+             'in_stock': True, 'parsed_at': '2020-01-01T02:03:04',
+             'extra': {'a': [1, 2]}},
+            {'id': 2, 'name': None, 'price': None, 'score': None,
+             'in_stock': False, 'parsed_at': '2020-01-02', 'extra': None},
+            {'id': 3, 'name': 'x', 'price': '0', 'score': None,
+             'in_stock': None, 'parsed_at': None, 'extra': {'b': None}},
+            ]
+
+
+def _reject_constant(name):
+    raise ValueError('{} is not valid JSON'.format(name))
+
+
+def _loads(encoded):
+    return json.loads(encoded, parse_constant=_reject_constant)
+
+
+def _encoders():
+    encoders = [('json', None)]
+    if serialize.orjson is not None:
+        encoders.append(('orjson', serialize.orjson))
+    return encoders
+
+
+class SerializeTest(unittest.TestCase):
+
+    def test_dumps_writes_valid_json_with_both_encoders(self):
+        for name, module in _encoders():
+            with self.subTest(encoder=name), \
+                    mock.patch.object(serialize, 'orjson', module):
+                encoded = dumps({'rows': EXPECTED, 'nan': float('nan')})
+                self.assertEqual(_loads(encoded),
+                                 {'rows': EXPECTED, 'nan': None})
+
+    def test_row_set_to_json_matches_to_dicts(self):
+        row_set = RowSet(COLUMNS, ROWS)
+        for name, module in _encoders():
+            with self.subTest(encoder=name), \
+                    mock.patch.object(serialize, 'orjson', module):
+                self.assertEqual(_loads(row_set.to_json()), EXPECTED)
+
+    def test_empty_row_set(self):
+        for name, module in _encoders():
+            with self.subTest(encoder=name), \
+                    mock.patch.object(serialize, 'orjson', module):
+                self.assertEqual(_loads(RowSet(COLUMNS, []).to_json()),
+                                 [])
+
+    def test_all_null_column(self):
+        row_set = RowSet(('id', 'name'), [(1, None), (2, None)])
+        with mock.patch.object(serialize, 'orjson', None):
+            self.assertEqual(_loads(row_set.to_json()),
+                             [{'id': 1, 'name': None},
+                              {'id': 2, 'name': None}])
+
+    def test_row_set_access(self):
+        row_set = RowSet(COLUMNS, ROWS)
+        self.assertEqual(len(row_set), 3)
+        self.assertEqual(row_set[0]['id'], 1)
+        self.assertEqual(row_set[1:].column('id'), [2, 3])
+        self.assertEqual([row['id'] for row in row_set], [1, 2, 3])
+
+    def test_unknown_type_raises(self):
+        for name, module in _encoders():
+            with self.subTest(encoder=name), \
+                    mock.patch.object(serialize, 'orjson', module):
+                with self.assertRaises(TypeError):
+                    dumps({'value': object()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+TRACKING_PARAMETER_PREFIXES = ('utm_', 'gclid', 'yclid', 'fbclid',
+                               '_openstat')
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+REPEATED_SLASHES = re.compile('/{2,}')
+
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname or ''
+    if parts.port is not None and DEFAULT_PORTS.get(scheme) != parts.port:
+        netloc = '{}:{}'.format(netloc, parts.port)
+    if parts.username is not None:
+        netloc = '{}@{}'.format(parts.netloc.rsplit('@', 1)[0], netloc)
+    path = REPEATED_SLASHES.sub('/', parts.path)
+    if netloc and not path:
+        path = '/'
+    query = urlencode(sorted((name, value) for name, value in
+                             parse_qsl(parts.query, keep_blank_values=True)
+                             if not name.lower().startswith(
+                                        TRACKING_PARAMETER_PREFIXES)))
+    return urlunsplit((scheme, netloc, path, query, ''))